@@ -7,6 +7,8 @@ import os
 
 import pmb.build
 import pmb.build.autodetect
+import pmb.build.cache
+import pmb.build.parallel
 import pmb.chroot
 import pmb.chroot.apk
 import pmb.helpers.pmaports
@@ -194,7 +196,8 @@ def is_necessary_warn_depends(args, apkbuild, arch, force, depends_built):
 
 
 def init_buildenv(args, apkbuild, arch, strict=False, force=False, cross=None,
-                  suffix="native", skip_init_buildenv=False, src=None):
+                  suffix="native", skip_init_buildenv=False, src=None,
+                  bootstrap_stage=BootstrapStage.NONE, overlay=False):
     """Build all dependencies.
 
     Check if we need to build at all (otherwise we've
@@ -207,6 +210,11 @@ def init_buildenv(args, apkbuild, arch, strict=False, force=False, cross=None,
                                something during initialization of the build
                                environment (e.g. qemu aarch64 bug workaround)
     :param src: override source used to build the package with a local folder
+    :param bootstrap_stage: don't use the packages of a previous build with
+                            the same inputs when set (see pmb.build.cache)
+    :param overlay: install abuild etc. in the chroot, then mount an overlay
+                    chroot on top of it and install the dependencies there
+                    (see pmb.chroot.mount_overlay())
     :returns: True when the build is necessary (otherwise False)
     """
 
@@ -221,6 +229,21 @@ def init_buildenv(args, apkbuild, arch, strict=False, force=False, cross=None,
     if not is_necessary_warn_depends(args, apkbuild, arch, force, built):
         return False
 
+    # Use the packages of a previous build with the same inputs
+    fingerprint = pmb.build.cache.fingerprint(args, apkbuild, arch, cross,
+                                              depends, depends_arch, src)
+    reuse = (not strict and "pmb:strict" not in apkbuild["options"] and
+             not bootstrap_stage and
+             ("build_cache" not in args or args.build_cache))
+    if pmb.build.cache.lookup(args, apkbuild, arch, fingerprint, suffix,
+                              reuse):
+        return False
+
+    # Install the common build packages below the overlay
+    if overlay:
+        pmb.build.init(args, suffix)
+        suffix = pmb.chroot.mount_overlay(args, suffix)
+
     # Install and configure abuild, ccache, gcc, dependencies
     if not skip_init_buildenv:
         pmb.build.init(args, suffix)
@@ -433,6 +456,12 @@ def run_abuild(args, apkbuild, arch, strict=False, force=False, cross=None,
     if bootstrap_stage:
         env["BOOTSTRAP"] = str(bootstrap_stage)
 
+    # Don't let abuild write and index the local repository while other
+    # packages get built at the same time
+    repodest = pmb.build.parallel.repodest()
+    if repodest:
+        env["REPODEST"] = repodest
+
     # Build the abuild command
     cmd = ["abuild", "-D", "postmarketOS"]
     if strict or "pmb:strict" in apkbuild["options"]:
@@ -449,23 +478,29 @@ def run_abuild(args, apkbuild, arch, strict=False, force=False, cross=None,
     pmb.build.copy_to_buildpath(args, apkbuild["pkgname"], suffix)
     override_source(args, apkbuild, pkgver, src, suffix)
     link_to_git_dir(args, suffix)
+    if repodest:
+        pmb.chroot.user(args, ["rm", "-rf", repodest], suffix)
     pmb.chroot.user(args, cmd, suffix, "/home/pmos/build", env=env)
     return (output, cmd, env)
 
 
 def finish(args, apkbuild, arch, output, strict=False, suffix="native"):
     """Various finishing tasks that need to be done after a build."""
-    # Verify output file
-    channel = pmb.config.pmaports.read_config(args)["channel"]
-    path = f"{args.work}/packages/{channel}/{output}"
-    if not os.path.exists(path):
-        raise RuntimeError("Package not found after build: " + path)
-
-    # Clear APKINDEX cache (we only parse APKINDEX files once per session and
-    # cache the result for faster dependency resolving, but after we built a
-    # package we need to parse it again)
-    pmb.parse.apkindex.clear_cache(f"{args.work}/packages/{channel}"
-                                   f"/{arch}/APKINDEX.tar.gz")
+    with pmb.build.parallel.lock:
+        # Move the packages to the local repository (parallel builds)
+        pmb.build.parallel.merge(args, arch, suffix)
+
+        # Verify output file
+        channel = pmb.config.pmaports.read_config(args)["channel"]
+        path = f"{args.work}/packages/{channel}/{output}"
+        if not os.path.exists(path):
+            raise RuntimeError("Package not found after build: " + path)
+
+        # Clear APKINDEX cache (we only parse APKINDEX files once per session
+        # and cache the result for faster dependency resolving, but after we
+        # built a package we need to parse it again)
+        pmb.parse.apkindex.clear_cache(f"{args.work}/packages/{channel}"
+                                       f"/{arch}/APKINDEX.tar.gz")
 
     # Uninstall build dependencies (strict mode)
     if strict or "pmb:strict" in apkbuild["options"]:
@@ -520,16 +555,45 @@ def package(args, pkgname, arch=None, force=False, strict=False,
     if not check_build_for_arch(args, pkgname, arch):
         return
     suffix = pmb.build.autodetect.suffix(apkbuild, arch)
+    suffix = pmb.build.parallel.worker_suffix(suffix, arch)
     cross = pmb.build.autodetect.crosscompile(args, apkbuild, arch, suffix)
-    if not init_buildenv(args, apkbuild, arch, strict, force, cross, suffix,
-                         skip_init_buildenv, src):
-        return
 
+    # Build in an overlay chroot that gets discarded afterwards. Not with
+    # cross == "native", as the cross compilers get installed in the native
+    # chroot, which must not change below the overlay.
+    overlay = ("build_overlay" in args and args.build_overlay and
+               cross != "native" and not skip_init_buildenv)
+
+    pmb.build.cache.forget(apkbuild, arch)
     try:
-        # Build and finish up
-        (output, cmd, env) = run_abuild(args, apkbuild, arch, strict, force, cross,
-                                        suffix, src, bootstrap_stage)
-    except RuntimeError:
-        raise BuildFailedError(f"Build for {arch}/{pkgname} failed!")
-    finish(args, apkbuild, arch, output, strict, suffix)
+        with pmb.build.parallel.lock:
+            if not init_buildenv(args, apkbuild, arch, strict, force, cross,
+                                 suffix, skip_init_buildenv, src,
+                                 bootstrap_stage, overlay):
+                return pmb.build.cache.reused(apkbuild, arch)
+        suffix_build = pmb.chroot.overlay_suffix(suffix) if overlay \
+            else suffix
+
+        try:
+            # Build and finish up
+            (output, cmd, env) = run_abuild(args, apkbuild, arch, strict,
+                                            force, cross, suffix_build, src,
+                                            bootstrap_stage)
+        except RuntimeError:
+            raise BuildFailedError(f"Build for {arch}/{pkgname} failed!")
+        finish(args, apkbuild, arch, output, strict, suffix_build)
+    except BaseException:
+        # Don't hide the original error if discarding the overlay fails too
+        if overlay:
+            try:
+                pmb.chroot.umount_overlay(args,
+                                          pmb.chroot.overlay_suffix(suffix))
+            except Exception as e:
+                logging.warning("WARNING: Failed to discard the overlay"
+                                f" chroot: {e}")
+        raise
+    if overlay:
+        pmb.chroot.umount_overlay(args, pmb.chroot.overlay_suffix(suffix))
+    with pmb.build.parallel.lock:
+        pmb.build.cache.store(args, apkbuild, arch, output)
     return output
@@ -0,0 +1,189 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Skip builds whose inputs did not change since the last build.
+
+After a package was built, a fingerprint of everything that goes into the
+build is stored next to the apks in the local repository, as
+``$WORK/packages/$CHANNEL/$ARCH/$PKGNAME.fingerprint``. The first line is
+the fingerprint, the following lines are the apk files that the build
+created with their size and sha256 checksum. When the same package would be
+built again with the same fingerprint (e.g. with --force or --src) and the
+apks still exist unchanged, they are used instead.
+"""
+import hashlib
+import logging
+import os
+import shlex
+
+import pmb.chroot
+import pmb.config
+import pmb.config.pmaports
+import pmb.helpers.other
+import pmb.helpers.pmaports
+import pmb.parse.apkindex
+
+
+def _files(path, read, exclude=()):
+    """Get a list of all files in a folder, for fingerprint().
+
+    :param read: hash the content of each file, otherwise use its size and
+                 modification time (faster, for big source trees)
+    :param exclude: names of folders to skip
+    :returns: sorted list of (relpath, content_or_stat)
+    """
+    ret = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in exclude)
+        for file in files:
+            path_file = os.path.join(root, file)
+            if os.path.islink(path_file):
+                entry = os.readlink(path_file)
+            elif read:
+                with open(path_file, "rb") as handle:
+                    entry = hashlib.sha256(handle.read()).hexdigest()
+            else:
+                stat = os.stat(path_file)
+                entry = (stat.st_size, stat.st_mtime_ns)
+            ret.append((os.path.relpath(path_file, path), entry))
+    return sorted(ret)
+
+
+def fingerprint(args, apkbuild, arch, cross, depends, depends_arch,
+                src=None):
+    """Hash the inputs of a build.
+
+    :param apkbuild: from pmb.parse.apkbuild()
+    :param arch: architecture to build for
+    :param cross: None, "native", or "crossdirect"
+    :param depends: dependencies of the package, see get_depends()
+    :param depends_arch: architecture of the dependencies
+    :param src: override source used to build the package with a local
+                folder
+    :returns: hex string that changes when the aport, the versions of the
+              dependencies and build tools, the source folder or relevant
+              configuration changes
+    """
+    aport = pmb.helpers.pmaports.find(args, apkbuild["pkgname"])
+
+    versions = []
+    for depend in sorted(set(depends + pmb.config.build_packages)):
+        if depend.startswith("!"):
+            continue
+        package = pmb.parse.apkindex.package(args, depend, depends_arch,
+                                             False)
+        versions.append((depend, package["pkgname"], package["version"])
+                        if package else (depend, None, None))
+
+    data = {"arch": arch,
+            "cross": cross,
+            "aport": _files(aport, True),
+            "depends": versions,
+            "src": _files(src, False, [".git"]) if src else None,
+            "channel": pmb.config.pmaports.read_config(args)["channel"]}
+    return hashlib.sha256(repr(sorted(data.items())).encode()).hexdigest()
+
+
+def _apk_entry(path, apk, size=None):
+    """Get the line of an apk in the fingerprint file.
+
+    :param path: folder of the apk
+    :param apk: file name of the apk
+    :param size: skip calculating the checksum if the apk does not have this
+                 size (no need to read a big apk that is different anyway)
+    :returns: "$APK $SIZE $SHA256", or None if the apk does not exist
+    """
+    path_apk = f"{path}/{apk}"
+    if not os.path.exists(path_apk):
+        return None
+    size_apk = os.path.getsize(path_apk)
+    if size is not None and size != str(size_apk):
+        return f"{apk} {size_apk}"
+    with open(path_apk, "rb") as handle:
+        checksum = hashlib.sha256(handle.read()).hexdigest()
+    return f"{apk} {size_apk} {checksum}"
+
+
+def _path(args, pkgname, arch):
+    channel = pmb.config.pmaports.read_config(args)["channel"]
+    return f"{args.work}/packages/{channel}/{arch}/{pkgname}.fingerprint"
+
+
+def lookup(args, apkbuild, arch, fingerprint, suffix="native", reuse=True):
+    """Check if the packages of a previous build with the same fingerprint
+    can be used. Remember the fingerprint for store() and the result for
+    reused().
+
+    :param fingerprint: return value of fingerprint()
+    :param reuse: set to False to only remember the fingerprint
+    :returns: True if the packages of the previous build can be used
+    """
+    pkgname = apkbuild["pkgname"]
+    cache = pmb.helpers.other.cache["pmb.build.cache"]
+    cache[(pkgname, arch)] = {"fingerprint": fingerprint, "output": None}
+
+    path = _path(args, pkgname, arch)
+    if not reuse or not os.path.exists(path):
+        return False
+    with open(path, encoding="utf-8") as handle:
+        lines = handle.read().splitlines()
+    if len(lines) < 2 or lines[0] != fingerprint:
+        logging.verbose(f"{pkgname}: build inputs changed since last build")
+        return False
+    for line in lines[1:]:
+        apk, size = (line.split(" ") + [None])[:2]
+        entry = _apk_entry(os.path.dirname(path), apk, size)
+        if not entry:
+            logging.verbose(f"{pkgname}: build cache: {apk} was deleted")
+            return False
+        if entry != line:
+            logging.verbose(f"{pkgname}: build cache: {apk} was modified")
+            return False
+
+    output = f"{arch}/{lines[1].split(' ')[0]}"
+    cache[(pkgname, arch)]["output"] = output
+    logging.info(f"({suffix}) build {output}: cache hit, build inputs did"
+                 " not change")
+    return True
+
+
+def forget(apkbuild, arch):
+    """Forget what lookup() found for a previous build of the package, so
+    reused() and store() only use the result of the current build."""
+    pmb.helpers.other.cache["pmb.build.cache"].pop(
+        (apkbuild["pkgname"], arch), None)
+
+
+def reused(apkbuild, arch):
+    """:returns: output of the previous build ("x86_64/hello-1-r2.apk") if
+                 lookup() found that its packages can be used, else None"""
+    entry = pmb.helpers.other.cache["pmb.build.cache"].get(
+        (apkbuild["pkgname"], arch))
+    return entry["output"] if entry else None
+
+
+def store(args, apkbuild, arch, output):
+    """Store the fingerprint of a build next to the apks it created.
+
+    :param output: apk path relative to the package folder, as returned by
+                   run_abuild() ("x86_64/hello-1-r2.apk")
+    """
+    pkgname = apkbuild["pkgname"]
+    entry = pmb.helpers.other.cache["pmb.build.cache"].pop((pkgname, arch),
+                                                           None)
+    if not entry:
+        return
+
+    # Apks of the package and its subpackages, main package first
+    path = _path(args, pkgname, arch)
+    version = os.path.basename(output)[len(pkgname) + 1:-len(".apk")]
+    apks = [f"{subpkgname}-{version}.apk" for subpkgname in
+            [pkgname] + sorted(apkbuild["subpackages"].keys())]
+    apks = [_apk_entry(os.path.dirname(path), apk) for apk in apks]
+
+    # The local repository is written by the user of the native chroot
+    lines = " ".join(shlex.quote(line) for line in [entry["fingerprint"]] +
+                     [apk for apk in apks if apk])
+    shell_cmd = (f"printf '%s\\n' {lines} > "
+                 f"{shlex.quote(os.path.basename(path))}")
+    pmb.chroot.user(args, ["sh", "-c", shell_cmd],
+                    working_dir=f"/home/pmos/packages/pmos/{arch}")
@@ -11,35 +11,156 @@ import pmb.helpers.file
 import pmb.helpers.git
 import pmb.helpers.pmaports
 import pmb.helpers.run
+import pmb.helpers.run_core
 import pmb.parse.apkindex
 import pmb.parse.version
 
 
+# Maximum length of one "sh -c" script in copy_to_buildpath(), it must stay
+# below the length limit of a single argument (MAX_ARG_STRLEN, 128 KiB)
+script_max_len = 65536
+
+
+def _list_tree(path, follow_symlinks):
+    """List a folder recursively, for sync_commands(). With follow_symlinks,
+    symlinks to a folder that contains the symlink itself are skipped.
+
+    :returns: {relpath: (is_dir, size, mtime_ns), ...}
+    """
+    ret = {}
+    # (st_dev, st_ino) of each folder and its parent folders
+    parents = {}
+    for root, dirs, files in os.walk(path, followlinks=follow_symlinks):
+        if follow_symlinks:
+            stat = os.stat(root)
+            parents[root] = parents.get(os.path.dirname(root), set()) | \
+                {(stat.st_dev, stat.st_ino)}
+            for entry in list(dirs):
+                try:
+                    stat = os.stat(os.path.join(root, entry))
+                except OSError:
+                    continue
+                if (stat.st_dev, stat.st_ino) in parents[root]:
+                    logging.warning("WARNING: Not copying symlink loop: "
+                                    f"{os.path.join(root, entry)}")
+                    dirs.remove(entry)
+        for entry in dirs + files:
+            path_entry = os.path.join(root, entry)
+            try:
+                stat = os.stat(path_entry, follow_symlinks=follow_symlinks)
+            except OSError:
+                continue
+            relpath = os.path.relpath(path_entry, path)
+            ret[relpath] = (os.path.isdir(path_entry) and
+                            (follow_symlinks or
+                             not os.path.islink(path_entry)),
+                            stat.st_size, stat.st_mtime_ns)
+    return ret
+
+
+def _split_command(cmd, paths, max_len=script_max_len):
+    """Split a command with many paths into multiple commands, so each of
+    them fits into a "sh -c" script of copy_to_buildpath().
+
+    :param cmd: command without the paths, e.g. ["mkdir", "-p", "--"]
+    :param paths: list of paths to append to the command
+    :returns: list of commands
+    """
+    ret = []
+    length = 0
+    for path in paths:
+        # Half of max_len, so the command still fits after quoting
+        if not ret or length + len(path) > max_len // 2:
+            ret.append(list(cmd))
+            length = 0
+        ret[-1].append(path)
+        length += len(path) + 1
+    return ret
+
+
+def sync_commands(source, destination, exclude=()):
+    """Get the commands to make a folder a copy of another folder, with
+    resolved symlinks. Files with the same size and modification time in
+    both folders are skipped, files and folders that only exist in the
+    destination are deleted.
+
+    :param source: full path to the folder to copy
+    :param destination: full path to the copy
+    :param exclude: names of top level entries in source to skip
+    :returns: list of commands, e.g. [["rm", "-rf", "--", ...],
+              ["mkdir", "-p", "--", ...], ["cp", "-pL", "--", src, dst]]
+    """
+    wanted = {relpath: entry for relpath, entry in
+              _list_tree(source, True).items()
+              if relpath.split(os.sep, 1)[0] not in exclude}
+    existing = _list_tree(destination, False)
+
+    remove = []
+    for relpath, (is_dir, _, _) in sorted(existing.items()):
+        if relpath in wanted and wanted[relpath][0] == is_dir:
+            continue
+        if not any(relpath.startswith(f"{path}/") for path in remove):
+            remove.append(relpath)
+
+    mkdir = [destination]
+    copy = []
+    for relpath, entry in sorted(wanted.items()):
+        if entry[0]:
+            if relpath not in existing or relpath in remove:
+                mkdir.append(f"{destination}/{relpath}")
+        elif existing.get(relpath) != entry or relpath in remove:
+            copy.append(relpath)
+
+    ret = _split_command(["rm", "-rf", "--"],
+                         [f"{destination}/{relpath}" for relpath in remove])
+    ret += _split_command(["mkdir", "-p", "--"], mkdir)
+    for relpath in copy:
+        ret.append(["cp", "-pL", "--", f"{source}/{relpath}",
+                    f"{destination}/{relpath}"])
+    return ret
+
+
 def copy_to_buildpath(args, package, suffix="native"):
+    """Copy an aport to /home/pmos/build in a chroot, with resolved symlinks.
+
+    All of it runs in one privileged shell (or a few for big aports): files
+    of a previous build that are not in the aport are deleted, unchanged
+    files are kept and the folder gets owned by the pmos user.
+    """
     # Sanity check
     aport = pmb.helpers.pmaports.find(args, package)
     if not os.path.exists(aport + "/APKBUILD"):
         raise ValueError("Path does not contain an APKBUILD file:" +
                          aport)
 
-    # Clean up folder
-    build = args.work + "/chroot_" + suffix + "/home/pmos/build"
-    if os.path.exists(build):
-        pmb.chroot.root(args, ["rm", "-rf", "/home/pmos/build"], suffix)
-
-    # Copy aport contents with resolved symlinks
-    pmb.helpers.run.root(args, ["mkdir", "-p", build])
-    for entry in os.listdir(aport):
-        # Don't copy those dirs, as those have probably been generated by running `abuild`
-        # on the host system directly and not cleaning up after itself.
-        # Those dirs might contain broken symlinks and cp fails resolving them.
-        if entry in ["src", "pkg"]:
+    # Don't copy those dirs, as those have probably been generated by running
+    # `abuild` on the host system directly and not cleaning up after itself.
+    # Those dirs might contain broken symlinks and cp fails resolving them.
+    exclude = ["src", "pkg"]
+    for entry in exclude:
+        if os.path.exists(f"{aport}/{entry}"):
             logging.warn(f"WARNING: Not copying {entry}, looks like a leftover from abuild")
-            continue
-        pmb.helpers.run.root(args, ["cp", "-rL", f"{aport}/{entry}", f"{build}/{entry}"])
 
-    pmb.chroot.root(args, ["chown", "-R", "pmos:pmos",
-                           "/home/pmos/build"], suffix)
+    # Copy aport contents and fix the ownership (numeric uid:gid of the pmos
+    # user, as the host system doesn't know it)
+    chroot = args.work + "/chroot_" + suffix
+    build = chroot + "/home/pmos/build"
+    owner = pmb.config.chroot_uid_user
+    with open(f"{chroot}/etc/passwd", encoding="utf-8") as handle:
+        for line in handle:
+            if line.startswith("pmos:"):
+                owner = ":".join(line.split(":")[2:4])
+    commands = sync_commands(aport, build, exclude)
+    commands.append(["chown", "-R", owner, build])
+    scripts = []
+    for command in commands:
+        flat = pmb.helpers.run_core.flat_cmd(command)
+        if not scripts or len(scripts[-1]) + len(flat) > script_max_len:
+            scripts.append(flat)
+        else:
+            scripts[-1] += " && " + flat
+    for script in scripts:
+        pmb.helpers.run.root(args, ["sh", "-c", script])
 
 
 def is_necessary(args, arch, apkbuild, indexes=None):
@@ -88,11 +209,43 @@ def is_necessary(args, arch, apkbuild, indexes=None):
     return False
 
 
+def index_outdated(path):
+    """Check if the APKINDEX.tar.gz of a local repository needs to be written
+    again.
+
+    The index is up to date if it lists exactly the apks in the folder, and
+    none of them was modified after the index was written. This is the same
+    check that "apk index --index" does for each apk, to reuse its entry from
+    the old index instead of reading the apk again.
+
+    :param path: full path to the repository folder (e.g.
+                 "$WORK/packages/edge/x86_64")
+    :returns: True if the index needs to be written
+    """
+    path_index = f"{path}/APKINDEX.tar.gz"
+    if not os.path.exists(path_index):
+        return True
+
+    mtime_index = os.path.getmtime(path_index)
+    apks = set()
+    for path_apk in glob.glob(f"{path}/*.apk"):
+        if os.path.getmtime(path_apk) > mtime_index:
+            return True
+        apks.add(os.path.basename(path_apk))
+
+    indexed = {f"{block['pkgname']}-{block['version']}.apk"
+               for block in pmb.parse.apkindex.parse_blocks(path_index)}
+    return apks != indexed
+
+
 def index_repo(args, arch=None):
     """Recreate the APKINDEX.tar.gz for a specific repo, and clear the parsing
     cache for that file for the current pmbootstrap session (to prevent
     rebuilding packages twice, in case the rebuild takes less than a second).
 
+    Only new and changed apks are read, the entries of the others are taken
+    from the existing index. Nothing is done if the index is up to date.
+
     :param arch: when not defined, re-index all repos
     """
     pmb.build.init(args)
@@ -104,14 +257,21 @@ def index_repo(args, arch=None):
         paths = glob.glob(f"{args.work}/packages/{channel}/*")
 
     for path in paths:
-        if os.path.isdir(path):
+        if os.path.isdir(path) and not index_outdated(path):
+            logging.debug(f"(native) {os.path.basename(path)} repository"
+                          " index is up to date")
+        elif os.path.isdir(path):
             path_arch = os.path.basename(path)
             path_repo_chroot = "/home/pmos/packages/pmos/" + path_arch
             logging.debug("(native) index " + path_arch + " repository")
             description = str(datetime.datetime.now())
+            index_old = ""
+            if os.path.exists(f"{path}/APKINDEX.tar.gz"):
+                index_old = " --index APKINDEX.tar.gz"
             commands = [
                 # Wrap the index command with sh so we can use '*.apk'
-                ["sh", "-c", "apk -q index --output APKINDEX.tar.gz_"
+                ["sh", "-c", "apk -q index --output APKINDEX.tar.gz_" +
+                 index_old + ""
                  " --description " + shlex.quote(description) + ""
                  " --rewrite-arch " + shlex.quote(path_arch) + " *.apk"],
                 ["abuild-sign", "APKINDEX.tar.gz_"],
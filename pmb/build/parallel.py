@@ -0,0 +1,255 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Build multiple packages at the same time (``pmbootstrap build -j N``).
+
+Each worker builds in its own chroot: worker 0 uses the regular chroots, the
+other workers use buildroot_$ARCH-$N chroots (e.g. buildroot_aarch64-1).
+Preparing a build (initializing chroots, installing and building
+dependencies) changes chroots and repositories that the workers share, so it
+is done with the lock held. Only the abuild runs happen at the same time,
+abuild writes the packages to a folder of the worker (see repodest()) and
+they get moved to the local repository with the lock held afterwards.
+"""
+import contextlib
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+
+import pmb.build
+import pmb.build.autodetect
+import pmb.chroot
+import pmb.config
+import pmb.helpers.depgraph
+import pmb.helpers.mount
+import pmb.helpers.other
+import pmb.helpers.pmaports
+import pmb.helpers.run_core
+from pmb.helpers.exceptions import BuildFailedError
+
+# Number of the build worker in the current process, see worker_suffix()
+worker = 0
+
+# Held by workers while preparing a build, and by the scheduler while
+# indexing the local repository. While packages() is running, it is a
+# multiprocessing.RLock() shared by all workers.
+lock = contextlib.nullcontext()
+
+
+def worker_suffix(suffix, arch):
+    """Get the chroot suffix for building a package in the current worker.
+
+    :param suffix: chroot suffix from pmb.build.autodetect.suffix()
+    :param arch: architecture of the package
+    :returns: suffix for worker 0 and packages that get cross-compiled in
+              the native chroot, "buildroot_$ARCH-$N" otherwise
+    """
+    if not worker or needs_native_chroot(suffix, arch):
+        return suffix
+    return f"buildroot_{arch}-{worker}"
+
+
+def repodest():
+    """Get the folder that abuild writes packages to in the current worker.
+
+    abuild indexes that folder after each build, so the workers must not
+    use the local repository for it at the same time.
+
+    :returns: path inside the build chroot while packages() is running,
+              None when abuild writes to the local repository directly
+    """
+    if isinstance(lock, contextlib.nullcontext):
+        return None
+    return "/home/pmos/repodest"
+
+
+def merge(args, arch, suffix):
+    """Move the packages that abuild wrote to repodest() to the local
+    repository and index it. Call this with the lock held.
+
+    :param arch: architecture of the packages
+    :param suffix: chroot suffix the packages were built in
+    """
+    path = repodest()
+    if not path:
+        return
+    repo = f"/home/pmos/packages/pmos/{arch}"
+    pmb.chroot.user(args, ["sh", "-c", f"mkdir -p {repo} &&"
+                           f" mv {path}/pmos/{arch}/*.apk {repo}/"], suffix)
+    pmb.build.index_repo(args, arch)
+
+
+def needs_native_chroot(suffix, arch):
+    """:returns: True if the package gets cross-compiled in the native chroot
+                 (pmb:cross-native), which only worker 0 may use"""
+    return suffix == "native" and arch != pmb.config.arch_native
+
+
+def plan(args, pkgnames, arch, force=False):
+    """Find the pmaports that need to be built, and the order between them.
+
+    :param pkgnames: origins of the packages to build
+    :param arch: architecture to build for
+    :param force: build pkgnames even if they are up to date
+    :returns: {pkgname: {pkgname, ...}, ...} with the pmaports that need to
+              be built in topological order, and the pmaports that must be
+              built before each one (directly or indirectly depended on)
+    """
+    graph = pmb.helpers.depgraph.get(args, arch)
+
+    # All pmaports that the packages depend on, directly or indirectly
+    closure = set()
+    todo = list(pkgnames)
+    while todo:
+        pkgname = todo.pop()
+        if pkgname in closure or pkgname not in graph.pmaports:
+            continue
+        closure.add(pkgname)
+        todo += graph.depends[pkgname]
+    order = graph.topological_order(closure)
+
+    necessary = set()
+    for pkgname in order:
+        apkbuild = pmb.helpers.pmaports.get(args, pkgname)
+        if (force and pkgname in pkgnames) or \
+                pmb.build.is_necessary(args, arch, apkbuild):
+            necessary.add(pkgname)
+
+    # Packages in a circular dependency only wait for the ones that come
+    # earlier in the order
+    position = {pkgname: i for i, pkgname in enumerate(order)}
+    ret = {}
+    for pkgname in order:
+        if pkgname not in necessary:
+            continue
+        ret[pkgname] = set()
+        seen = set()
+        todo = list(graph.depends[pkgname])
+        while todo:
+            depend = todo.pop()
+            if depend in seen or depend not in closure or \
+                    position[depend] >= position[pkgname]:
+                continue
+            seen.add(depend)
+            if depend in necessary:
+                ret[pkgname].add(depend)
+            todo += graph.depends[depend]
+    return ret
+
+
+def _build(args, pkgname, arch, worker_number, jobs, force, strict):
+    """Build one package in a worker process."""
+    global worker
+    worker = worker_number
+    args.jobs = str(jobs)
+    try:
+        pmb.build.package(args, pkgname, arch, force, strict)
+    except Exception as e:
+        logging.info(f"ERROR: {e}")
+        logging.debug(f"{pkgname}: build in worker {worker_number} failed",
+                      exc_info=True)
+        sys.exit(1)
+
+
+def packages(args, pkgnames, arch, workers, force=False, strict=False):
+    """Build packages and all of their dependencies that need to be built,
+    up to the given number of packages at the same time.
+
+    The JOBS setting of abuild (args.jobs) is divided among the workers.
+
+    :param pkgnames: packages to build
+    :param arch: architecture to build for
+    :param workers: maximum number of packages to build at the same time
+    :param force: build pkgnames even if they are up to date
+    :param strict: see pmb.build.package()
+    :returns: list of pkgnames that have been built
+    """
+    global lock
+
+    # Build pmaports that can't be built for arch, or are not in pmaports,
+    # with pmb.build.package() to get its error messages
+    graph = pmb.helpers.depgraph.get(args, arch)
+    origins = []
+    built = []
+    for pkgname in pkgnames:
+        aport = pmb.helpers.pmaports.find(args, pkgname, False)
+        origin = os.path.basename(aport) if aport else pkgname
+        if origin in graph.pmaports:
+            origins.append(origin)
+        elif pmb.build.package(args, pkgname, arch, force, strict):
+            built.append(pkgname)
+
+    todo = plan(args, origins, arch, force)
+    if not todo:
+        return built
+    jobs = max(1, int(args.jobs) // workers)
+    logging.info(f"Building {len(todo)} package(s) for {arch} with up to"
+                 f" {workers} workers ({jobs} jobs each)")
+
+    context = multiprocessing.get_context("fork")
+    lock = context.RLock()
+    running = {}
+    failed = []
+    try:
+        while running or (todo and not failed):
+            # Start all builds whose dependencies are done
+            for pkgname, depends in list(todo.items()):
+                free = [i for i in range(workers) if i not in running]
+                if failed or not free:
+                    break
+                if not depends.issubset(built):
+                    continue
+                apkbuild = pmb.helpers.pmaports.get(args, pkgname)
+                suffix = pmb.build.autodetect.suffix(apkbuild, arch)
+                if needs_native_chroot(suffix, arch):
+                    if 0 in running:
+                        continue
+                    free = [0]
+                process = context.Process(
+                    target=_build,
+                    args=(args, pkgname, arch, free[0], jobs,
+                          force and pkgname in origins, strict))
+                with pmb.helpers.run_core.sudo_timer_paused():
+                    process.start()
+                running[free[0]] = (process, pkgname)
+                del todo[pkgname]
+
+            if not running:
+                break
+
+            # Wait until at least one build is done. The workers have their
+            # own snapshot of the mount table, read it again afterwards.
+            multiprocessing.connection.wait(
+                [process.sentinel for process, _ in running.values()])
+            pmb.helpers.mount.invalidate()
+            done = []
+            for i, (process, pkgname) in list(running.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del running[i]
+                if process.exitcode:
+                    failed.append(pkgname)
+                    continue
+                done.append(pkgname)
+                if arch not in pmb.helpers.other.cache["built"]:
+                    pmb.helpers.other.cache["built"][arch] = []
+                pmb.helpers.other.cache["built"][arch].append(pkgname)
+
+            # Packages built in other chroots at the same time may have
+            # overwritten the APKINDEX, so index again (once for all builds
+            # that are done) before starting builds that depend on them
+            if done:
+                built += done
+                with lock:
+                    pmb.build.index_repo(args, arch)
+    finally:
+        for process, _ in running.values():
+            process.join()
+        lock = contextlib.nullcontext()
+
+    if failed:
+        raise BuildFailedError(f"Build for {arch}/{', '.join(failed)}"
+                               " failed!")
+    return built
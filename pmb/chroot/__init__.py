@@ -2,8 +2,9 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 from pmb.chroot.init import init, init_keys, UsrMerge
 from pmb.chroot.mount import mount, mount_native_into_foreign, remove_mnt_pmbootstrap
-from pmb.chroot.root import root
-from pmb.chroot.user import user
+from pmb.chroot.mount import mount_overlay, overlay_suffix, umount_overlay
+from pmb.chroot.root import root, root_batch
+from pmb.chroot.user import user, user_batch
 from pmb.chroot.user import exists as user_exists
 from pmb.chroot.shutdown import shutdown
 from pmb.chroot.zap import zap
@@ -54,11 +54,9 @@ def update_repository_list(args, suffix="native", postmarketos_mirror=True,
 
     # Update the file
     logging.debug(f"({suffix}) update /etc/apk/repositories")
-    if os.path.exists(path):
-        pmb.helpers.run.root(args, ["rm", path])
-    for line in lines_new:
-        pmb.helpers.run.root(args, ["sh", "-c", "echo "
-                                    f"{shlex.quote(line)} >> {path}"])
+    lines = " ".join(shlex.quote(line) for line in lines_new)
+    pmb.helpers.run.root(args, ["sh", "-c", f"printf '%s\\n' {lines} >"
+                                f" {shlex.quote(path)}"])
     update_repository_list(args, suffix, postmarketos_mirror, True)
 
 
@@ -8,8 +8,11 @@ import os
 
 import pmb.chroot
 import pmb.chroot.apk_static
+import pmb.chroot.template
 import pmb.config
 import pmb.config.workdir
+import pmb.helpers.mount
+import pmb.helpers.other
 import pmb.helpers.repo
 import pmb.helpers.run
 import pmb.parse.arch
@@ -109,6 +112,41 @@ def warn_if_chroot_is_outdated(args, suffix):
     cache_chroot_is_outdated += [suffix]
 
 
+def mountpoints(args, suffix):
+    """
+    Get all mountpoints inside a chroot from the mount table snapshot.
+
+    :returns: set of mountpoints, e.g. {".../chroot_native/dev", ...}
+    """
+    chroot = os.path.realpath(f"{args.work}/chroot_{suffix}")
+    return {mountpoint for mountpoint in
+            pmb.helpers.mount.umount_all_list(chroot)
+            if mountpoint.startswith(f"{chroot}/")}
+
+
+def ready(args, suffix):
+    """
+    Check if init() has prepared the chroot already in the current session,
+    and if it is still in that state (it was not zapped and nothing got
+    umounted in the meantime).
+    """
+    expected = pmb.helpers.other.cache["pmb.chroot.init"].get(suffix)
+    if expected is None:
+        return False
+    if not os.path.islink(f"{args.work}/chroot_{suffix}/bin/sh"):
+        return False
+    return expected <= mountpoints(args, suffix)
+
+
+def mark_ready(args, suffix):
+    """
+    Remember that init() has prepared the chroot, so the following commands
+    in the same session can skip the preparation (see ready()).
+    """
+    pmb.helpers.other.cache["pmb.chroot.init"][suffix] = \
+        mountpoints(args, suffix)
+
+
 def init(args, suffix="native", usr_merge=UsrMerge.AUTO,
          postmarketos_mirror=True):
     """
@@ -121,6 +159,10 @@ def init(args, suffix="native", usr_merge=UsrMerge.AUTO,
                       pmbootstrap init.
     :param postmarketos_mirror: add postmarketos mirror URLs
     """
+    # Prepared earlier in this session and still mounted: nothing to do
+    if ready(args, suffix):
+        return
+
     # When already initialized: just prepare the chroot
     chroot = f"{args.work}/chroot_{suffix}"
     arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
@@ -133,6 +175,14 @@ def init(args, suffix="native", usr_merge=UsrMerge.AUTO,
         copy_resolv_conf(args, suffix)
         pmb.chroot.apk.update_repository_list(args, suffix, postmarketos_mirror)
         warn_if_chroot_is_outdated(args, suffix)
+        mark_ready(args, suffix)
+        return
+
+    # Create from template if possible
+    if usr_merge is UsrMerge.AUTO and pmb.config.is_systemd_selected(args):
+        usr_merge = UsrMerge.ON
+    if pmb.chroot.template.restore(args, suffix, usr_merge is UsrMerge.ON):
+        init(args, suffix, usr_merge, postmarketos_mirror)
         return
 
     # Require apk-tools-static
@@ -166,21 +216,25 @@ def init(args, suffix="native", usr_merge=UsrMerge.AUTO,
                         suffix, auto_init=False)
 
         # Create the links (with subfolders if necessary)
+        cmds_root = []
+        cmds_user = []
         for target, link_name in pmb.config.chroot_home_symlinks.items():
             link_dir = os.path.dirname(link_name)
             if not os.path.exists(f"{chroot}{link_dir}"):
-                pmb.chroot.user(args, ["mkdir", "-p", link_dir], suffix)
+                cmds_user.append(["mkdir", "-p", link_dir])
             if not os.path.exists(f"{chroot}{target}"):
-                pmb.chroot.root(args, ["mkdir", "-p", target], suffix)
-            pmb.chroot.user(args, ["ln", "-s", target, link_name], suffix)
-            pmb.chroot.root(args, ["chown", "pmos:pmos", target], suffix)
+                cmds_root.append(["mkdir", "-p", target])
+            cmds_user.append(["ln", "-s", target, link_name])
+            cmds_root.append(["chown", "pmos:pmos", target])
+        pmb.chroot.root_batch(args, cmds_root, suffix)
+        pmb.chroot.user_batch(args, cmds_user, suffix)
 
     # Merge /usr
-    if usr_merge is UsrMerge.AUTO and pmb.config.is_systemd_selected(args):
-        usr_merge = UsrMerge.ON
     if usr_merge is UsrMerge.ON:
         init_usr_merge(args, suffix)
 
     # Upgrade packages in the chroot, in case alpine-base, apk, etc. have been
     # built from source with pmbootstrap
     pmb.chroot.root(args, ["apk", "--no-network", "upgrade", "-a"], suffix)
+    pmb.chroot.template.save(args, suffix, usr_merge is UsrMerge.ON)
+    mark_ready(args, suffix)
@@ -4,8 +4,11 @@ import glob
 import logging
 import os
 import pmb.config
+import pmb.config.workdir
 import pmb.parse
 import pmb.helpers.mount
+import pmb.helpers.other
+import pmb.helpers.run
 
 
 def create_device_nodes(args, suffix):
@@ -16,16 +19,18 @@ def create_device_nodes(args, suffix):
         chroot = args.work + "/chroot_" + suffix
 
         # Create all device nodes as specified in the config
+        cmds = []
         for dev in pmb.config.chroot_device_nodes:
             path = chroot + "/dev/" + str(dev[4])
             if not os.path.exists(path):
-                pmb.helpers.run.root(args, ["mknod",
-                                            "-m", str(dev[0]),  # permissions
-                                            path,  # name
-                                            str(dev[1]),  # type
-                                            str(dev[2]),  # major
-                                            str(dev[3]),  # minor
-                                            ])
+                cmds.append(["mknod",
+                             "-m", str(dev[0]),  # permissions
+                             path,  # name
+                             str(dev[1]),  # type
+                             str(dev[2]),  # major
+                             str(dev[3]),  # minor
+                             ])
+        pmb.helpers.run.root_batch(args, cmds)
 
         # Verify major and minor numbers of created nodes
         for dev in pmb.config.chroot_device_nodes:
@@ -59,22 +64,19 @@ def mount_dev_tmpfs(args, suffix="native"):
     if pmb.helpers.mount.ismount(dev):
         return
 
-    # Create the $chroot/dev folder and mount tmpfs there
-    pmb.helpers.run.root(args, ["mkdir", "-p", dev])
-    pmb.helpers.run.root(args, ["mount", "-t", "tmpfs",
-                                "-o", "size=1M,noexec,dev",
-                                "tmpfs", dev])
-
-    # Create pts, shm folders and device nodes
-    pmb.helpers.run.root(args, ["mkdir", "-p", dev + "/pts", dev + "/shm"])
-    pmb.helpers.run.root(args, ["mount", "-t", "tmpfs",
-                                "-o", "nodev,nosuid,noexec",
-                                "tmpfs", dev + "/shm"])
+    # Create the $chroot/dev folder and mount tmpfs there, create pts, shm
+    # folders and setup /dev/fd as a symlink
+    pmb.helpers.run.root_batch(args, [
+        ["mkdir", "-p", dev],
+        ["mount", "-t", "tmpfs", "-o", "size=1M,noexec,dev", "tmpfs", dev],
+        ["mkdir", "-p", dev + "/pts", dev + "/shm"],
+        ["mount", "-t", "tmpfs", "-o", "nodev,nosuid,noexec", "tmpfs",
+         dev + "/shm"],
+        ["ln", "-sf", "/proc/self/fd", f"{dev}/"]])
+
+    # Create device nodes
     create_device_nodes(args, suffix)
 
-    # Setup /dev/fd as a symlink
-    pmb.helpers.run.root(args, ["ln", "-sf", "/proc/self/fd", f"{dev}/"])
-
 
 def mount(args, suffix="native"):
     # Mount tmpfs as the chroot's /dev
@@ -91,9 +93,12 @@ def mount(args, suffix="native"):
         mountpoints[source] = target
 
     # Mount if necessary
-    for source, target in mountpoints.items():
-        target_full = args.work + "/chroot_" + suffix + target
-        pmb.helpers.mount.bind(args, source, target_full)
+    targets = {source: args.work + "/chroot_" + suffix + target
+               for source, target in mountpoints.items()}
+    mounted = pmb.helpers.mount.mounted(targets.values())
+    for source, target_full in targets.items():
+        if target_full not in mounted:
+            pmb.helpers.mount.bind(args, source, target_full)
 
 
 def mount_native_into_foreign(args, suffix):
@@ -108,6 +113,94 @@ def mount_native_into_foreign(args, suffix):
                                     musl_link])
         pmb.helpers.run.root(args, ["ln", "-sf", "/native/bin/busybox", "/usr/local/bin/gzip"])
 
+
+def overlay_suffix(suffix):
+    """
+    :param suffix: suffix of the chroot below the overlay
+    :returns: suffix of the overlay chroot, e.g. "native-overlay"
+    """
+    return f"{suffix}-overlay"
+
+
+def mount_overlay(args, suffix):
+    """
+    Mount a temporary overlay chroot on top of a chroot. The overlay chroot
+    has the same content, but all changes go to its own upper layer in
+    $WORK/overlays/ and the chroot below stays as it is. A left over overlay
+    chroot from a previous run gets discarded first.
+
+    :param suffix: suffix of the chroot below the overlay, it must not be
+                   modified while the overlay is mounted
+    :returns: suffix of the overlay chroot
+    """
+    ret = overlay_suffix(suffix)
+    umount_overlay(args, ret)
+
+    layers = f"{args.work}/overlays/{ret}"
+    pmb.helpers.mount.overlay(args, f"{args.work}/chroot_{suffix}",
+                              f"{layers}/upper", f"{layers}/work",
+                              f"{args.work}/chroot_{ret}")
+    pmb.config.workdir.chroot_save_init(args, ret)
+    return ret
+
+
+def kill_processes(args, suffix):
+    """
+    Kill all processes that run inside a chroot, e.g. daemons that a build
+    started and that are still running (like the sccache server), so the
+    chroot can be umounted. Waits up to 5 seconds until they are gone.
+
+    :param suffix: suffix of the chroot
+    """
+    chroot = os.path.realpath(f"{args.work}/chroot_{suffix}")
+    # $1: chroot. Kill the processes with that root folder until none are
+    # left (readlink of /proc/$PID/root needs root)
+    script = """
+        kill_all() {
+            found=""
+            for proc in /proc/[0-9]*; do
+                if [ "$(readlink "$proc/root")" = "$1" ]; then
+                    kill -9 "${proc#/proc/}" 2>/dev/null
+                    found=1
+                fi
+            done
+            [ -n "$found" ]
+        }
+        i=0
+        while kill_all "$1" && [ "$i" -lt 50 ]; do
+            sleep 0.1
+            i=$((i + 1))
+        done
+        true
+    """
+    pmb.helpers.run.root(args, ["sh", "-c", script, "sh", chroot])
+
+
+def umount_overlay(args, suffix):
+    """
+    Umount an overlay chroot from mount_overlay() and discard all changes
+    made in it.
+
+    :param suffix: suffix of the overlay chroot
+    """
+    chroot = f"{args.work}/chroot_{suffix}"
+    layers = f"{args.work}/overlays/{suffix}"
+    if not os.path.exists(chroot) and not os.path.exists(layers):
+        return
+
+    # Umount the overlay and everything mounted inside it first, so only the
+    # upper layer gets deleted
+    if pmb.helpers.mount.ismount(chroot):
+        kill_processes(args, suffix)
+    pmb.helpers.mount.umount_all(args, chroot)
+    cmds = [["rm", "-rf", layers]]
+    if os.path.exists(chroot):
+        cmds += [["rmdir", chroot]]
+    pmb.helpers.run.root_batch(args, cmds)
+    pmb.helpers.other.cache["pmb.chroot.init"].pop(suffix, None)
+    pmb.config.workdir.clean(args)
+
+
 def remove_mnt_pmbootstrap(args, suffix):
     """ Safely remove /mnt/pmbootstrap directories from the chroot, without
         running rm -r as root and potentially removing data inside the
@@ -120,5 +213,5 @@ def remove_mnt_pmbootstrap(args, suffix):
     if not os.path.exists(mnt_dir):
         return
 
-    for path in glob.glob(f"{mnt_dir}/*") + [mnt_dir]:
-        pmb.helpers.run.root(args, ["rmdir", path])
+    pmb.helpers.run.root_batch(args, [["rmdir", path] for path in
+                                      glob.glob(f"{mnt_dir}/*") + [mnt_dir]])
@@ -6,6 +6,8 @@ import shutil
 import pmb.config
 import pmb.chroot
 import pmb.chroot.binfmt
+import pmb.helpers.mount
+import pmb.helpers.privileged
 import pmb.helpers.run
 import pmb.helpers.run_core
 
@@ -25,6 +27,41 @@ def executables_absolute_path():
     return ret
 
 
+def log_message(cmd, suffix="native", working_dir="/", env={}):
+    """
+    Readable log message for a command in a chroot (without all the
+    escaping), e.g. "(native) % cd /home/pmos; echo test".
+    """
+    ret = f"({suffix}) % "
+    for key, value in env.items():
+        ret += f"{key}={value} "
+    if working_dir != "/":
+        ret += f"cd {working_dir}; "
+    return ret + " ".join(cmd)
+
+
+def env_all(env={}, add_proxy_env_vars=True):
+    """
+    Get the environment variables for running a command in a chroot.
+
+    :param env: dict of environment variables that override the defaults
+    :param add_proxy_env_vars: preserve HTTP_PROXY etc. vars from host
+    """
+    ret = {"CHARSET": "UTF-8",
+           "HISTFILE": "~/.ash_history",
+           "HOME": "/root",
+           "LANG": "UTF-8",
+           "PATH": pmb.config.chroot_path,
+           "PYTHONUNBUFFERED": "1",
+           "SHELL": "/bin/ash",
+           "TERM": "xterm"}
+    for key, value in env.items():
+        ret[key] = value
+    if add_proxy_env_vars:
+        pmb.helpers.run_core.add_proxy_env_vars(ret)
+    return ret
+
+
 def root(args, cmd, suffix="native", working_dir="/", output="log",
          output_return=False, check=None, env={}, auto_init=True,
          disable_timeout=False, add_proxy_env_vars=True):
@@ -50,38 +87,65 @@ def root(args, cmd, suffix="native", working_dir="/", output="log",
         pmb.chroot.init(args, suffix)
 
     # Readable log message (without all the escaping)
-    msg = f"({suffix}) % "
-    for key, value in env.items():
-        msg += f"{key}={value} "
-    if working_dir != "/":
-        msg += f"cd {working_dir}; "
-    msg += " ".join(cmd)
-
-    # Merge env with defaults into env_all
-    env_all = {"CHARSET": "UTF-8",
-               "HISTFILE": "~/.ash_history",
-               "HOME": "/root",
-               "LANG": "UTF-8",
-               "PATH": pmb.config.chroot_path,
-               "PYTHONUNBUFFERED": "1",
-               "SHELL": "/bin/ash",
-               "TERM": "xterm"}
-    for key, value in env.items():
-        env_all[key] = value
-    if add_proxy_env_vars:
-        pmb.helpers.run_core.add_proxy_env_vars(env_all)
+    msg = log_message(cmd, suffix, working_dir, env)
+
+    # Merge env with defaults
+    env_chroot = env_all(env, add_proxy_env_vars)
+
+    # Read the mount table again after mount and umount commands
+    pmb.helpers.mount.invalidate([cmd])
 
     # Build the command in steps and run it, e.g.:
     # cmd: ["echo", "test"]
     # cmd_chroot: ["/sbin/chroot", "/..._native", "/bin/sh", "-c", "echo test"]
     # cmd_sudo: ["sudo", "env", "-i", "sh", "-c", "PATH=... /sbin/chroot ..."]
+    if pmb.helpers.privileged.supported(args, cmd, output):
+        return pmb.helpers.privileged.core(args, msg, cmd, working_dir,
+                                           output_return, check, env_chroot,
+                                           True, disable_timeout, chroot)
     executables = executables_absolute_path()
     cmd_chroot = [executables["chroot"], chroot, "/bin/sh", "-c",
                   pmb.helpers.run_core.flat_cmd(cmd, working_dir)]
     cmd_sudo = pmb.config.sudo([
         "env", "-i", executables["sh"], "-c",
-        pmb.helpers.run_core.flat_cmd(cmd_chroot, env=env_all)]
+        pmb.helpers.run_core.flat_cmd(cmd_chroot, env=env_chroot)]
     )
     return pmb.helpers.run_core.core(args, msg, cmd_sudo, None, output,
                                      output_return, check, True,
                                      disable_timeout)
+
+
+def root_batch(args, cmds, suffix="native", working_dir="/", check=None,
+               env={}, auto_init=True):
+    """
+    Run multiple commands inside a chroot as root, with one privileged call
+    instead of one per command. The commands run one after another, until
+    one of them fails.
+
+    :param cmds: list of commands, each as list, e.g.
+                 [["mkdir", "-p", "/tmp/a"], ["touch", "/tmp/a/b"]]
+    :returns: exit code of the last command that ran
+
+    See root() and pmb.helpers.run.root_batch() for details.
+    """
+    if not cmds:
+        return 0
+    pmb.helpers.mount.invalidate(cmds)
+
+    # Commands the privileged helper can't run: one "sh -c" call
+    if not all(pmb.helpers.privileged.supported(args, cmd) for cmd in cmds):
+        script = " && ".join(pmb.helpers.run_core.flat_cmd(cmd)
+                             for cmd in cmds)
+        return root(args, ["sh", "-c", script], suffix, working_dir,
+                    check=check, env=env, auto_init=auto_init)
+
+    chroot = f"{args.work}/chroot_{suffix}"
+    if not auto_init and not os.path.islink(f"{chroot}/bin/sh"):
+        raise RuntimeError(f"Chroot does not exist: {chroot}")
+    if auto_init:
+        pmb.chroot.init(args, suffix)
+
+    msgs = [log_message(cmd, suffix, working_dir, env) for cmd in cmds]
+    return pmb.helpers.privileged.core_batch(args, msgs, cmds, working_dir,
+                                             check, env_all(env), True,
+                                             chroot)
@@ -59,6 +59,10 @@ def shutdown_cryptsetup_device(args, name):
 
 
 def shutdown(args, only_install_related=False):
+    # Don't rely on the mount table snapshot, other processes (e.g. another
+    # pmbootstrap instance) may have mounted or umounted something
+    pmb.helpers.mount.invalidate()
+
     # Stop daemons
     kill_adb(args)
     kill_sccache(args)
@@ -0,0 +1,136 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Templates of freshly created chroots, so creating the same chroot again
+(e.g. after 'pmbootstrap zap') only means extracting a tarball.
+
+A template gets stored as $WORK/cache_chroot_templates/$NAME.tar, with the
+installed packages and their versions in $NAME.pkgs. It is only used as
+long as the APKINDEX files have the same versions of all these packages.
+"""
+import logging
+import os
+
+import pmb.config.pmaports
+import pmb.config.workdir
+import pmb.helpers.mount
+import pmb.helpers.repo
+import pmb.helpers.run
+import pmb.parse.apkindex
+import pmb.parse.arch
+
+
+# Keep owners, permissions, file capabilities etc. exactly as they are (tar
+# would map owners by name with the passwd and group files of the host)
+tar_flags = ["--numeric-owner", "--xattrs", "--xattrs-include=*", "--acls"]
+
+
+def enabled(args, suffix):
+    """
+    Check if templates are used for a chroot. Only building chroots are
+    stored as templates, rootfs and installer chroots are device specific.
+    Overlay chroots only consist of the chroot below them.
+    """
+    if "chroot_templates" in args and not args.chroot_templates:
+        return False
+    if suffix.endswith("-overlay"):
+        return False
+    return suffix == "native" or suffix.startswith("buildroot_")
+
+
+def path(args, suffix, usr_merge):
+    """
+    :param usr_merge: if /usr is merged in the chroot
+    :returns: path to the template without file extension, e.g.
+              "$WORK/cache_chroot_templates/edge_x86_64"
+    """
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    channel = pmb.config.pmaports.read_config(args)["channel"]
+    name = f"{channel}_{arch}{'_usr-merge' if usr_merge else ''}"
+    return f"{args.work}/cache_chroot_templates/{name}"
+
+
+def outdated(args, suffix, pkgs):
+    """
+    Compare the packages of a template with the APKINDEX files.
+
+    :param pkgs: {pkgname: version} of the packages in the template
+    :returns: list of pkgnames that have a different version now
+    """
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    ret = []
+    for pkgname, version in pkgs.items():
+        package = pmb.parse.apkindex.package(args, pkgname, arch, False)
+        if not package or package["version"] != version:
+            ret.append(pkgname)
+    return ret
+
+
+def restore(args, suffix, usr_merge):
+    """
+    Create a chroot from its template, if there is an up-to-date template.
+
+    :param usr_merge: if /usr should be merged in the chroot
+    :returns: True if the chroot was created
+    """
+    template = path(args, suffix, usr_merge)
+    if not enabled(args, suffix) or not os.path.exists(f"{template}.pkgs") \
+            or not os.path.exists(f"{template}.tar"):
+        return False
+
+    pkgs = {}
+    with open(f"{template}.pkgs") as handle:
+        for line in handle:
+            pkgname, version = line.split()
+            pkgs[pkgname] = version
+
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    pmb.helpers.repo.update(args, arch)
+    changed = outdated(args, suffix, pkgs)
+    if changed:
+        logging.verbose(f"({suffix}) chroot template is outdated, changed"
+                        f" packages: {', '.join(changed)}")
+        return False
+
+    logging.info(f"({suffix}) create chroot from template")
+    chroot = f"{args.work}/chroot_{suffix}"
+    pmb.helpers.run.root(args, ["tar", "-xpf", f"{template}.tar", "-C",
+                                chroot] + tar_flags)
+    pmb.config.workdir.chroot_save_init(args, suffix)
+    return True
+
+
+def save(args, suffix, usr_merge):
+    """
+    Store a freshly created chroot as template, without the folders that
+    are mounted inside it.
+
+    :param usr_merge: if /usr is merged in the chroot
+    """
+    if not enabled(args, suffix):
+        return
+
+    chroot = f"{args.work}/chroot_{suffix}"
+    installed = pmb.parse.apkindex.parse(f"{chroot}/lib/apk/db/installed",
+                                         False)
+    pkgs = {block["pkgname"]: block["version"]
+            for block in installed.values()}
+
+    logging.debug(f"({suffix}) save chroot template")
+    template = path(args, suffix, usr_merge)
+    os.makedirs(os.path.dirname(template), exist_ok=True)
+    if os.path.exists(f"{template}.pkgs"):
+        os.remove(f"{template}.pkgs")
+    excludes = []
+    chroot_real = os.path.realpath(chroot)
+    for mountpoint in pmb.helpers.mount.umount_all_list(chroot):
+        if mountpoint.startswith(f"{chroot_real}/"):
+            excludes += ["--exclude", f".{mountpoint[len(chroot_real):]}"]
+    pmb.helpers.run.root(args, ["tar", "-cf", f"{template}.tar.tmp", "-C",
+                                chroot] + tar_flags + excludes + ["."])
+    os.replace(f"{template}.tar.tmp", f"{template}.tar")
+
+    # Write the package list last, restore() only uses complete templates
+    with open(f"{template}.pkgs", "w") as handle:
+        for pkgname, version in sorted(pkgs.items()):
+            handle.write(f"{pkgname} {version}\n")
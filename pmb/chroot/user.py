@@ -32,6 +32,24 @@ def user(args, cmd, suffix="native", working_dir="/", output="log",
                            add_proxy_env_vars=False)
 
 
+def user_batch(args, cmds, suffix="native", working_dir="/", check=None,
+               env={}, auto_init=True):
+    """
+    Run multiple commands inside a chroot as "user", with one call of 'su'.
+    The commands run one after another, until one of them fails.
+
+    :param cmds: list of commands, each as list, e.g.
+                 [["mkdir", "-p", "/tmp/a"], ["touch", "/tmp/a/b"]]
+
+    See user() for a description of the other arguments.
+    """
+    if not cmds:
+        return 0
+    script = " && ".join(pmb.helpers.run_core.flat_cmd(cmd) for cmd in cmds)
+    return user(args, ["sh", "-c", script], suffix, working_dir,
+                check=check, env=env, auto_init=auto_init)
+
+
 def exists(args, username, suffix="native"):
     """
     Checks if username exists in the system
@@ -10,12 +10,12 @@ import pmb.config.pmaports
 import pmb.config.workdir
 import pmb.helpers.pmaports
 import pmb.helpers.run
-import pmb.parse.apkindex
+import pmb.parse.apk
 
 
 def zap(args, confirm=True, dry=False, pkgs_local=False, http=False,
         pkgs_local_mismatch=False, pkgs_online_mismatch=False, distfiles=False,
-        rust=False, netboot=False):
+        rust=False, netboot=False, templates=False, parse_cache=False):
     """
     Shutdown everything inside the chroots (e.g. adb), umount
     everything and then safely remove folders from the work-directory.
@@ -30,6 +30,9 @@ def zap(args, confirm=True, dry=False, pkgs_local=False, http=False,
     :param distfiles: Clear the downloaded files cache
     :param rust: Remove rust related caches
     :param netboot: Remove images for netboot
+    :param templates: Remove templates of created chroots
+    :param parse_cache: Remove the cached parsing results of APKINDEX,
+        APKBUILD files etc. (see pmb.helpers.persistent_cache)
 
     NOTE: This function gets called in pmb/config/init.py, with only args.work
     and args.device set!
@@ -54,9 +57,11 @@ def zap(args, confirm=True, dry=False, pkgs_local=False, http=False,
     # Deletion patterns for folders inside args.work
     patterns = [
         "chroot_native",
+        "chroot_native-overlay",
         "chroot_buildroot_*",
         "chroot_installer_*",
         "chroot_rootfs_*",
+        "overlays",
     ]
     if pkgs_local:
         patterns += ["packages"]
@@ -68,6 +73,10 @@ def zap(args, confirm=True, dry=False, pkgs_local=False, http=False,
         patterns += ["cache_rust"]
     if netboot:
         patterns += ["images_netboot"]
+    if templates:
+        patterns += ["cache_chroot_templates"]
+    if parse_cache:
+        patterns += ["cache_parse"]
 
     # Delete everything matching the patterns
     for pattern in patterns:
@@ -106,24 +115,29 @@ def zap_pkgs_local_mismatch(args, confirm=True, dry=False):
         return
 
     reindex = False
-    pattern = f"{args.work}/packages/{channel}/*/APKINDEX.tar.gz"
-    for apkindex_path in glob.glob(pattern):
-        # Delete packages without same version in aports
-        blocks = pmb.parse.apkindex.parse_blocks(apkindex_path)
-        for block in blocks:
-            pkgname = block["pkgname"]
-            origin = block["origin"]
-            version = block["version"]
-            arch = block["arch"]
+    for path in glob.glob(f"{args.work}/packages/{channel}/*"):
+        if not os.path.isdir(path):
+            continue
 
+        # Delete packages without same version in aports. Read the apks
+        # instead of the APKINDEX, so packages missing in it are found too.
+        for filename, apk in pmb.parse.apk.read_repo(path).items():
             # Apk path
-            apk_path_short = f"{arch}/{pkgname}-{version}.apk"
-            apk_path = f"{args.work}/packages/{channel}/{apk_path_short}"
-            if not os.path.exists(apk_path):
-                logging.info("WARNING: Package mentioned in index not"
-                             f" found: {apk_path_short}")
+            apk_path_short = f"{os.path.basename(path)}/{filename}"
+            apk_path = f"{path}/{filename}"
+
+            # Broken apks (e.g. truncated by an interrupted build) can't
+            # match any aport
+            if not apk:
+                logging.info(f"% rm {apk_path_short} (failed to read)")
+                if not dry:
+                    pmb.helpers.run.root(args, ["rm", apk_path])
+                    reindex = True
                 continue
 
+            origin = apk.get("origin", apk["pkgname"])
+            version = apk["pkgver"]
+
             # Aport path
             aport_path = pmb.helpers.pmaports.find(args, origin, False)
             if not aport_path:
@@ -713,6 +713,12 @@ kconfig_options_uefi = {
 # PARSE
 #
 
+# Version of the data structures in the persistent parse cache
+# ($WORK/cache_parse, see pmb/helpers/persistent_cache.py). Increase this
+# number whenever the format of cached APKINDEX, APKBUILD or pmaports data
+# changes, so existing cache entries get ignored.
+parse_cache_version = 5
+
 # Variables belonging to a package or subpackage in APKBUILD files
 apkbuild_package_attributes = {
     "pkgdesc": {},
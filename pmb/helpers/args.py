@@ -4,6 +4,7 @@ import copy
 import os
 import pmb.config
 import pmb.helpers.git
+import pmb.helpers.persistent_cache
 
 """This file constructs the args variable, which is passed to almost all
    functions in the pmbootstrap code base. Here's a listing of the kind of
@@ -112,6 +113,7 @@ def init(args):
     pmb.config.merge_with_args(args)
     replace_placeholders(args)
     pmb.helpers.other.init_cache()
+    pmb.helpers.persistent_cache.init(args)
 
     # Initialize logs (we could raise errors below)
     pmb.helpers.logging.init(args)
@@ -0,0 +1,296 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Dependency graph of pmaports and binary packages for one architecture.
+
+Nodes are origins: the pkgnames of pmaports, or the origins of binary
+packages from the APKINDEX for dependencies that are not in pmaports. Edges
+point from a package to the packages it depends on (makedepends,
+checkdepends and depends, including the depends of subpackages). Binary
+packages are leaves, their dependencies are not looked at.
+"""
+import glob
+import hashlib
+import heapq
+import logging
+import os
+
+import pmb.build
+import pmb.helpers.package
+import pmb.helpers.persistent_cache
+import pmb.helpers.pmaports
+import pmb.helpers.repo
+import pmb.parse.apkindex
+
+
+class Graph:
+    """Directed graph of packages, see the module description."""
+
+    def __init__(self, arch, depends, pmaports):
+        """
+        :param arch: architecture of the packages (e.g. "armhf")
+        :param depends: {origin: [origin, ...], ...} with the dependencies of
+                        each node. Each dependency must be a node as well.
+        :param pmaports: the nodes that are in pmaports, all others are
+                         binary packages
+        """
+        self.arch = arch
+        self.depends = {node: tuple(sorted(set(deps)))
+                        for node, deps in sorted(depends.items())}
+        self.pmaports = frozenset(pmaports)
+        self._reverse = None
+        self._components = None
+        self._order = None
+
+    def as_dict(self):
+        """:returns: the graph as dict, to be stored or printed as JSON"""
+        return {"arch": self.arch,
+                "depends": {node: list(deps)
+                            for node, deps in self.depends.items()},
+                "pmaports": sorted(self.pmaports)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """:param data: return value of as_dict()"""
+        return cls(data["arch"], data["depends"], data["pmaports"])
+
+    def reverse_depends(self, node):
+        """Get the packages that directly depend on a package.
+
+        :param node: origin of the package
+        :returns: sorted list of origins
+        """
+        if self._reverse is None:
+            self._reverse = {}
+            for node_i, deps in self.depends.items():
+                for dep in deps:
+                    self._reverse.setdefault(dep, []).append(node_i)
+        return list(self._reverse.get(node, []))
+
+    def components(self):
+        """Find the strongly connected components of the graph (Tarjan's
+        algorithm, iterative to not run into Python's recursion limit).
+
+        :returns: {node: component, ...} where component is a sorted tuple of
+                  all nodes that depend on each other, directly or indirectly
+        """
+        if self._components is not None:
+            return self._components
+
+        ret = {}
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        for root in self.depends:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.depends[root]))]
+            while work:
+                node, deps = work[-1]
+                for dep in deps:
+                    if dep not in index:
+                        index[dep] = lowlink[dep] = len(index)
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(self.depends[dep])))
+                        break
+                    if dep in on_stack:
+                        lowlink[node] = min(lowlink[node], index[dep])
+                else:
+                    # All dependencies of node are done
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] != index[node]:
+                        continue
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    component = tuple(sorted(component))
+                    for member in component:
+                        ret[member] = component
+
+        self._components = ret
+        return ret
+
+    def cycles(self):
+        """:returns: sorted list of circular dependencies, each one a sorted
+                     tuple of the nodes that are part of it"""
+        ret = set()
+        for node, component in self.components().items():
+            if len(component) > 1 or node in self.depends[node]:
+                ret.add(component)
+        return sorted(ret)
+
+    def topological_order(self, nodes=None):
+        """Order packages, so each one comes after its dependencies.
+
+        Packages that don't depend on each other are sorted alphabetically, so
+        the order is deterministic. Packages that are part of a circular
+        dependency (see cycles()) are next to each other, in alphabetical
+        order.
+
+        :param nodes: only return these packages, in the order of the whole
+                      graph (so dependencies through other packages are
+                      taken into account as well). Packages that are not in
+                      the graph come first.
+        :returns: list of origins
+        """
+        if self._order is None:
+            components = self.components()
+            dependents = {}
+            pending = {}
+            for node, deps in self.depends.items():
+                component = components[node]
+                pending.setdefault(component, set())
+                for dep in deps:
+                    if components[dep] != component:
+                        pending[component].add(components[dep])
+                        dependents.setdefault(components[dep],
+                                              set()).add(component)
+
+            # Kahn's algorithm on the components
+            count = {component: len(deps)
+                     for component, deps in pending.items()}
+            heap = [component for component, deps in count.items()
+                    if not deps]
+            heapq.heapify(heap)
+            order = []
+            while heap:
+                component = heapq.heappop(heap)
+                order += component
+                for dependent in dependents.get(component, []):
+                    count[dependent] -= 1
+                    if not count[dependent]:
+                        heapq.heappush(heap, dependent)
+            self._order = order
+
+        if nodes is None:
+            return list(self._order)
+        nodes = set(nodes)
+        return (sorted(nodes - self.depends.keys()) +
+                [node for node in self._order if node in nodes])
+
+    def rebuild(self, nodes):
+        """Find out what needs to be rebuilt if packages change.
+
+        :param nodes: origins of the changed packages
+        :returns: the pmaports among nodes and all pmaports depending on them
+                  directly or indirectly, in topological order
+        """
+        ret = set()
+        todo = list(nodes)
+        while todo:
+            node = todo.pop()
+            if node in ret:
+                continue
+            ret.add(node)
+            todo += self.reverse_depends(node)
+        return self.topological_order(ret & self.pmaports)
+
+
+def _resolve(args, arch, depend, origins):
+    """Find the origin of a dependency.
+
+    :param depend: entry of depends, e.g. "so:libc.musl-x86_64.so.1"
+    :param origins: cache of previously resolved dependencies
+    :returns: origin (or the pkgname if it can't be found), or None for
+              conflicting dependencies
+    """
+    if depend.startswith("!"):
+        return None
+    pkgname = pmb.helpers.package.remove_operators(depend)
+    if pkgname in origins:
+        return origins[pkgname]
+
+    aport = pmb.helpers.pmaports.find(args, pkgname, False)
+    if aport:
+        ret = os.path.basename(aport)
+    else:
+        package = pmb.parse.apkindex.package(args, pkgname, arch, False)
+        ret = package.get("origin", package["pkgname"]) if package else pkgname
+
+    origins[pkgname] = ret
+    return ret
+
+
+def build(args, arch):
+    """Build the dependency graph of all pmaports that can be built for an
+    architecture.
+
+    :param arch: architecture (e.g. "armhf")
+    :returns: Graph
+    """
+    logging.verbose(f"Building dependency graph of pmaports ({arch})")
+    pmb.helpers.repo.update(args, arch)
+
+    depends = {}
+    pmaports = []
+    origins = {}
+    for pkgname, apkbuild in pmb.helpers.pmaports.parse_all(args).items():
+        if not pmb.helpers.pmaports.check_arches(apkbuild["arch"], arch):
+            continue
+        pmaports.append(pkgname)
+
+        depends_pkgname = pmb.build._package.get_depends(args, apkbuild)
+        for subpkg in apkbuild["subpackages"].values():
+            if subpkg:
+                depends_pkgname += subpkg["depends"]
+
+        depends[pkgname] = set()
+        for depend in depends_pkgname:
+            origin = _resolve(args, arch, depend, origins)
+            if origin and origin != pkgname:
+                depends[pkgname].add(origin)
+
+    # Binary packages and dependencies that were not found are leaves
+    for deps in list(depends.values()):
+        for dep in deps:
+            depends.setdefault(dep, [])
+
+    return Graph(arch, depends, pmaports)
+
+
+def _fingerprint(args, arch):
+    """:returns: hash that changes when the graph needs to be built again"""
+    paths = list(pmb.helpers.pmaports.get_paths(args).values())
+    paths += sorted(glob.glob(f"{args.work}/cache_apk_{arch}/APKINDEX.*"))
+    files = [(path, pmb.helpers.persistent_cache.fingerprint_file(path))
+             for path in paths]
+    ignore_depends = "ignore_depends" in args and args.ignore_depends
+    return hashlib.sha256(repr((files, ignore_depends)).encode()).hexdigest()
+
+
+def get(args, arch):
+    """Get the dependency graph of pmaports for an architecture.
+
+    The graph is cached for the current session, and stored in the
+    persistent cache until an APKBUILD or APKINDEX changes.
+
+    :param arch: architecture (e.g. "armhf")
+    :returns: Graph
+    """
+    cache = pmb.helpers.other.cache["pmb.helpers.depgraph"]
+    if arch in cache:
+        return cache[arch]
+
+    key = (args.aports, arch)
+    fingerprint = _fingerprint(args, arch)
+    data = pmb.helpers.persistent_cache.load("depgraph", key, fingerprint)
+    if data:
+        ret = Graph.from_dict(data)
+    else:
+        ret = build(args, arch)
+        pmb.helpers.persistent_cache.save("depgraph", key, fingerprint,
+                                          ret.as_dict())
+
+    cache[arch] = ret
+    return ret
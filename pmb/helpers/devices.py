@@ -54,11 +54,12 @@ def list_vendors(args):
 
 def list_apkbuilds(args):
     """:returns: { "first-device": {"pkgname": ..., "pkgver": ...}, ... }"""
-    ret = {}
+    paths = {}
     for device in list_codenames(args):
-        apkbuild_path = f"{args.aports}/device/*/device-{device}/APKBUILD"
-        ret[device] = pmb.parse.apkbuild(apkbuild_path)
-    return ret
+        paths[device] = find_path(args, device, "APKBUILD")
+    apkbuilds = pmb.parse.apkbuild_bulk(list(paths.values()),
+                                        int(args.jobs))
+    return {device: apkbuilds[path] for device, path in paths.items()}
 
 
 def list_deviceinfos(args):
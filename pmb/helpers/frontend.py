@@ -9,6 +9,7 @@ import sys
 import pmb.aportgen
 import pmb.build
 import pmb.build.autodetect
+import pmb.build.parallel
 import pmb.chroot
 import pmb.chroot.initfs
 import pmb.chroot.other
@@ -117,6 +118,11 @@ def build(args):
         pmb.helpers.repo_bootstrap.require_bootstrap(args, arch_package,
             f"build {package} for {arch_package}")
 
+    # Build independent packages at the same time
+    if args.build_workers > 1 and not src:
+        build_parallel(args, force)
+        return
+
     # Build all packages
     for package in args.packages:
         arch_package = args.arch or pmb.build.autodetect.arch(args, package)
@@ -127,6 +133,27 @@ def build(args):
                          " if needed.")
 
 
+def build_parallel(args, force):
+    """Build args.packages with pmb.build.parallel, grouped by arch."""
+    packages_arch = {}
+    for package in args.packages:
+        arch_package = args.arch or pmb.build.autodetect.arch(args, package)
+        packages_arch.setdefault(arch_package, []).append(package)
+
+    for arch_package, packages in packages_arch.items():
+        built = pmb.build.parallel.packages(args, packages, arch_package,
+                                            args.build_workers, force,
+                                            args.strict)
+        for package in packages:
+            aport = pmb.helpers.pmaports.find(args, package, False)
+            if (aport and os.path.basename(aport) in built) or \
+                    package in built:
+                continue
+            logging.info("NOTE: Package '" + package + "' is up to date. Use"
+                         " 'pmbootstrap build " + package + " --force'"
+                         " if needed.")
+
+
 def build_init(args):
     suffix = _parse_suffix(args)
     pmb.build.init(args, suffix)
@@ -467,12 +494,17 @@ def deviceinfo_parse(args):
 
 
 def apkbuild_parse(args):
-    # Default to all packages
+    # Default to all packages, parse them in parallel
     packages = args.packages
-    if not packages:
-        packages = pmb.helpers.pmaports.get_list(args)
+    if args.apkbuild_parse_all or not packages:
+        apkbuilds = pmb.helpers.pmaports.parse_all(args,
+                                                   args.apkbuild_parse_jobs)
+        for package, apkbuild in apkbuilds.items():
+            print(package + ":")
+            print(json.dumps(apkbuild, indent=4, sort_keys=True))
+        return
 
-    # Iterate over all packages
+    # Iterate over the specified packages
     for package in packages:
         print(package + ":")
         aport = pmb.helpers.pmaports.find(args, package)
@@ -488,7 +520,8 @@ def apkindex_parse(args):
             raise RuntimeError("Package not found in the APKINDEX: " +
                                args.package)
         result = result[args.package]
-    print(json.dumps(result, indent=4))
+    print(json.dumps(result, indent=4,
+                     default=pmb.parse.apkindex.PackageRecord.as_dict))
 
 
 def pkgrel_bump(args):
@@ -574,7 +607,9 @@ def zap(args):
                    distfiles=args.distfiles, pkgs_local=args.pkgs_local,
                    pkgs_local_mismatch=args.pkgs_local_mismatch,
                    pkgs_online_mismatch=args.pkgs_online_mismatch,
-                   rust=args.rust, netboot=args.netboot)
+                   rust=args.rust, netboot=args.netboot,
+                   templates=args.templates,
+                   parse_cache=args.parse_cache)
 
     # Don't write the "Done" message
     pmb.helpers.logging.disable()
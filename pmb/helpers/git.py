@@ -269,3 +269,35 @@ def get_files(args, path):
             ret += [file]
 
     return ret
+
+
+def changed_files(args, path, revision_old, revision="HEAD"):
+    """Get the files that changed between two commits.
+
+    :param path: top dir of the git repository
+    :param revision_old: older commit, e.g. HEAD of a previous run
+    :param revision: newer commit
+    :returns: set of added, modified and removed files relative to path, or
+        None if revision_old does not exist (anymore)
+    """
+    command = ["git", "cat-file", "-e", f"{revision_old}^{{commit}}"]
+    if pmb.helpers.run.user(args, command, path, check=False):
+        return None
+
+    command = ["git", "diff", "--name-only", "--no-renames", "-z",
+               revision_old, revision, "--"]
+    output = pmb.helpers.run.user(args, command, path, output_return=True)
+    return set(filter(None, output.split("\0")))
+
+
+def dirty_files(args, path):
+    """Get the files with uncommitted changes, including untracked files.
+
+    :param path: top dir of the git repository
+    :returns: set of files relative to path
+    """
+    command = ["git", "status", "--porcelain", "--no-renames",
+               "--untracked-files=all", "-z"]
+    output = pmb.helpers.run.user(args, command, path, output_return=True)
+    # Each entry looks like "XY file", with X and Y being the status
+    return {entry[3:] for entry in output.split("\0") if entry}
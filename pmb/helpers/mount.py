@@ -1,23 +1,100 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 import os
+import re
 import pmb.helpers.run
 
 
+"""
+Snapshot of the mount table, see table(). It gets read again after
+invalidate() was called, which happens before pmbootstrap runs mount or
+umount commands.
+"""
+snapshot = None
+
+
+def unescape(path):
+    r"""Decode the octal escapes of the kernel in mount table paths.
+
+    :param path: e.g. "/mnt/my\040folder"
+    :returns: e.g. "/mnt/my folder"
+    """
+    return re.sub(r"\\([0-7]{3})", lambda match: chr(int(match[1], 8)),
+                  path)
+
+
+def mountinfo(path="/proc/self/mountinfo"):
+    """Parse a mountinfo file (see proc(5)).
+
+    :param path: can be changed for testcases
+    :returns: list of (mountpoint, source) tuples in the order of the file
+    """
+    ret = []
+    with open(path, "r") as handle:
+        for line in handle:
+            words = line.split()
+            if len(words) < 5 or "-" not in words[5:]:
+                raise RuntimeError(f"Failed to parse line in {path}: {line}")
+            separator = words.index("-", 5)
+            source = words[separator + 2] if len(words) > separator + 2 \
+                else ""
+            ret.append((unescape(words[4]), unescape(source)))
+    return ret
+
+
+def table():
+    """Get a snapshot of the mount table, read from /proc/self/mountinfo on
+    first use and after invalidate().
+
+    :returns: {"mountpoints": [...], "index": {...}, "sources": {...}} with
+              the mountpoints in the order of the mount table, and sets of
+              the mountpoints and sources for lookups
+    """
+    global snapshot
+    if snapshot is None:
+        entries = mountinfo()
+        snapshot = {"mountpoints": [mountpoint for mountpoint, _ in entries],
+                    "index": {mountpoint for mountpoint, _ in entries},
+                    "sources": {source for _, source in entries}}
+    return snapshot
+
+
+def invalidate(cmds=None):
+    """Drop the snapshot of the mount table, so it gets read again on the
+    next query.
+
+    :param cmds: list of commands that are about to run (each as list). If
+                 set, the snapshot is only dropped if one of them is a mount
+                 or umount command.
+    """
+    global snapshot
+    if cmds is None or any(os.path.basename(cmd[0]) in ["mount", "umount"]
+                           for cmd in cmds):
+        snapshot = None
+
+
+def mounted(folders):
+    """Check which of the given folders are mount points (or mounted
+    devices), with one lookup in the mount table snapshot each.
+
+    :param folders: list of paths
+    :returns: set of the paths from folders that are mounted
+    """
+    current = table()
+    ret = set()
+    for folder in folders:
+        path = os.path.realpath(folder)
+        if path in current["index"] or path in current["sources"]:
+            ret.add(folder)
+    return ret
+
+
 def ismount(folder):
     """Ismount() implementation that works for mount --bind.
 
     Workaround for: https://bugs.python.org/issue29707
     """
-    folder = os.path.realpath(os.path.realpath(folder))
-    with open("/proc/mounts", "r") as handle:
-        for line in handle:
-            words = line.split()
-            if len(words) >= 2 and words[1] == folder:
-                return True
-            if words[0] == folder:
-                return True
-    return False
+    return folder in mounted([folder])
 
 
 def bind(args, source, destination, create_folders=True, umount=False):
@@ -50,6 +127,37 @@ def bind(args, source, destination, create_folders=True, umount=False):
         raise RuntimeError("Mount failed: " + source + " -> " + destination)
 
 
+def overlay(args, lower, upper, work, destination):
+    """Mount an overlayfs with one read-only lower layer, and create the
+    necessary directory structure.
+
+    :param lower: folder with the lower layer, it does not get modified
+    :param upper: folder that gets all changes made in the destination
+    :param work: work folder of overlayfs, on the same filesystem as upper
+    :param destination: where the combined layers get mounted
+    """
+    if ismount(destination):
+        return
+
+    # Load the kernel module if necessary
+    with open("/proc/filesystems") as handle:
+        supported = "\toverlay\n" in handle.read()
+    if not supported:
+        # check=False: this might be built-in instead of being a module
+        pmb.helpers.run.root(args, ["modprobe", "overlay"], check=False)
+
+    pmb.helpers.run.root_batch(args, [
+        ["mkdir", "-p", upper, work, destination],
+        ["mount", "-t", "overlay", "-o",
+         f"lowerdir={lower},upperdir={upper},workdir={work}", "overlay",
+         destination]])
+
+    # Verify that it has worked
+    if not ismount(destination):
+        raise RuntimeError(f"Mount failed: overlay of {lower} -> "
+                           f"{destination}")
+
+
 def bind_file(args, source, destination, create_folders=False):
     """Mount a file with the --bind option, and create the destination file, if necessary."""
     # Skip existing mountpoint
@@ -70,36 +178,46 @@ def bind_file(args, source, destination, create_folders=False):
                                 destination])
 
 
-def umount_all_list(prefix, source="/proc/mounts"):
-    """Parse `/proc/mounts` for all folders beginning with a prefix.
+def umount_all_list(prefix, source=None):
+    """Get all mountpoints beginning with a prefix from the mount table.
 
-    :source: can be changed for testcases
+    :source: file in the format of /proc/mounts, can be set for testcases
+             (default: the mount table snapshot)
 
     :returns: a list of folders that need to be umounted
 
     """
+    if source:
+        mountpoints = []
+        with open(source, "r") as handle:
+            for line in handle:
+                words = line.split()
+                if len(words) < 2:
+                    raise RuntimeError("Failed to parse line in " + source +
+                                       ": " + line)
+                mountpoints.append(words[1])
+    else:
+        mountpoints = table()["mountpoints"]
+
     ret = []
     prefix = os.path.realpath(prefix)
-    with open(source, "r") as handle:
-        for line in handle:
-            words = line.split()
-            if len(words) < 2:
-                raise RuntimeError("Failed to parse line in " + source + ": " +
-                                   line)
-            mountpoint = words[1]
-            if mountpoint.startswith(prefix):
-                # Remove "\040(deleted)" suffix (#545)
-                deleted_str = r"\040(deleted)"
+    for mountpoint in mountpoints:
+        if mountpoint.startswith(prefix):
+            # Remove "\040(deleted)" suffix (#545)
+            for deleted_str in [r"\040(deleted)", " (deleted)"]:
                 if mountpoint.endswith(deleted_str):
                     mountpoint = mountpoint[:-len(deleted_str)]
-                ret.append(mountpoint)
+            ret.append(mountpoint)
     ret.sort(reverse=True)
     return ret
 
 
 def umount_all(args, folder):
     """Umount all folders that are mounted inside a given folder."""
-    for mountpoint in umount_all_list(folder):
-        pmb.helpers.run.root(args, ["umount", mountpoint])
-        if ismount(mountpoint):
+    mountpoints = umount_all_list(folder)
+    pmb.helpers.run.root_batch(args, [["umount", mountpoint]
+                                      for mountpoint in mountpoints])
+    still_mounted = mounted(mountpoints)
+    for mountpoint in mountpoints:
+        if mountpoint in still_mounted:
             raise RuntimeError("Failed to umount: " + mountpoint)
@@ -303,13 +303,19 @@ def init_cache():
     """Add a caching dict (caches parsing of files etc. for the current session)."""
     repo_update = {"404": [], "offline_msg_shown": False}
     cache = {"apkindex": {},
+             "apkindex_providers": {},
              "apkbuild": {},
+             "apkbuild_functions": {},
              "apk_min_version_checked": [],
              "apk_repository_list_updated": [],
              "built": {},
+             "pmb.chroot.init": {},
+             "pmb.build.cache": {},
              "find_aport": {},
+             "pmb.helpers.depgraph": {},
              "pmb.helpers.package.depends_recurse": {},
              "pmb.helpers.package.get": {},
+             "pmb.parse.depends.recurse": {},
              "pmb.helpers.repo.update": repo_update,
              "pmb.helpers.git.parse_channels_cfg": {},
              "pmb.config.pmaports.read_config": None,
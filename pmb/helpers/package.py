@@ -8,7 +8,6 @@ See also:
 
     - pmb/helpers/repo.py (work with binary package repos)
 """
-import copy
 import logging
 
 import pmb.helpers.pmaports
@@ -85,10 +84,11 @@ def get(args, pkgname, arch, replace_subpkgnames=False, must_exist=True):
             if ret:
                 break
 
-    # Copy ret (it might have references to caches of the APKINDEX or APKBUILDs
-    # and we don't want to modify those!)
+    # Copy ret, so we can replace keys below without modifying the caches of
+    # the APKINDEX or APKBUILDs. A shallow copy is enough, as the values are
+    # replaced and not modified.
     if ret:
-        ret = copy.deepcopy(ret)
+        ret = dict(ret)
 
     # Make sure ret["arch"] is a list (APKINDEX code puts a string there)
     if ret and isinstance(ret["arch"], str):
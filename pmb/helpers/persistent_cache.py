@@ -0,0 +1,172 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Cache expensive parsing results on disk, across pmbootstrap invocations.
+
+While pmb.helpers.other.cache only lives for the current session, the results
+stored here end up in $WORK/cache_parse and get reused by the next
+pmbootstrap call. Every entry is stored together with a fingerprint of its
+input (e.g. size and last modification time of the parsed file). An entry is
+only returned by load() if the fingerprint still matches, so callers never
+get outdated data.
+
+Each entry file consists of two pickles: a small header with the version and
+key, and the entry itself. The header is enough to find entries of files
+that don't exist anymore, which get removed the first time something is
+saved in the same namespace in a session.
+"""
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+import pmb.config
+
+# Set by init(), when None the persistent cache is disabled and load() / save()
+# do nothing (e.g. when running parsing functions without initialized args)
+path_base = None
+
+# Namespaces that were pruned in the current session
+pruned = set()
+
+
+def init(args):
+    """Enable the persistent cache for the current work folder."""
+    global path_base
+    path_base = f"{args.work}/cache_parse"
+
+
+def fingerprint_file(path, *extra):
+    """Generate a fingerprint for a file, without reading its content.
+
+    :param path: full path to the file
+    :param extra: additional values that influence the cached result
+    :returns: tuple, or None if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns, *extra)
+
+
+def _path(namespace, key):
+    digest = hashlib.sha1(str(key).encode("utf-8")).hexdigest()
+    return f"{path_base}/{namespace}/{digest}.pickle"
+
+
+def source_path(key):
+    """Get the path of the file or folder that an entry was created from.
+
+    :param key: key of the entry, a path or a tuple starting with a path
+    :returns: the path, or None if the key has no path
+    """
+    if isinstance(key, tuple) and key:
+        key = key[0]
+    if isinstance(key, str) and key.startswith("/"):
+        return key
+    return None
+
+
+def prune(namespace):
+    """Remove the entries of a namespace that have an outdated version, or
+    that were created from a path that does not exist anymore."""
+    for path in glob.glob(f"{path_base}/{namespace}/*.pickle"):
+        try:
+            with open(path, "rb") as handle:
+                header = pickle.load(handle)
+            source = source_path(header.get("key"))
+            if header.get("version") == pmb.config.parse_cache_version and \
+                    (not source or os.path.exists(source)):
+                continue
+        except Exception:
+            pass
+        logging.verbose(f"Removing outdated persistent cache entry {path}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def load(namespace, key, fingerprint):
+    """Get a cached result.
+
+    :param namespace: subfolder of the cache, e.g. "apkindex"
+    :param key: identifies the entry inside the namespace, e.g. a file path
+    :param fingerprint: must be equal to the fingerprint passed to save()
+    :returns: the cached value, or None if it does not exist or is outdated
+    """
+    if not path_base or fingerprint is None:
+        return None
+
+    path = _path(namespace, key)
+    try:
+        with open(path, "rb") as handle:
+            header = pickle.load(handle)
+            if header.get("version") != pmb.config.parse_cache_version or \
+                    header.get("key") != key:
+                return None
+            entry = pickle.load(handle)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.verbose(f"Ignoring broken persistent cache entry {path}: {e}")
+        return None
+
+    if entry.get("fingerprint") != fingerprint:
+        return None
+    return entry["value"]
+
+
+def save(namespace, key, fingerprint, value):
+    """Store a result in the cache, replacing existing entries atomically.
+
+    Failing to write the cache is not fatal, pmbootstrap will just need to
+    parse the file again in the next run. The first call for a namespace in
+    a session also removes its outdated entries, see prune().
+
+    :param namespace: subfolder of the cache, e.g. "apkindex"
+    :param key: identifies the entry inside the namespace, e.g. a file path
+    :param fingerprint: see fingerprint_file()
+    :param value: the data to store, must be picklable
+    """
+    if not path_base or fingerprint is None:
+        return
+    if not os.path.isdir(os.path.dirname(path_base)):
+        return
+
+    if namespace not in pruned:
+        pruned.add(namespace)
+        prune(namespace)
+
+    header = {"version": pmb.config.parse_cache_version, "key": key}
+    entry = {"fingerprint": fingerprint, "value": value}
+    path = _path(namespace, key)
+    folder = os.path.dirname(path)
+    path_temp = None
+    try:
+        os.makedirs(folder, exist_ok=True)
+        fd, path_temp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as handle:
+            pickle.dump(header, handle, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(entry, handle, pickle.HIGHEST_PROTOCOL)
+        os.replace(path_temp, path)
+    except OSError as e:
+        logging.verbose(f"Failed to write persistent cache entry {path}: {e}")
+        if path_temp and os.path.exists(path_temp):
+            os.remove(path_temp)
+
+
+def delete(namespace, key):
+    """Remove one entry from the cache.
+
+    :returns: True if an entry was removed, False otherwise
+    """
+    if not path_base:
+        return False
+    try:
+        os.remove(_path(namespace, key))
+        return True
+    except OSError:
+        return False
@@ -33,7 +33,7 @@ def package(args, pkgname, reason="", dry=False):
     pmb.helpers.file.replace(path, old, new)
 
     # Verify
-    del pmb.helpers.other.cache["apkbuild"][path]
+    pmb.parse._apkbuild.clear_cache(path)
     apkbuild = pmb.parse.apkbuild(path)
     if int(apkbuild["pkgrel"]) != pkgrel_new:
         raise RuntimeError("Failed to bump pkgrel for package '" + pkgname +
@@ -10,9 +10,68 @@ import glob
 import logging
 import os
 
+import pmb.helpers.persistent_cache
 import pmb.parse
 
 
+def _git_state(args):
+    """Get the state of the pmaports git repository, so it can be compared
+    with the state of a later pmbootstrap run in _changed_apkbuilds().
+
+    :returns: (head, dirty) with the commit of HEAD and a frozenset of files
+              with uncommitted changes, or None if pmaports is not the top
+              dir of a git repository
+    """
+    key = "pmb.helpers.pmaports.git_state"
+    if key in pmb.helpers.other.cache:
+        return pmb.helpers.other.cache[key]
+
+    ret = None
+    if os.path.exists(f"{args.aports}/.git"):
+        head = pmb.helpers.git.rev_parse(args, args.aports)
+        dirty = pmb.helpers.git.dirty_files(args, args.aports)
+        ret = (head, frozenset(dirty))
+
+    pmb.helpers.other.cache[key] = ret
+    return ret
+
+
+def _is_apkbuild(path):
+    """:param path: file path relative to pmaports
+    :returns: True if _find_apkbuilds() would find the file"""
+    parts = path.split("/")
+    if len(parts) < 2 or parts[-1] != "APKBUILD":
+        return False
+    return not any(part.startswith(".") for part in parts[:-1])
+
+
+def _changed_apkbuilds(args, git_state_old):
+    """Find the APKBUILDs that changed since a cache was built.
+
+    :param git_state_old: return value of _git_state() when the cache was
+                          built
+    :returns: set of full paths to APKBUILDs that were added, modified or
+              removed in the meantime, or None if that can't be determined
+              (then the whole cache needs to be built again)
+    """
+    git_state = _git_state(args)
+    if not git_state or not git_state_old:
+        return None
+
+    # Files that were dirty may have been reverted since then
+    head_old, dirty_old = git_state_old
+    head, dirty = git_state
+    files = dirty | dirty_old
+    if head != head_old:
+        committed = pmb.helpers.git.changed_files(args, args.aports, head_old,
+                                                  head)
+        if committed is None:
+            return None
+        files |= committed
+
+    return {f"{args.aports}/{file}" for file in files if _is_apkbuild(file)}
+
+
 def _find_apkbuilds(args):
     # Try to get a cached result first (we assume that the aports don't change
     # in one pmbootstrap call)
@@ -20,8 +79,24 @@ def _find_apkbuilds(args):
     if apkbuilds is not None:
         return apkbuilds
 
-    apkbuilds = {}
-    for apkbuild in glob.iglob(f"{args.aports}/**/*/APKBUILD", recursive=True):
+    # Update the list of the previous run with the APKBUILDs that git reports
+    # as changed, or look through all folders
+    pattern = f"{args.aports}/**/*/APKBUILD"
+    cached = pmb.helpers.persistent_cache.load("pmaports_apkbuilds",
+                                               args.aports, pattern)
+    changed = _changed_apkbuilds(args, cached["git"]) if cached else None
+    if changed is None:
+        apkbuilds = {}
+        paths = glob.iglob(pattern, recursive=True)
+    else:
+        apkbuilds = dict(cached["apkbuilds"])
+        for path in changed:
+            package = os.path.basename(os.path.dirname(path))
+            if apkbuilds.get(package) == path:
+                del apkbuilds[package]
+        paths = sorted(path for path in changed if os.path.exists(path))
+
+    for apkbuild in paths:
         package = os.path.basename(os.path.dirname(apkbuild))
         if package in apkbuilds:
             raise RuntimeError(f"Package {package} found in multiple aports "
@@ -33,6 +108,11 @@ def _find_apkbuilds(args):
     apkbuilds = dict(sorted(apkbuilds.items()))
 
     # Save result in cache
+    git_state = _git_state(args)
+    if not cached or cached["git"] != git_state:
+        pmb.helpers.persistent_cache.save("pmaports_apkbuilds", args.aports,
+                                          pattern, {"git": git_state,
+                                                    "apkbuilds": apkbuilds})
     pmb.helpers.other.cache["pmb.helpers.pmaports.apkbuilds"] = apkbuilds
     return apkbuilds
 
@@ -42,6 +122,29 @@ def get_list(args):
     return list(_find_apkbuilds(args).keys())
 
 
+def get_paths(args):
+    """:returns: dict of all pmaport pkgnames and the full paths to their
+                 APKBUILDs ({"hello-world": "/.../hello-world/APKBUILD"})"""
+    return dict(_find_apkbuilds(args))
+
+
+def parse_all(args, jobs=None):
+    """Parse all APKBUILDs of pmaports at once, in parallel.
+
+    The results get cached, so following pmb.parse.apkbuild() calls for the
+    same APKBUILDs return immediately.
+
+    :param jobs: amount of parallel processes, defaults to args.jobs
+    :returns: {pkgname: apkbuild, ...} with the parsed APKBUILDs, sorted by
+              pkgname
+    """
+    apkbuilds = _find_apkbuilds(args)
+    if jobs is None:
+        jobs = int(args.jobs)
+    parsed = pmb.parse.apkbuild_bulk(list(apkbuilds.values()), jobs)
+    return {pkgname: parsed[path] for pkgname, path in apkbuilds.items()}
+
+
 def guess_main_dev(args, subpkgname):
     """Check if a package without "-dev" at the end exists in pmaports or not, and log the appropriate message.
 
@@ -100,23 +203,15 @@ def guess_main(args, subpkgname):
             return os.path.dirname(path)
 
 
-def _find_package_in_apkbuild(package, path):
-    """Look through subpackages and all provides to see if the APKBUILD at the specified path
-    contains (or provides) the specified package.
+def _package_index_entry(apkbuild):
+    """Get the names an APKBUILD can be found with in package_index().
 
-    :param package: The package to search for
-    :param path: The path to the apkbuild
-    :return: True if the APKBUILD contains or provides the package
+    :param apkbuild: parsed APKBUILD
+    :returns: list of the subpackages and versioned provides (e.g.
+              "mkbootimg=0.0.1") of the package and its subpackages
     """
-    apkbuild = pmb.parse.apkbuild(path)
-
-    # Subpackages
-    if package in apkbuild["subpackages"]:
-        return True
-
-    # Search for provides in both package and subpackages
-    apkbuild_pkgs = [apkbuild, *apkbuild["subpackages"].values()]
-    for apkbuild_pkg in apkbuild_pkgs:
+    ret = list(apkbuild["subpackages"].keys())
+    for apkbuild_pkg in [apkbuild, *apkbuild["subpackages"].values()]:
         if not apkbuild_pkg:
             continue
 
@@ -125,13 +220,71 @@ def _find_package_in_apkbuild(package, path):
         for provides_i in apkbuild_pkg["provides"]:
             # Ignore provides without version, they shall never be
             # automatically selected
-            if "=" not in provides_i:
-                continue
+            if "=" in provides_i:
+                ret.append(provides_i.split("=", 1)[0])
+    return ret
 
-            if package == provides_i.split("=", 1)[0]:
-                return True
 
-    return False
+def package_index(args):
+    """Map the subpackages and versioned provides of all pmaports to their
+    APKBUILDs.
+
+    The index is stored in the persistent cache. Only APKBUILDs that were
+    added or modified since the last pmbootstrap run get parsed again (see
+    _changed_apkbuilds()).
+
+    :returns: {"packages": {name: path, ...}} with full paths to APKBUILDs,
+              see _package_index_entry() for the names. If multiple
+              APKBUILDs have the same name, the one with the alphabetically
+              first pkgname wins.
+    """
+    ret = pmb.helpers.other.cache.get("pmb.helpers.pmaports.package_index")
+    if ret is not None:
+        return ret
+
+    # Reuse entries of APKBUILDs that did not change. Ask git which ones
+    # changed, or compare size and modification time of all APKBUILDs.
+    apkbuilds = _find_apkbuilds(args)
+    schema = pmb.parse._apkbuild._cache_schema()
+    cached = pmb.helpers.persistent_cache.load("pmaports_index", args.aports,
+                                               schema)
+    entries_old = cached["entries"] if cached else {}
+    changed = _changed_apkbuilds(args, cached["git"]) if cached else None
+    entries = {}
+    outdated = {}
+    for path in apkbuilds.values():
+        entry = entries_old.get(path)
+        if entry and changed is not None and path not in changed:
+            entries[path] = entry
+            continue
+        stat = pmb.helpers.persistent_cache.fingerprint_file(path)
+        if entry and entry[0] == stat:
+            entries[path] = entry
+        else:
+            outdated[path] = stat
+
+    # Parse new and modified APKBUILDs
+    if outdated:
+        logging.verbose(f"Updating package index of pmaports ({len(outdated)}"
+                        " APKBUILDs)")
+        parsed = pmb.parse.apkbuild_bulk(list(outdated.keys()),
+                                         int(args.jobs))
+        for path, stat in outdated.items():
+            entries[path] = (stat, _package_index_entry(parsed[path]))
+    git_state = _git_state(args)
+    if not cached or cached["git"] != git_state or outdated or \
+            len(entries) != len(entries_old):
+        pmb.helpers.persistent_cache.save("pmaports_index", args.aports,
+                                          schema, {"git": git_state,
+                                                   "entries": entries})
+
+    ret = {"packages": {}}
+    for path in apkbuilds.values():
+        for name in entries[path][1]:
+            ret["packages"].setdefault(name, path)
+
+    pmb.helpers.other.cache["pmb.helpers.pmaports.package_index"] = ret
+    return ret
 
 
 def find(args, package, must_exist=True):
@@ -160,24 +313,24 @@ def find(args, package, must_exist=True):
             # No luck, take a guess what APKBUILD could have the package we are
             # looking for as subpackage
             guess = guess_main(args, package)
-            if guess:
-                # Parse the APKBUILD and verify if the guess was right
-                if _find_package_in_apkbuild(package, f'{guess}/APKBUILD'):
-                    ret = guess
-                else:
-                    # Otherwise parse all APKBUILDs (takes time!), is the
-                    # package we are looking for a subpackage of any of those?
-                    for path_current in _find_apkbuilds(args).values():
-                        if _find_package_in_apkbuild(package, path_current):
-                            ret = os.path.dirname(path_current)
-                            break
-
-                # If we still didn't find anything, as last resort: assume our
-                # initial guess was right and the APKBUILD parser just didn't
-                # find the subpackage in there because it is behind shell logic
-                # that we don't parse.
-                if not ret:
-                    ret = guess
+
+            # Parse the APKBUILD and verify if the guess was right. Otherwise
+            # look in the index: is the package we are looking for a
+            # subpackage of (or provided by) any APKBUILD?
+            if guess and package in _package_index_entry(
+                    pmb.parse.apkbuild(f"{guess}/APKBUILD")):
+                ret = guess
+            else:
+                path = package_index(args)["packages"].get(package)
+                if path:
+                    ret = os.path.dirname(path)
+
+            # If we still didn't find anything, as last resort: assume our
+            # initial guess was right and the APKBUILD parser just didn't
+            # find the subpackage in there because it is behind shell logic
+            # that we don't parse.
+            if not ret:
+                ret = guess
 
     # Crash when necessary
     if ret is None and must_exist:
@@ -198,7 +351,7 @@ def get(args, pkgname, must_exist=True, subpackages=True):
     :param pkgname: the package name to find
     :param must_exist: raise an exception when it can't be found
     :param subpackages: also search for subpackages with the specified
-        names (slow! might need to parse all APKBUILDs to find it)
+        names (see package_index())
 
     :returns: relevant variables from the APKBUILD as dictionary, e.g.:
                   { "pkgname": "hello-world",
@@ -0,0 +1,161 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Run short root commands through one long-lived privileged helper process
+(pmb.helpers.privileged_helper), instead of starting sudo (or doas) for each
+of them. The helper gets started on first use, once per process.
+"""
+import atexit
+import base64
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pmb.config
+import pmb.helpers.logging
+import pmb.helpers.privileged_helper
+import pmb.helpers.run_core
+
+# Popen of the helper, and the pid of the process that started it (forked
+# processes, e.g. from pmb.build.parallel, start their own helper)
+helper = None
+helper_pid = None
+
+
+def supported(args, cmd, output="log"):
+    """Check if a root command can run through the helper.
+
+    Only commands that are expected to finish quickly are run through the
+    helper, as their output only gets written to the log after they are
+    done.
+
+    :param cmd: command as list, without sudo
+    :param output: see pmb.helpers.run_core.core()
+    """
+    if "privileged_helper" in args and not args.privileged_helper:
+        return False
+    if "/" in cmd[0] and os.path.dirname(cmd[0]) not in \
+            pmb.helpers.privileged_helper.path:
+        return False
+    return output == "log" and os.path.basename(cmd[0]) in \
+        pmb.helpers.privileged_helper.programs
+
+
+def start(args):
+    """Start the helper for the current process, if it is not running."""
+    global helper
+    global helper_pid
+    if helper and helper_pid == os.getpid():
+        return
+    cmd = pmb.config.sudo([sys.executable, "-I",
+                           pmb.helpers.privileged_helper.__file__,
+                           os.path.normpath(args.work)])
+    logging.debug("Start privileged helper: " + " ".join(cmd))
+    helper = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE,
+                              stderr=pmb.helpers.logging.logfd)
+    helper_pid = os.getpid()
+    atexit.register(stop)
+
+
+def stop():
+    """Stop the helper of the current process."""
+    global helper
+    if not helper or helper_pid != os.getpid():
+        return
+    helper.stdin.close()
+    helper.wait()
+    helper.stdout.close()
+    helper = None
+
+
+def run_batch(args, commands, stop_on_error=True):
+    """Run commands as root through the helper, without logging them.
+
+    :param commands: list of dicts, see the module description
+    :param stop_on_error: skip the remaining commands after one failed
+    :returns: list of (code, output, timed_out) for each command that ran,
+              where output is bytes
+    """
+    start(args)
+    request = {"batch": commands, "stop_on_error": stop_on_error}
+    helper.stdin.write(json.dumps(request).encode() + b"\n")
+    helper.stdin.flush()
+    line = helper.stdout.readline()
+    if not line:
+        stop()
+        raise RuntimeError("The privileged helper exited unexpectedly, see"
+                           " the log for details: " + args.log)
+    return [(result["code"], base64.b64decode(result["output"]),
+             result["timed_out"])
+            for result in json.loads(line)["results"]]
+
+
+def _log_output(args, output, timed_out):
+    """Write the output of a command to the log."""
+    pmb.helpers.logging.logfd.buffer.write(output)
+    pmb.helpers.logging.logfd.flush()
+    if timed_out:
+        logging.info("Process did not write any output for " +
+                     str(args.timeout) + " seconds. Killing it.")
+        logging.info("NOTE: The timeout can be increased with"
+                     " 'pmbootstrap -t'.")
+
+
+def core(args, log_message, cmd, working_dir=None, output_return=False,
+         check=None, env={}, clean_env=False, disable_timeout=False,
+         chroot=None):
+    """Run a command through the helper and create a log entry. Same as
+    pmb.helpers.run_core.core() with output="log".
+
+    :param cmd: command as list, without sudo
+    :param env: environment variables for the command
+    :param clean_env: only pass env to the command, not the environment of
+                      the helper
+    :param chroot: full path to a chroot to run the command in, working_dir
+                   is inside the chroot then
+    """
+    pmb.helpers.run_core.sanity_checks("log", output_return, check)
+    logging.debug(log_message)
+    logging.verbose("run (privileged helper): " + str(cmd))
+
+    command = {"cmd": cmd, "cwd": working_dir, "env": env,
+               "clean_env": clean_env,
+               "timeout": None if disable_timeout else args.timeout,
+               "chroot": chroot}
+    code, output, timed_out = run_batch(args, [command])[0]
+    _log_output(args, output, timed_out)
+
+    if check is not False:
+        pmb.helpers.run_core.check_return_code(args, code, log_message)
+    return output.decode("utf-8") if output_return else code
+
+
+def core_batch(args, log_messages, cmds, working_dir=None, check=None,
+               env={}, clean_env=False, chroot=None):
+    """Run multiple commands through the helper with one request, and create
+    a log entry for each of them. The commands after a failing command are
+    skipped.
+
+    :param log_messages: list with one log message for each command
+    :param cmds: list of commands, each as list without sudo
+    :returns: exit code of the last command that ran
+
+    See core() for the other parameters.
+    """
+    commands = [{"cmd": cmd, "cwd": working_dir, "env": env,
+                 "clean_env": clean_env, "timeout": args.timeout,
+                 "chroot": chroot}
+                for cmd in cmds]
+    code = 0
+    results = run_batch(args, commands)
+    for log_message, cmd, result in zip(log_messages, cmds, results):
+        code, output, timed_out = result
+        logging.debug(log_message)
+        logging.verbose("run (privileged helper): " + str(cmd))
+        _log_output(args, output, timed_out)
+
+        if check is not False:
+            pmb.helpers.run_core.check_return_code(args, code, log_message)
+    return code
@@ -0,0 +1,189 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Privileged helper process, see pmb.helpers.privileged.
+
+This file gets started once per pmbootstrap process with
+"sudo python3 -I pmb/helpers/privileged_helper.py $WORK", so it must only
+import the standard library. It reads requests from stdin and writes
+responses to stdout, one JSON object per line:
+
+* request: {"batch": [command, ...], "stop_on_error": true}, where each
+  command is {"cmd": [...], "cwd": ..., "env": {...}, "clean_env": false,
+  "timeout": 900, "chroot": null}
+* response: {"results": [result, ...]}, where each result is
+  {"code": 0, "output": "<base64>", "timed_out": false}. Commands after a
+  failed one are skipped with stop_on_error.
+
+Only the programs listed in "programs" can be run, from the folders listed
+in "path". With "chroot", the command runs inside that chroot (which must
+be $WORK/chroot_*) and "cwd" is a path inside the chroot. Environment
+variables for the dynamic linker (LD_*) are not passed to the commands.
+Like with pmb.helpers.run_core.foreground_pipe(), a command that does not
+write any output for "timeout" seconds gets killed.
+"""
+import base64
+import json
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import time
+
+# Programs that the helper runs (first argument, as name or as absolute
+# path in one of the folders of "path"), on the host and inside chroots
+programs = ["chmod", "chown", "cp", "install", "kill", "ln", "mkdir",
+            "mknod", "mount", "mv", "rm", "rmdir", "touch", "truncate",
+            "umount"]
+
+# Folders the programs are looked up in, independent of $PATH
+path = ["/usr/sbin", "/usr/bin", "/sbin", "/bin"]
+
+# Work folder of pmbootstrap, set when starting the helper
+work = None
+
+
+def which(program, root="/"):
+    """Find the absolute path of an allowed program.
+
+    :param program: first argument of a command
+    :param root: look up the program inside this folder (a chroot)
+    :returns: absolute path to the program inside root, or None if it is
+              not allowed or does not exist
+    """
+    if os.path.basename(program) not in programs:
+        return None
+    if "/" in program:
+        folders = [os.path.dirname(program)]
+        if folders[0] not in path:
+            return None
+    else:
+        folders = path
+    for folder in folders:
+        ret = f"{folder}/{os.path.basename(program)}"
+        # lexists: symlinks inside chroots are relative to the chroot
+        if os.path.lexists(f"{root.rstrip('/')}{ret}"):
+            return ret
+    return None
+
+
+def chroot_allowed(chroot):
+    """Check if the helper may run commands inside a folder.
+
+    :param chroot: full path to the chroot
+    """
+    chroot = os.path.normpath(chroot)
+    if not work or os.path.islink(chroot) or not os.path.isdir(chroot):
+        return False
+    return os.path.dirname(chroot) == work and \
+        os.path.basename(chroot).startswith("chroot_")
+
+
+def _error(code, message):
+    """:returns: result dict for a command that did not run"""
+    output = f"privileged helper: {message}\n"
+    return {"code": code, "timed_out": False,
+            "output": base64.b64encode(output.encode()).decode()}
+
+
+def _run(command):
+    """Run one command of a request (in the helper).
+
+    :returns: result dict, see the module description
+    """
+    cmd = list(command["cmd"])
+    chroot = command.get("chroot")
+    if chroot:
+        if not chroot_allowed(chroot):
+            return _error(126, f"chroot not allowed: {chroot}")
+        chroot = os.path.normpath(chroot)
+    program = which(cmd[0], chroot or "/")
+    if not program:
+        return _error(126, f"program not allowed: {cmd[0]}")
+    cmd[0] = program
+
+    env = {} if command.get("clean_env") else os.environ.copy()
+    env.update(command.get("env") or {})
+    for key in list(env):
+        if key.startswith("LD_"):
+            del env[key]
+
+    cwd = command.get("cwd")
+    preexec_fn = None
+    if chroot:
+        def preexec_fn(cwd_chroot=cwd or "/"):
+            os.chroot(chroot)
+            os.chdir(cwd_chroot)
+        cwd = None
+
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL,
+                                   cwd=cwd, env=env, preexec_fn=preexec_fn,
+                                   start_new_session=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        return _error(127, e)
+
+    # Read output, kill the process group after being silent for too long
+    handle = process.stdout.fileno()
+    os.set_blocking(handle, False)
+    timeout = command.get("timeout")
+    timed_out = False
+    output = []
+    sel = selectors.DefaultSelector()
+    sel.register(handle, selectors.EVENT_READ)
+    last_output = time.perf_counter()
+    while process.poll() is None:
+        # Wake up regularly, children may keep the pipe open after the
+        # process is done
+        sel.select(min(timeout, 1) if timeout else 1)
+        if _read(handle, output):
+            last_output = time.perf_counter()
+        elif timeout and time.perf_counter() - last_output >= timeout:
+            timed_out = True
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            last_output = time.perf_counter()
+    _read(handle, output)
+    sel.close()
+    process.stdout.close()
+    return {"code": process.returncode, "timed_out": timed_out,
+            "output": base64.b64encode(b"".join(output)).decode()}
+
+
+def _read(handle, output):
+    """Read all currently available output of a command.
+
+    :returns: True if there was any output
+    """
+    ret = False
+    while True:
+        try:
+            chunk = os.read(handle, 65536)
+        except BlockingIOError:
+            return ret
+        if not chunk:
+            return ret
+        output.append(chunk)
+        ret = True
+
+
+def serve(handle_in, handle_out):
+    """Answer requests until handle_in is closed (in the helper)."""
+    for line in handle_in:
+        request = json.loads(line)
+        results = []
+        for command in request["batch"]:
+            results.append(_run(command))
+            if results[-1]["code"] and request.get("stop_on_error"):
+                break
+        handle_out.write(json.dumps({"results": results}) + "\n")
+        handle_out.flush()
+
+
+if __name__ == "__main__":
+    work = os.path.normpath(sys.argv[1])
+    serve(sys.stdin.buffer, sys.stdout)
@@ -190,6 +190,7 @@ def update(args, arch=None, force=False, existing_only=False):
         if not os.path.exists(target_folder):
             pmb.helpers.run.root(args, ["mkdir", "-p", target_folder])
         pmb.helpers.run.root(args, ["cp", temp, target])
+        pmb.parse.apkindex.clear_cache(target)
     pmb.helpers.cli.progress_flush(args)
 
     return True
@@ -3,6 +3,7 @@
 import logging
 
 import pmb.build
+import pmb.helpers.depgraph
 import pmb.helpers.package
 import pmb.helpers.pmaports
 
@@ -66,7 +67,7 @@ def get_relevant_packages(args, arch, pkgname=None, built=False):
             raise RuntimeError(pkgname + " can't be built for " + arch + ".")
         ret = pmb.helpers.package.depends_recurse(args, pkgname, arch)
     else:
-        ret = pmb.helpers.pmaports.get_list(args)
+        ret = list(pmb.helpers.pmaports.parse_all(args).keys())
         ret = filter_arch_packages(args, arch, ret)
     if built:
         ret = filter_aport_packages(args, arch, ret)
@@ -127,8 +128,14 @@ def generate(args, arch, overview, pkgname=None, built=False):
     logging.info("Calculate packages that need to be built ({}, {})"
                  "".format(packages_str, arch))
 
-    # Order relevant packages
+    # Order relevant packages, so dependencies get built first
     ret = get_relevant_packages(args, arch, pkgname, built)
+    graph = pmb.helpers.depgraph.get(args, arch)
+    ret = graph.topological_order(ret)
+    for cycle in graph.cycles():
+        if set(cycle) & set(ret):
+            logging.info("NOTE: circular dependency, the build order of these"
+                         f" packages may be wrong: {', '.join(cycle)}")
 
     # Output format
     if overview:
@@ -1,10 +1,25 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
+import pmb.helpers.mount
+import pmb.helpers.privileged
 import pmb.helpers.run_core
 from argparse import Namespace
 from typing import Any, Dict, List, Optional
 
 
+def log_message(cmd, working_dir=None, env={}):
+    """Readable log message for a command (without all the escaping).
+
+    :returns: e.g. "% FOO=bar cd /tmp; echo test"
+    """
+    ret = "% "
+    for key, value in env.items():
+        ret += key + "=" + value + " "
+    if working_dir:
+        ret += "cd " + working_dir + "; "
+    return ret + " ".join(cmd)
+
+
 def user(args: Namespace, cmd: List[str], working_dir: Optional[str]=None, output: str="log", output_return: bool=False,
          check: Optional[bool]=None, env: Dict[Any, Any]={}, sudo: bool=False) -> str:
     """
@@ -17,12 +32,7 @@ def user(args: Namespace, cmd: List[str], working_dir: Optional[str]=None, outpu
     arguments and the return value.
     """
     # Readable log message (without all the escaping)
-    msg = "% "
-    for key, value in env.items():
-        msg += key + "=" + value + " "
-    if working_dir:
-        msg += "cd " + working_dir + "; "
-    msg += " ".join(cmd)
+    msg = log_message(cmd, working_dir, env)
 
     # Add environment variables and run
     env = env.copy()
@@ -46,9 +56,49 @@ def root(args, cmd, working_dir=None, output="log", output_return=False,
     env = env.copy()
     pmb.helpers.run_core.add_proxy_env_vars(env)
 
+    # Read the mount table again after mount and umount commands
+    pmb.helpers.mount.invalidate([cmd])
+
+    # Short commands: run through the privileged helper
+    if pmb.helpers.privileged.supported(args, cmd, output):
+        msg = log_message(cmd, working_dir, env)
+        return pmb.helpers.privileged.core(args, msg, cmd, working_dir,
+                                           output_return, check, env)
+
     if env:
         cmd = ["sh", "-c", pmb.helpers.run_core.flat_cmd(cmd, env=env)]
     cmd = pmb.config.sudo(cmd)
 
     return user(args, cmd, working_dir, output, output_return, check, env,
                 True)
+
+
+def root_batch(args, cmds, working_dir=None, check=None, env={}):
+    """Run multiple commands on the host system as root, with one privileged
+    call instead of one sudo (or doas) call per command.
+
+    The commands run one after another, until one of them fails. If all of
+    them can run through the privileged helper, they get sent in one request
+    and each command gets its own log entry. Otherwise they run as one
+    "sh -c" command.
+
+    :param cmds: list of commands, each as list, e.g.
+                 [["mkdir", "-p", "/tmp/a"], ["touch", "/tmp/a/b"]]
+    :returns: exit code of the last command that ran
+
+    See root() for a description of the other arguments.
+    """
+    if not cmds:
+        return 0
+
+    pmb.helpers.mount.invalidate(cmds)
+    if all(pmb.helpers.privileged.supported(args, cmd) for cmd in cmds):
+        env = env.copy()
+        pmb.helpers.run_core.add_proxy_env_vars(env)
+        msgs = [log_message(cmd, working_dir, env) for cmd in cmds]
+        return pmb.helpers.privileged.core_batch(args, msgs, cmds,
+                                                 working_dir, check, env)
+
+    script = " && ".join(pmb.helpers.run_core.flat_cmd(cmd) for cmd in cmds)
+    return root(args, ["sh", "-c", script], working_dir, check=check,
+                env=env)
@@ -1,10 +1,12 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
+import contextlib
 import fcntl
 import logging
 import os
 import selectors
 import shlex
+import signal
 import subprocess
 import sys
 import threading
@@ -80,73 +82,149 @@ def pipe(cmd, working_dir=None):
     return ret
 
 
+# Read up to this many bytes of output at once in pipe_read()
+pipe_read_size = 1024 * 1024
+
+# Flush the log at most this often (seconds) while a process is running
+pipe_read_flush_interval = 0.5
+pipe_read_flushed = 0
+
+
 def pipe_read(process, output_to_stdout=False, output_return=False,
               output_return_buffer=False):
     """Read all output from a subprocess, copy it to the log and optionally stdout and a buffer variable.
 
     This is only meant to be called by foreground_pipe() below.
 
+    The output is read in big chunks with os.read() from the non-blocking
+    pipe. Output copied to stdout gets flushed right away (e.g. prompts
+    without a newline). The log gets flushed when the process has closed its
+    output, and otherwise at most every pipe_read_flush_interval seconds.
+
     :param process: subprocess.Popen instance
     :param output_to_stdout: copy all output to pmbootstrap's stdout
     :param output_return: when set to True, output_return_buffer will be
                           extended
     :param output_return_buffer: list of bytes that gets extended with the
                                  current output in case output_return is True.
+    :returns: True if the log was not flushed, foreground_pipe() calls
+              pipe_read() again when the flush is due
     """
+    global pipe_read_flushed
+    handle = process.stdout.fileno()
+    written = False
     while True:
         # Copy available output
-        out = process.stdout.readline()
-        if len(out):
-            pmb.helpers.logging.logfd.buffer.write(out)
-            if output_to_stdout:
-                sys.stdout.buffer.write(out)
-            if output_return:
-                output_return_buffer.append(out)
-            continue
-
-        # No more output (flush buffers)
-        pmb.helpers.logging.logfd.flush()
+        try:
+            out = os.read(handle, pipe_read_size)
+        except BlockingIOError:
+            out = None
+        if not out:
+            break
+        pmb.helpers.logging.logfd.buffer.write(out)
         if output_to_stdout:
-            sys.stdout.flush()
-        return
-
-
-def kill_process_tree(args, pid, ppids, sudo):
-    """Recursively kill a pid and its child processes.
-
-    :param pid: process id that will be killed
-    :param ppids: list of process id and parent process id tuples (pid, ppid)
-    :param sudo: use sudo to kill the process
+            sys.stdout.buffer.write(out)
+        if output_return:
+            output_return_buffer.append(out)
+        written = True
+
+    # No more output (flush buffers)
+    if output_to_stdout and written:
+        sys.stdout.flush()
+    now = time.perf_counter()
+    if out is None and now - pipe_read_flushed < pipe_read_flush_interval:
+        return True
+    pipe_read_flushed = now
+    pmb.helpers.logging.logfd.flush()
+    return False
+
+
+def process_tree(pid):
+    """Find a process and all of its descendants by walking /proc.
+
+    :param pid: process id of the parent
+    :returns: dict of {pid: pgid} with the process and its descendants, or
+              None if /proc can't be read
     """
-    if sudo:
-        pmb.helpers.run.root(args, ["kill", "-9", str(pid)],
-                             check=False)
-    else:
-        pmb.helpers.run.user(args, ["kill", "-9", str(pid)],
-                             check=False)
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+
+    children = {}
+    pgids = {}
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as handle:
+                stat = handle.read()
+        except OSError:
+            # Process exited in the meantime
+            continue
+        # The second field (comm) may contain spaces and parentheses
+        fields = stat[stat.rindex(")") + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        pgids[int(entry)] = int(fields[2])
+
+    ret = {}
+    todo = [pid]
+    while todo:
+        current = todo.pop()
+        if current in ret or current not in pgids:
+            continue
+        ret[current] = pgids[current]
+        todo += children.get(current, [])
+    return ret
 
-    for (child_pid, child_ppid) in ppids:
-        if child_ppid == str(pid):
-            kill_process_tree(args, child_pid, ppids, sudo)
+
+def has_terminal():
+    """:returns: True if pmbootstrap has a controlling terminal, which
+                 commands may read from (e.g. ssh asking for a password)"""
+    try:
+        os.close(os.open("/dev/tty", os.O_RDWR | os.O_NOCTTY))
+    except OSError:
+        return False
+    return True
 
 
 def kill_command(args, pid, sudo):
-    """Kill a command process and recursively kill its child processes.
+    """Kill a command process, its child processes and their process groups.
+
+    Commands started by foreground_pipe() without sudo, without output to
+    stdout and without a terminal are the leader of their own process group,
+    which gets killed as a whole. The processes found with process_tree()
+    and their process groups (except for the one of pmbootstrap) get killed
+    as well, to also catch processes that were started in a different
+    process group (e.g. by sudo) or session. With sudo, everything gets
+    killed in one privileged call.
 
     :param pid: process id that will be killed
     :param sudo: use sudo to kill the process
     """
-    cmd = ["ps", "-e", "-o", "pid,ppid"]
-    ret = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
-    ppids = []
-    proc_entries = ret.stdout.decode("utf-8").rstrip().split('\n')[1:]
-    for row in proc_entries:
-        items = row.split()
-        if len(items) != 2:
-            raise RuntimeError("Unexpected ps output: " + row)
-        ppids.append(items)
+    own_pgid = os.getpgid(0)
+    tree = process_tree(pid) or {}
+
+    # Kill the processes before their process groups, so children that were
+    # forked in the meantime get killed with the group
+    targets = [pid] + [child for child in tree if child != pid]
+    pgids = []
+    for pgid in tree.values():
+        if pgid != own_pgid and pgid not in pgids:
+            pgids.append(pgid)
+    targets += [-pgid for pgid in pgids]
+
+    if sudo:
+        pmb.helpers.run.root(args, ["kill", "-9", "--"] +
+                             [str(target) for target in targets],
+                             check=False)
+        return
 
-    kill_process_tree(args, pid, ppids, sudo)
+    for target in targets:
+        try:
+            os.kill(target, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
 
 
 def foreground_pipe(args, cmd, working_dir=None, output_to_stdout=False,
@@ -169,10 +247,17 @@ def foreground_pipe(args, cmd, working_dir=None, output_to_stdout=False,
               * output: ""
               * output: full program output string (output_return is True)
     """
-    # Start process in background (stdout and stderr combined)
+    # Start process in background (stdout and stderr combined). Without sudo,
+    # start it in its own process group, so kill_command() can kill the
+    # whole group. Not with sudo, not with output to stdout and not if there
+    # is a terminal: sudo, ssh, git etc. may ask for passwords on the
+    # terminal, which only works in the foreground process group. (sudo
+    # itself runs the command in a new process group if it uses a pty.)
+    own_group = not sudo and not output_to_stdout and not has_terminal()
     process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                                stderr=subprocess.STDOUT, cwd=working_dir,
-                               stdin=stdin)
+                               stdin=stdin,
+                               preexec_fn=os.setpgrp if own_group else None)
 
     # Make process.stdout non-blocking
     handle = process.stdout.fileno()
@@ -184,26 +269,43 @@ def foreground_pipe(args, cmd, working_dir=None, output_to_stdout=False,
     sel = selectors.DefaultSelector()
     sel.register(process.stdout, selectors.EVENT_READ)
     timeout = args.timeout if output_timeout else None
-    while process.poll() is None:
-        wait_start = time.perf_counter() if output_timeout else None
-        sel.select(timeout)
-
-        # On timeout raise error (we need to measure time on our own, because
-        # select() may exit early even if there is no data to read and the
-        # timeout was not reached.)
-        if output_timeout:
-            wait_end = time.perf_counter()
-            if wait_end - wait_start >= args.timeout:
+    last_output = time.perf_counter()
+    flush_pending = False
+    try:
+        while process.poll() is None:
+            # Wake up when the log needs to be flushed
+            wait = timeout
+            if flush_pending:
+                flush_due = max(0, pipe_read_flushed +
+                                pipe_read_flush_interval -
+                                time.perf_counter())
+                wait = flush_due if wait is None else min(wait, flush_due)
+            events = sel.select(wait)
+
+            # On timeout raise error (we need to measure time on our own,
+            # because select() may exit early even if there is no data to
+            # read and the timeout was not reached.)
+            now = time.perf_counter()
+            if events:
+                last_output = now
+            elif output_timeout and now - last_output >= args.timeout:
                 logging.info("Process did not write any output for " +
                              str(args.timeout) + " seconds. Killing it.")
                 logging.info("NOTE: The timeout can be increased with"
                              " 'pmbootstrap -t'.")
                 kill_command(args, process.pid, sudo)
+                last_output = now
                 continue
 
-        # Read all currently available output
-        pipe_read(process, output_to_stdout, output_return,
-                  output_buffer)
+            # Read all currently available output
+            flush_pending = pipe_read(process, output_to_stdout,
+                                      output_return, output_buffer)
+    except BaseException:
+        # The process does not get the SIGINT of ctrl+c from the terminal
+        # when it runs in its own process group, so don't leave it running
+        if own_group:
+            kill_command(args, process.pid, sudo)
+        raise
 
     # There may still be output after the process quit
     pipe_read(process, output_to_stdout, output_return, output_buffer)
@@ -243,16 +345,33 @@ def check_return_code(args, code, log_message):
                            log_message)
 
 
+# Timer of sudo_timer_iterate() that runs next, None while it is paused
+sudo_timer = None
+sudo_timer_lock = threading.Lock()
+
+
+def sudo_timer_schedule():
+    """Run sudo_timer_iterate() again in 60 seconds. Call this with
+    sudo_timer_lock held."""
+    global sudo_timer
+    sudo_timer = threading.Timer(interval=60, function=sudo_timer_iterate)
+    sudo_timer.daemon = True
+    sudo_timer.start()
+
+
 def sudo_timer_iterate():
     """Run sudo -v and schedule a new timer to repeat the same."""
-    if pmb.config.which_sudo() == "sudo":
-        subprocess.Popen(["sudo", "-v"]).wait()
-    else:
-        subprocess.Popen(pmb.config.sudo(["true"])).wait()
+    with sudo_timer_lock:
+        # Stopped by sudo_timer_paused()
+        current = threading.current_thread()
+        if isinstance(current, threading.Timer) and current is not sudo_timer:
+            return
 
-    timer = threading.Timer(interval=60, function=sudo_timer_iterate)
-    timer.daemon = True
-    timer.start()
+        if pmb.config.which_sudo() == "sudo":
+            subprocess.Popen(["sudo", "-v"]).wait()
+        else:
+            subprocess.Popen(pmb.config.sudo(["true"])).wait()
+        sudo_timer_schedule()
 
 
 def sudo_timer_start():
@@ -264,6 +383,29 @@ def sudo_timer_start():
     sudo_timer_iterate()
 
 
+@contextlib.contextmanager
+def sudo_timer_paused():
+    """Stop the sudo timer thread while the block runs, and start it again
+    afterwards. Use this around forking: the child process only gets the
+    thread that forked, and would keep any lock held by the timer thread
+    locked forever."""
+    global sudo_timer
+    with sudo_timer_lock:
+        timer = sudo_timer
+        sudo_timer = None
+    if not timer:
+        yield
+        return
+
+    timer.cancel()
+    timer.join()
+    try:
+        yield
+    finally:
+        with sudo_timer_lock:
+            sudo_timer_schedule()
+
+
 def add_proxy_env_vars(env):
     """Add proxy environment variables from host to the environment of the command we are running.
 
@@ -45,10 +45,13 @@ def mount_disk(args, path):
     # Sanity checks
     if not os.path.exists(path):
         raise RuntimeError(f"The disk block device does not exist: {path}")
-    for path_mount in glob.glob(f"{path}*"):
-        if pmb.helpers.mount.ismount(path_mount):
-            raise RuntimeError(f"{path_mount} is mounted! Will not attempt to"
-                               " format this!")
+    # Read the mount table again, the disk may have been mounted by the host
+    # system (e.g. automount) after pmbootstrap read it
+    pmb.helpers.mount.invalidate()
+    mounted = pmb.helpers.mount.mounted(glob.glob(f"{path}*"))
+    if mounted:
+        raise RuntimeError(f"{min(mounted)} is mounted! Will not attempt to"
+                           " format this!")
     logging.info(f"(native) mount /dev/install (host: {path})")
     pmb.helpers.mount.bind_file(args, path,
                                 args.work + "/chroot_native/dev/install")
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 from pmb.parse.arguments import arguments, arguments_install, arguments_flasher, get_parser
 from pmb.parse._apkbuild import apkbuild
+from pmb.parse._apkbuild import apkbuild_bulk
 from pmb.parse._apkbuild import function_body
 from pmb.parse.binfmt_info import binfmt_info
 from pmb.parse.deviceinfo import deviceinfo
@@ -1,13 +1,19 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 # mypy: disable-error-code="attr-defined"
+import concurrent.futures
+import hashlib
 import logging
+import multiprocessing
 import os
 import re
 from collections import OrderedDict
 
 import pmb.config
 import pmb.helpers.devices
+import pmb.helpers.logging
+import pmb.helpers.other
+import pmb.helpers.persistent_cache
 import pmb.parse.version
 
 # sh variable name regex: https://stackoverflow.com/a/2821201/3527128
@@ -27,6 +33,9 @@ revar4 = re.compile(r"\${([a-zA-Z_]+[a-zA-Z0-9_]*)#(.*)}")
 # foo=
 revar5 = re.compile(r"([a-zA-Z_]+[a-zA-Z0-9_]*)=")
 
+# Parse fewer APKBUILDs than this sequentially in apkbuild_bulk()
+apkbuild_bulk_min_paths = 32
+
 
 def replace_variable(apkbuild, value: str) -> str:
     def log_key_not_found(match):
@@ -94,21 +103,55 @@ def function_body(path, func):
     :param func: name of function to get the body of.
     :returns: function body in an array of strings.
     """
-    func_body = []
-    in_func = False
-    lines = read_file(path)
-    for line in lines:
-        if in_func:
-            if line.startswith("}"):
-                in_func = False
-                break
-            func_body.append(line)
+    lines, functions = _read_functions(path)
+    if func not in functions:
+        return []
+    start, end = functions[func]
+    return lines[start:end]
+
+
+def function_ranges(lines):
+    """
+    Find all functions in an APKBUILD, so their bodies can be looked up
+    without going through all lines again.
+
+    :param lines: contents of an APKBUILD as list of strings
+    :returns: {name: (start, end), ...} with the range of lines of each
+              function body: start is the line after "name() {", end is the
+              next line starting with "}" (not included), or None if there is
+              no such line. Only the first function with the same name is
+              listed.
+    """
+    ret = {}
+    unfinished = []
+    for i, line in enumerate(lines):
+        if line.startswith("}"):
+            for name in unfinished:
+                ret[name] = (ret[name][0], i)
+            unfinished = []
             continue
-        else:
-            if line.startswith(func + "() {"):
-                in_func = True
-                continue
-    return func_body
+        pos = line.find("() {")
+        if pos > 0 and line[:pos] not in ret:
+            ret[line[:pos]] = (i + 1, None)
+            unfinished.append(line[:pos])
+    return ret
+
+
+def _read_functions(path):
+    """
+    Read an APKBUILD and find its functions, cached for the current session
+    as long as the file does not change.
+
+    :param path: full path to the APKBUILD
+    :returns: (lines, functions) as returned by read_file() and
+              function_ranges()
+    """
+    cache = pmb.helpers.other.cache["apkbuild_functions"]
+    stat = pmb.helpers.persistent_cache.fingerprint_file(path)
+    if path not in cache or cache[path][0] != stat:
+        lines = read_file(path)
+        cache[path] = (stat, lines, function_ranges(lines))
+    return cache[path][1:]
 
 
 def read_file(path):
@@ -186,7 +229,8 @@ def parse_next_attribute(lines, i, path):
                        f" attribute '{attribute}' in: {path}")
 
 
-def _parse_attributes(path, lines, apkbuild_attributes, ret):
+def _parse_attributes(path, lines, apkbuild_attributes, ret,
+                      functions=None):
     """
     Parse attributes from a list of lines. Variables are replaced with values
     from ret (if found) and split into the format configured in
@@ -195,6 +239,7 @@ def _parse_attributes(path, lines, apkbuild_attributes, ret):
     :param lines: the lines to parse
     :param apkbuild_attributes: the attributes to parse
     :param ret: a dict to update with new parsed variable
+    :param functions: function_ranges() of lines, if already known
     """
     # Parse all variables first, and replace variables mentioned earlier
     for i in range(len(lines)):
@@ -205,9 +250,12 @@ def _parse_attributes(path, lines, apkbuild_attributes, ret):
 
     if "subpackages" in apkbuild_attributes:
         subpackages = OrderedDict()
+        if functions is None:
+            functions = function_ranges(lines)
         for subpkg in ret["subpackages"].split(" "):
             if subpkg:
-                _parse_subpackage(path, lines, ret, subpackages, subpkg)
+                _parse_subpackage(path, lines, functions, ret, subpackages,
+                                  subpkg)
         ret["subpackages"] = subpackages
 
     # Split attributes
@@ -227,7 +275,7 @@ def _parse_attributes(path, lines, apkbuild_attributes, ret):
             del ret[attribute]
 
 
-def _parse_subpackage(path, lines, apkbuild, subpackages, subpkg):
+def _parse_subpackage(path, lines, functions, apkbuild, subpackages, subpkg):
     """
     Attempt to parse attributes from a subpackage function.
     This will attempt to locate the subpackage function in the APKBUILD and
@@ -235,6 +283,8 @@ def _parse_subpackage(path, lines, apkbuild, subpackages, subpkg):
 
     :param path: path to APKBUILD
     :param lines: the lines to parse
+    :param functions: the functions in lines, as returned by
+                      function_ranges()
     :param apkbuild: dict of attributes already parsed from APKBUILD
     :param subpackages: the subpackages dict to update
     :param subpkg: the subpackage to parse
@@ -258,16 +308,8 @@ def _parse_subpackage(path, lines, apkbuild, subpackages, subpkg):
         subpkgsplit = subpkgparts[1]
 
     # Find start and end of package function
-    start = end = 0
     prefix = subpkgsplit + "() {"
-    for i in range(len(lines)):
-        if lines[i].startswith(prefix):
-            start = i + 1
-        elif start and lines[i].startswith("}"):
-            end = i
-            break
-
-    if not start:
+    if subpkgsplit not in functions:
         # Unable to find subpackage function in the APKBUILD.
         # The subpackage function could be actually missing, or this is a
         # problem in the parser. For now we also don't handle subpackages with
@@ -280,7 +322,8 @@ def _parse_subpackage(path, lines, apkbuild, subpackages, subpkg):
             f"subpackage '{subpkgname}' not found, ignoring")
         return
 
-    if not end:
+    start, end = functions[subpkgsplit]
+    if end is None:
         raise RuntimeError(
             f"Could not find end of subpackage function, no line starts with "
             f"'}}' after '{prefix}' in {path}")
@@ -310,6 +353,30 @@ def _parse_subpackage(path, lines, apkbuild, subpackages, subpkg):
     subpackages[subpkgname] = ret
 
 
+def _cache_schema():
+    """Fingerprint of the attributes we parse, so results from the persistent
+    cache get discarded when pmb.config.apkbuild_attributes changes."""
+    schema = repr((pmb.config.apkbuild_attributes,
+                   pmb.config.apkbuild_package_attributes))
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+
+def clear_cache(path):
+    """Forget the parsed APKBUILD, after the file has been modified.
+
+    Checking the timestamp is not enough to detect all modifications (e.g.
+    when pkgrel gets increased by pmbootstrap in the same second as it has
+    been parsed, on file systems with coarse timestamps).
+
+    :param path: full path to the APKBUILD
+    """
+    if path in pmb.helpers.other.cache["apkbuild"]:
+        del pmb.helpers.other.cache["apkbuild"][path]
+    if path in pmb.helpers.other.cache["apkbuild_functions"]:
+        del pmb.helpers.other.cache["apkbuild_functions"][path]
+    pmb.helpers.persistent_cache.delete("apkbuild", os.path.realpath(path))
+
+
 def apkbuild(path, check_pkgver=True, check_pkgname=True):
     """
     Parse relevant information out of the APKBUILD file. This is not meant
@@ -329,12 +396,31 @@ def apkbuild(path, check_pkgver=True, check_pkgname=True):
     if path in pmb.helpers.other.cache["apkbuild"]:
         return pmb.helpers.other.cache["apkbuild"][path]
 
-    # Read the file and check line endings
-    lines = read_file(path)
-
-    # Parse all attributes from the config
-    ret = {key: "" for key in pmb.config.apkbuild_attributes.keys()}
-    _parse_attributes(path, lines, pmb.config.apkbuild_attributes, ret)
+    # Try to get the result of a previous pmbootstrap run. Use it if the
+    # file was not modified, or if only the timestamp changed (e.g. after
+    # switching git branches back and forth).
+    path_real = os.path.realpath(path)
+    stat = pmb.helpers.persistent_cache.fingerprint_file(path_real)
+    entry = pmb.helpers.persistent_cache.load("apkbuild", path_real,
+                                              _cache_schema())
+    if entry and entry["stat"] == stat:
+        ret = entry["ret"]
+    else:
+        # Read the file and check line endings (the function ranges get
+        # cached for function_body() as well)
+        lines, functions = _read_functions(path)
+        sha = hashlib.sha256("".join(lines).encode("utf-8")).hexdigest()
+        if entry and entry["sha"] == sha:
+            ret = entry["ret"]
+        else:
+            # Parse all attributes from the config
+            ret = {key: "" for key in pmb.config.apkbuild_attributes.keys()}
+            _parse_attributes(path, lines, pmb.config.apkbuild_attributes,
+                              ret, functions)
+        pmb.helpers.persistent_cache.save("apkbuild", path_real,
+                                          _cache_schema(),
+                                          {"stat": stat, "sha": sha,
+                                           "ret": ret})
 
     # Sanity check: pkgname
     suffix = f"/{ret['pkgname']}/APKBUILD"
@@ -359,6 +445,47 @@ def apkbuild(path, check_pkgver=True, check_pkgname=True):
     return ret
 
 
+def _apkbuild_bulk_init(path_base):
+    """Set up a process of the pool in apkbuild_bulk()."""
+    pmb.helpers.logging.add_verbose_log_level()
+    pmb.helpers.other.init_cache()
+    pmb.helpers.persistent_cache.path_base = path_base
+
+
+def apkbuild_bulk(paths, jobs=None):
+    """
+    Parse many APKBUILDs at once, in parallel with a process pool. The
+    results are the same as with apkbuild(), and get stored in the cache of
+    the current session, so following apkbuild() calls with the same paths
+    don't need to parse them again. The processes are started with a fork
+    server, as forking pmbootstrap itself is not safe while other threads
+    (e.g. the sudo timer) are running.
+
+    :param paths: list of full paths to APKBUILDs
+    :param jobs: amount of parallel processes, defaults to the CPU count
+    :returns: {path: apkbuild, ...} with the return values of apkbuild(), in
+              the same order as paths
+    """
+    cache = pmb.helpers.other.cache["apkbuild"]
+    todo = [path for path in paths if path not in cache]
+    jobs = jobs or os.cpu_count() or 1
+
+    # Starting the processes is only worth it when there is enough to do
+    if jobs > 1 and len(todo) >= apkbuild_bulk_min_paths:
+        logging.verbose(f"Parsing {len(todo)} APKBUILDs with {jobs} jobs")
+        chunksize = len(todo) // (jobs * 4) + 1
+        context = multiprocessing.get_context("forkserver")
+        with concurrent.futures.ProcessPoolExecutor(
+                jobs, mp_context=context, initializer=_apkbuild_bulk_init,
+                initargs=(pmb.helpers.persistent_cache.path_base,)) \
+                as executor:
+            for path, ret in zip(todo, executor.map(apkbuild, todo,
+                                                    chunksize=chunksize)):
+                cache[path] = ret
+
+    return {path: apkbuild(path) for path in paths}
+
+
 def kernels(args, device):
     """
     Get the possible kernels from a device-* APKBUILD.
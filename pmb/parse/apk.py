@@ -0,0 +1,162 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Read the metadata of .apk files without extracting them.
+
+An apk is a concatenation of gzip streams: the optional signature (tar with
+.SIGN.* files), the control segment (tar with .PKGINFO and install
+scripts) and the data segment (tar with the files of the package). Only the
+first segments are decompressed, unless the file list is requested.
+"""
+import base64
+import concurrent.futures
+import glob
+import gzip
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import tarfile
+import zlib
+
+# Keys of .PKGINFO that can appear multiple times
+pkginfo_list_keys = ["depend", "provides", "replaces", "install_if",
+                     "triggers"]
+
+# Read fewer apks than this sequentially in read_repo()
+read_repo_min_apks = 32
+
+
+def parse_pkginfo(text):
+    """Parse the content of a .PKGINFO file.
+
+    :param text: content of the .PKGINFO file
+    :returns: dict with the keys from the file, e.g. {"pkgname": "hello",
+              "pkgver": "1-r0", "depend": ["so:libc.musl-x86_64.so.1"],
+              ...}. The keys in pkginfo_list_keys are always lists.
+    """
+    ret = {key: [] for key in pkginfo_list_keys}
+    for line in text.splitlines():
+        if line.startswith("#") or " = " not in line:
+            continue
+        key, value = line.split(" = ", 1)
+        if key in pkginfo_list_keys:
+            ret[key] += value.split(" ")
+        else:
+            ret[key] = value
+    return ret
+
+
+def _read_segment(handle, chunk_size=65536):
+    """Decompress the next gzip stream of an apk.
+
+    :param handle: binary file handle, positioned at the start of the stream
+                   (and after its end when returning)
+    :returns: (data, digest) with the decompressed bytes and the sha1 hash of
+              the compressed bytes, or None at the end of the file
+    """
+    decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    sha1 = hashlib.sha1()
+    data = []
+    while not decompress.eof:
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            if not data:
+                return None
+            raise RuntimeError(f"Unexpected end of file: {handle.name}")
+        data.append(decompress.decompress(chunk))
+        if decompress.eof:
+            unused = len(decompress.unused_data)
+            sha1.update(chunk[:len(chunk) - unused])
+            handle.seek(-unused, os.SEEK_CUR)
+        else:
+            sha1.update(chunk)
+    return (b"".join(data), sha1.digest())
+
+
+def read(path, files=False):
+    """Read the .PKGINFO of an apk file.
+
+    :param path: full path to the .apk file
+    :param files: also list the files of the package (this needs to
+                  decompress the whole apk)
+    :returns: return value of parse_pkginfo(), with additional keys:
+              - "checksum": same as the "C:" field of the APKINDEX, e.g.
+              "Q1ZmJ4G6H3u6Dyu9GWYBLQ0OAGvb4="
+              - "files": (only with files=True) list of files, folders and
+              symlinks in the package, e.g. ["usr", "usr/bin",
+              "usr/bin/hello"]
+    """
+    with open(path, "rb") as handle:
+        # Signature and control segment
+        while True:
+            segment = _read_segment(handle)
+            if not segment:
+                raise RuntimeError(f"No .PKGINFO found in apk: {path}")
+            data, digest = segment
+            with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+                try:
+                    member = tar.getmember(".PKGINFO")
+                except KeyError:
+                    continue
+                pkginfo = tar.extractfile(member).read().decode("utf-8")
+                break
+
+        ret = parse_pkginfo(pkginfo)
+        ret["checksum"] = "Q1" + base64.b64encode(digest).decode()
+
+        # Data segment
+        if files:
+            with gzip.GzipFile(fileobj=handle) as data:
+                with tarfile.open(fileobj=data, mode="r|") as tar:
+                    ret["files"] = [member.name for member in tar]
+    return ret
+
+
+def _read_or_error(path, files):
+    """Run read() for read_repo(), and return errors instead of raising them.
+
+    :returns: (apk, None) with the return value of read(), or (None, error)
+              with an error message if the apk is broken (e.g. truncated)
+    """
+    try:
+        return (read(path, files), None)
+    except (EOFError, OSError, RuntimeError, UnicodeDecodeError,
+            tarfile.TarError, zlib.error) as e:
+        return (None, str(e) or type(e).__name__)
+
+
+def read_repo(path, files=False, jobs=None):
+    """Read all apk files of a repository folder, in parallel with a process
+    pool.
+
+    :param path: full path to the folder, e.g. "$WORK/packages/edge/x86_64"
+    :param files: see read()
+    :param jobs: amount of parallel processes, defaults to the CPU count
+    :returns: {filename: apk, ...} with the return values of read(), sorted
+              by filename (e.g. {"hello-1-r0.apk": {...}, ...}). The value
+              is None for apks that could not be read (a warning gets
+              printed for them).
+    """
+    paths = sorted(glob.glob(f"{path}/*.apk"))
+    jobs = jobs or os.cpu_count() or 1
+    files = [files] * len(paths)
+
+    # Starting the processes is only worth it when there is enough to do
+    if jobs > 1 and len(paths) >= read_repo_min_apks:
+        logging.verbose(f"Reading {len(paths)} apks with {jobs} jobs")
+        chunksize = len(paths) // (jobs * 4) + 1
+        context = multiprocessing.get_context("forkserver")
+        with concurrent.futures.ProcessPoolExecutor(
+                jobs, mp_context=context) as executor:
+            apks = list(executor.map(_read_or_error, paths, files,
+                                     chunksize=chunksize))
+    else:
+        apks = list(map(_read_or_error, paths, files))
+
+    ret = {}
+    for path_apk, (apk, error) in zip(paths, apks):
+        if error:
+            logging.warning(f"WARNING: failed to read {path_apk}: {error}")
+        ret[os.path.basename(path_apk)] = apk
+    return ret
@@ -1,15 +1,166 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 import collections
+import collections.abc
+import contextlib
+import io
 import logging
 import os
+import re
+import sys
 import tarfile
 import pmb.chroot.apk
 import pmb.helpers.package
+import pmb.helpers.persistent_cache
 import pmb.helpers.repo
 import pmb.parse.version
 
 
+# Keys we parse from APKINDEX blocks, indexed by the prefix of their line
+block_keys = {
+    "A:": "arch",
+    "D:": "depends",
+    "o:": "origin",
+    "P:": "pkgname",
+    "p:": "provides",
+    "k:": "provider_priority",
+    "t:": "timestamp",
+    "V:": "version",
+}
+
+# Package names in "depends" and "provides" values, without the version
+# operators, e.g. "so:libc.musl-x86_64.so.1=1 cmd:curl" -> ["so:...", "cmd:..."]
+# (only for values without "<" and "~", see block_list())
+re_block_list = re.compile(r"(?:^| )([^ <>=~]*)[^ ]*")
+
+# Amount of characters read at once from the APKINDEX
+read_chunk_size = 1024 * 1024
+
+
+class PackageRecord(collections.abc.Mapping):
+    """Package data from one APKINDEX block.
+
+    The index data of all architectures and repositories stays in the cache
+    for the whole session, so this uses much less memory than a dict per
+    package. Strings that repeat across many packages are interned, and the
+    depends/provides lists are tuples. Records are read-only, so they can be
+    shared with all callers without copying them.
+
+    Records can be used like the dict that was returned in previous versions
+    of parse_next_block(), including comparing them with such dicts. Keys
+    that are not set in the block (e.g. "origin" and "timestamp" for virtual
+    packages, see parse_next_block()) are not in the mapping.
+    """
+    __slots__ = tuple(block_keys.values())
+
+    def __init__(self, block):
+        """:param block: dict with keys from block_keys, already formatted by
+                         block_finish()"""
+        for key, value in block.items():
+            _package_record_setters[key](self, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("PackageRecord is read-only")
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Mapping):
+            return NotImplemented
+        if isinstance(other, PackageRecord):
+            other = other.as_dict()
+        return self.as_dict() == dict(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def __reduce__(self):
+        return (PackageRecord, (dict(self),))
+
+    def as_dict(self):
+        """:returns: the record as dict with lists, e.g. for json.dumps()"""
+        ret = dict(self)
+        for key in ["depends", "provides"]:
+            ret[key] = list(ret[key])
+        return ret
+
+
+# Set the attributes of the read-only PackageRecord
+_package_record_setters = {key: PackageRecord.__dict__[key].__set__
+                           for key in PackageRecord.__slots__}
+
+
+def block_list(value):
+    """Split a "depends" or "provides" value of an APKINDEX block into the
+    package names, without version operators.
+
+    Each name gets cut at the first ">", otherwise at the first "=", "<" or
+    "~" (in that order), so "foo<=1" becomes "foo<".
+
+    :param value: e.g. "so:libc.musl-x86_64.so.1=1 cmd:curl", or None
+    :returns: tuple of names, e.g. ("so:libc.musl-x86_64.so.1", "cmd:curl")
+    """
+    if not value:
+        return ()
+    intern = sys.intern
+    if "<" not in value and "~" not in value:
+        return tuple(map(intern, re_block_list.findall(value)))
+
+    ret = []
+    for name in value.split(" "):
+        for operator in [">", "=", "<", "~"]:
+            if operator in name:
+                name = name.split(operator)[0]
+                break
+        ret.append(intern(name))
+    return tuple(ret)
+
+
+def block_finish(path, block):
+    """Verify and format a block after all its lines have been read.
+
+    :param path: to the APKINDEX.tar.gz (for error messages)
+    :param block: dictionary with all keys from block_keys that were found in
+                  the block, with the unmodified values
+    :returns: PackageRecord of the block, see parse_next_block()
+    """
+    # Check for required keys
+    if "arch" not in block or "pkgname" not in block or \
+            "version" not in block:
+        for key in ["arch", "pkgname", "version"]:
+            if key not in block:
+                raise RuntimeError(f"Missing required key '{key}' in block "
+                                   f"{block}, file: {path}")
+
+    # Format optional lists, ignore all operators for now
+    block["depends"] = block_list(block.get("depends"))
+    block["provides"] = block_list(block.get("provides"))
+
+    # Share strings that are the same for many packages
+    intern = sys.intern
+    block["arch"] = intern(block["arch"])
+    block["pkgname"] = intern(block["pkgname"])
+    if "origin" in block:
+        block["origin"] = intern(block["origin"])
+    return PackageRecord(block)
+
+
 def parse_next_block(path, lines, start):
     """Parse the next block in an APKINDEX.
 
@@ -18,11 +169,11 @@ def parse_next_block(path, lines, start):
                   function. Wrapped into a list, so it can be modified
                   "by reference". Example: [5]
     :param lines: all lines from the "APKINDEX" file inside the archive
-    :returns: Dictionary with the following structure:
-              ``{ "arch": "noarch", "depends": ["busybox-extras", "lddtree", ... ],
+    :returns: PackageRecord (read-only mapping) with the following structure:
+              ``{ "arch": "noarch", "depends": ("busybox-extras", "lddtree", ... ),
               "origin": "postmarketos-mkinitfs",
               "pkgname": "postmarketos-mkinitfs",
-              "provides": ["mkinitfs=0.0.1"],
+              "provides": ("mkinitfs",),
               "timestamp": "1500000000",
               "version": "0.0.4-r10" }``
 
@@ -34,17 +185,6 @@ def parse_next_block(path, lines, start):
     """
     # Parse until we hit an empty line or end of file
     ret = {}
-    mapping = {
-        "A": "arch",
-        "D": "depends",
-        "o": "origin",
-        "P": "pkgname",
-        "p": "provides",
-        "k": "provider_priority",
-        "t": "timestamp",
-        "V": "version",
-    }
-    end_of_block_found = False
     for i in range(start[0], len(lines)):
         # Check for empty line
         start[0] = i + 1
@@ -52,50 +192,89 @@ def parse_next_block(path, lines, start):
         if not isinstance(line, str):
             line = line.decode()
         if line == "\n":
-            end_of_block_found = True
-            break
+            return block_finish(path, ret)
 
         # Parse keys from the mapping
-        for letter, key in mapping.items():
-            if line.startswith(letter + ":"):
-                if key in ret:
-                    raise RuntimeError(
-                        "Key " + key + " (" + letter + ":) specified twice"
-                        " in block: " + str(ret) + ", file: " + path)
-                ret[key] = line[2:-1]
-
-    # Format and return the block
-    if end_of_block_found:
-        # Check for required keys
-        for key in ["arch", "pkgname", "version"]:
-            if key not in ret:
-                raise RuntimeError(f"Missing required key '{key}' in block "
-                                   f"{ret}, file: {path}")
-
-        # Format optional lists
-        for key in ["provides", "depends"]:
-            if key in ret and ret[key] != "":
-                # Ignore all operators for now
-                values = ret[key].split(" ")
-                ret[key] = []
-                for value in values:
-                    for operator in [">", "=", "<", "~"]:
-                        if operator in value:
-                            value = value.split(operator)[0]
-                            break
-                    ret[key].append(value)
-            else:
-                ret[key] = []
-        return ret
+        key = block_keys.get(line[:2])
+        if key:
+            if key in ret:
+                raise RuntimeError(
+                    "Key " + key + " (" + line[:2] + ") specified twice"
+                    " in block: " + str(ret) + ", file: " + path)
+            ret[key] = line[2:-1]
 
     # No more blocks
-    elif ret != {}:
+    if ret != {}:
         raise RuntimeError("Last block in " + path + " does not end"
                            " with a new line! Delete the file and"
                            " try again. Last block: " + str(ret))
     return None
 
 
+def read_blocks(path, handle):
+    """Parse all blocks of an APKINDEX in one pass.
+
+    Compared to calling parse_next_block() in a loop, this does not need all
+    lines of the file in memory: the file gets read in large chunks, and each
+    line is only looked at once.
+
+    :param path: to the APKINDEX.tar.gz (for error messages)
+    :param handle: text mode file object of the "APKINDEX" file inside the
+                   archive, or of the apk package database
+    :returns: generator of blocks, see parse_next_block()
+    """
+    block = {}
+    rest = ""
+    while True:
+        chunk = handle.read(read_chunk_size)
+        if not chunk:
+            break
+        lines = (rest + chunk).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            # Empty line: end of block
+            if not line:
+                yield block_finish(path, block)
+                block = {}
+                continue
+
+            key = block_keys.get(line[:2])
+            if key:
+                if key in block:
+                    raise RuntimeError(
+                        "Key " + key + " (" + line[:2] + ") specified twice"
+                        " in block: " + str(block) + ", file: " + path)
+                block[key] = line[2:]
+
+    # A line without new line character at the end of the file
+    if rest:
+        key = block_keys.get(rest[:2])
+        if key:
+            block[key] = rest[2:-1]
+    if block != {}:
+        raise RuntimeError("Last block in " + path + " does not end"
+                           " with a new line! Delete the file and"
+                           " try again. Last block: " + str(block))
+
+
+def open_apkindex(path):
+    """Open the "APKINDEX" file inside an APKINDEX.tar.gz, or an uncompressed
+    apk package database, for reading with read_blocks().
+
+    :param path: to the APKINDEX.tar.gz or package database
+    :returns: context manager for a text mode file object
+    """
+    if not tarfile.is_tarfile(path):
+        return open(path, "r", encoding="utf-8")
+
+    @contextlib.contextmanager
+    def extract():
+        with tarfile.open(path, "r:gz") as tar:
+            with tar.extractfile(tar.getmember("APKINDEX")) as handle:
+                yield io.TextIOWrapper(handle, encoding="utf-8", newline="")
+    return extract()
+
+
 def parse_add_block(ret, block, alias=None, multiple_providers=True):
     """Add one block to the return dictionary of parse().
 
@@ -181,34 +360,14 @@ def parse(path, multiple_providers=True):
         else:
             clear_cache(path)
 
-    # Read all lines
-    if tarfile.is_tarfile(path):
-        with tarfile.open(path, "r:gz") as tar:
-            with tar.extractfile(tar.getmember("APKINDEX")) as handle:
-                lines = handle.readlines()
-    else:
-        with open(path, "r", encoding="utf-8") as handle:
-            lines = handle.readlines()
-
-    # Parse the whole APKINDEX file
-    ret = collections.OrderedDict()
-    start = [0]
-    while True:
-        block = parse_next_block(path, lines, start)
-        if not block:
-            break
-
-        # Skip virtual packages
-        if "timestamp" not in block:
-            logging.verbose("Skipped virtual package " + str(block) + " in"
-                            " file: " + path)
-            continue
-
-        # Add the next package and all aliases
-        parse_add_block(ret, block, None, multiple_providers)
-        if "provides" in block:
-            for alias in block["provides"]:
-                parse_add_block(ret, block, alias, multiple_providers)
+    # Try to get the result of a previous pmbootstrap run
+    fingerprint = pmb.helpers.persistent_cache.fingerprint_file(path)
+    ret = pmb.helpers.persistent_cache.load("apkindex", (path, cache_key),
+                                            fingerprint)
+    if ret is None:
+        ret = _parse_uncached(path, multiple_providers)
+        pmb.helpers.persistent_cache.save("apkindex", (path, cache_key),
+                                          fingerprint, ret)
 
     # Update the cache
     if path not in pmb.helpers.other.cache["apkindex"]:
@@ -217,6 +376,27 @@ def parse(path, multiple_providers=True):
     return ret
 
 
+def _parse_uncached(path, multiple_providers):
+    """Parse an APKINDEX.tar.gz file without looking at any cache.
+
+    See parse() for the parameters and return value.
+    """
+    ret = collections.OrderedDict()
+    with open_apkindex(path) as handle:
+        for block in read_blocks(path, handle):
+            # Skip virtual packages
+            if "timestamp" not in block:
+                logging.verbose("Skipped virtual package " + str(block) +
+                                " in file: " + path)
+                continue
+
+            # Add the next package and all aliases
+            parse_add_block(ret, block, None, multiple_providers)
+            for alias in block["provides"]:
+                parse_add_block(ret, block, alias, multiple_providers)
+    return ret
+
+
 def parse_blocks(path):
     """
     Read all blocks from an APKINDEX.tar.gz into a list.
@@ -229,28 +409,24 @@ def parse_blocks(path):
 
     NOTE: "block" is the return value from parse_next_block() above.
     """
-    # Parse all lines
-    with tarfile.open(path, "r:gz") as tar:
-        with tar.extractfile(tar.getmember("APKINDEX")) as handle:
-            lines = handle.readlines()
-
-    # Parse lines into blocks
-    ret = []
-    start = [0]
-    while True:
-        block = pmb.parse.apkindex.parse_next_block(path, lines, start)
-        if not block:
-            return ret
-        ret.append(block)
+    with open_apkindex(path) as handle:
+        return list(read_blocks(path, handle))
 
 
 def clear_cache(path):
     """
-    Clear the APKINDEX parsing cache.
+    Clear the APKINDEX parsing cache, in memory and on disk.
 
-    :returns: True on successful deletion, False otherwise
+    :returns: True on successful deletion (from the cache of the current
+              session), False otherwise
     """
     logging.verbose("Clear APKINDEX cache for: " + path)
+    for cache_key in ["multiple", "single"]:
+        pmb.helpers.persistent_cache.delete("apkindex", (path, cache_key))
+    cache_providers = pmb.helpers.other.cache["apkindex_providers"]
+    for indexes in list(cache_providers.keys()):
+        if path in indexes:
+            del cache_providers[indexes]
     if path in pmb.helpers.other.cache["apkindex"]:
         del pmb.helpers.other.cache["apkindex"][path]
         return True
@@ -260,6 +436,52 @@ def clear_cache(path):
         return False
 
 
+def provider_index(indexes):
+    """
+    Merge the providers from multiple APKINDEX files into one lookup table,
+    so providers() does not need to look at each APKINDEX and compare the
+    versions again for every package. The result is cached for the current
+    session, and gets rebuilt as soon as one of the APKINDEX files changes.
+
+    :param indexes: list of APKINDEX.tar.gz paths
+    :returns: ``{ provide: { pkgname: block, ... }, ... }``, like parse() with
+              multiple_providers, but with the highest version of each
+              provider across all indexes. With the same version, the provider
+              from the index listed last wins.
+    """
+    key = tuple(indexes)
+    fingerprint = tuple(pmb.helpers.persistent_cache.fingerprint_file(path)
+                        for path in indexes)
+    cache = pmb.helpers.other.cache["apkindex_providers"]
+    if key in cache and cache[key]["fingerprint"] == fingerprint:
+        return cache[key]["index"]
+
+    ret = {}
+    # Provides for which ret has its own dict, and not the one from parse()
+    copied = set()
+    for path in indexes:
+        for provide, index_providers in parse(path).items():
+            if provide not in ret:
+                ret[provide] = index_providers
+                continue
+            if provide not in copied:
+                ret[provide] = dict(ret[provide])
+                copied.add(provide)
+
+            # Skip lower versions of providers we already found
+            ret_providers = ret[provide]
+            for provider_pkgname, provider in index_providers.items():
+                if provider_pkgname in ret_providers:
+                    version = provider["version"]
+                    version_last = ret_providers[provider_pkgname]["version"]
+                    if pmb.parse.version.compare(version, version_last) == -1:
+                        continue
+                ret_providers[provider_pkgname] = provider
+
+    cache[key] = {"fingerprint": fingerprint, "index": ret}
+    return ret
+
+
 def providers(args, package, arch=None, must_exist=True, indexes=None):
     """
     Get all packages, which provide one package.
@@ -280,30 +502,10 @@ def providers(args, package, arch=None, must_exist=True, indexes=None):
 
     package = pmb.helpers.package.remove_operators(package)
 
-    ret = collections.OrderedDict()
-    for path in indexes:
-        # Skip indexes not providing the package
-        index_packages = parse(path)
-        if package not in index_packages:
-            continue
-
-        # Iterate over found providers
-        for provider_pkgname, provider in index_packages[package].items():
-            # Skip lower versions of providers we already found
-            version = provider["version"]
-            if provider_pkgname in ret:
-                version_last = ret[provider_pkgname]["version"]
-                if pmb.parse.version.compare(version, version_last) == -1:
-                    logging.verbose(package + ": provided by: " +
-                                    provider_pkgname + "-" + version + " in " +
-                                    path + " (but " + version_last + " is"
-                                    " higher)")
-                    continue
-
-            # Add the provider to ret
-            logging.verbose(package + ": provided by: " + provider_pkgname +
-                            "-" + version + " in " + path)
-            ret[provider_pkgname] = provider
+    ret = collections.OrderedDict(provider_index(indexes).get(package, {}))
+    for provider_pkgname, provider in ret.items():
+        logging.verbose(package + ": provided by: " + provider_pkgname +
+                        "-" + provider["version"])
 
     if ret == {} and must_exist:
         logging.debug("Searched in APKINDEX files: " + ", ".join(indexes))
@@ -12,12 +12,14 @@ def alpine_native():
 
 
 def from_chroot_suffix(args, suffix):
-    if suffix == "native":
+    if suffix in ["native", "native-overlay"]:
         return pmb.config.arch_native
     if suffix in [f"rootfs_{args.device}", f"installer_{args.device}"]:
         return args.deviceinfo["arch"]
     if suffix.startswith("buildroot_"):
-        return suffix.split("_", 1)[1]
+        # Parallel build workers: buildroot_$ARCH-$N (pmb.build.parallel),
+        # overlay chroots: buildroot_$ARCH[-$N]-overlay
+        return suffix.split("_", 1)[1].split("-", 1)[0]
 
     raise ValueError("Invalid chroot suffix: " + suffix +
                      " (wrong device chosen in 'init' step?)")
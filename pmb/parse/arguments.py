@@ -693,6 +693,16 @@ def get_parser():
     # Logging
     parser.add_argument("-l", "--log", dest="log", default=None,
                         help="path to log file")
+    parser.add_argument("--no-privileged-helper", dest="privileged_helper",
+                        help="run each command that needs root with sudo (or"
+                        " doas), instead of running short commands through"
+                        " one privileged helper process",
+                        action="store_false")
+    parser.add_argument("--no-chroot-templates", dest="chroot_templates",
+                        help="always create chroots from scratch, instead of"
+                        " extracting a template of a chroot that was created"
+                        " before with the same packages",
+                        action="store_false")
     parser.add_argument("--details-to-stdout", dest="details_to_stdout",
                         help="print details (e.g. build output) to stdout,"
                              " instead of writing to the log",
@@ -759,10 +769,16 @@ def get_parser():
                      " (that have been downloaded to the apk cache)")
     zap.add_argument("-r", "--rust", action="store_true",
                      help="also delete rust related caches")
+    zap.add_argument("--templates", action="store_true",
+                     help="also delete templates of created chroots")
+    zap.add_argument("--parse-cache", action="store_true",
+                     dest="parse_cache",
+                     help="also delete cached parsing results of APKINDEX"
+                     " and APKBUILD files")
 
     zap_all_delete_args = ["http", "distfiles", "pkgs_local",
                            "pkgs_local_mismatch", "netboot", "pkgs_online_mismatch",
-                           "rust"]
+                           "rust", "templates", "parse_cache"]
     zap_all_delete_args_print = [arg.replace("_", "-")
                                  for arg in zap_all_delete_args]
     zap.add_argument("-a", "--all",
@@ -890,6 +906,22 @@ def get_parser():
     build.add_argument("--envkernel", action="store_true",
                        help="Create an apk package from the build output of"
                        " a kernel compiled locally on the host or with envkernel.sh.")
+    build.add_argument("--no-build-cache", action="store_false",
+                       help="build even if the packages of a previous build"
+                       " with the same inputs (aport, versions of"
+                       " dependencies, --src folder) exist",
+                       dest="build_cache")
+    build.add_argument("--overlay", action="store_true",
+                       help="build each package in a temporary overlay chroot"
+                       " on top of its build chroot, so the installed"
+                       " dependencies get discarded after the build",
+                       dest="build_overlay")
+    build.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                       help="build up to N packages (and their dependencies)"
+                       " at the same time, in separate buildroot chroots."
+                       " The parallel jobs of 'pmbootstrap -j' are divided"
+                       " among them. (default: 1)",
+                       dest="build_workers")
     add_packages_arg(build, nargs="+")
 
     # Action: deviceinfo_parse
@@ -903,7 +935,17 @@ def get_parser():
 
     # Action: apkbuild_parse
     apkbuild_parse = sub.add_parser("apkbuild_parse")
-    add_packages_arg(apkbuild_parse, nargs="*")
+    apkbuild_parse_packages = apkbuild_parse.add_mutually_exclusive_group()
+    add_packages_arg(apkbuild_parse_packages, nargs="*", default=[])
+    apkbuild_parse_packages.add_argument("--all", action="store_true",
+                                         help="parse all packages (default"
+                                              " if no packages are"
+                                              " specified)",
+                                         dest="apkbuild_parse_all")
+    apkbuild_parse.add_argument("--jobs", type=int, metavar="N",
+                                help="amount of parallel processes for"
+                                     " parsing, default: same as -j",
+                                dest="apkbuild_parse_jobs")
 
     # Action: apkindex_parse
     apkindex_parse = sub.add_parser("apkindex_parse")
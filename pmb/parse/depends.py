@@ -1,8 +1,11 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
+import collections
+import glob
 import logging
 import pmb.chroot
 import pmb.chroot.apk
+import pmb.helpers.persistent_cache
 import pmb.helpers.pmaports
 import pmb.parse.apkindex
 import pmb.parse.arch
@@ -115,10 +118,34 @@ def package_from_index(args, pkgname_depend, pkgnames_install, package_aport,
     return provider
 
 
+def recurse_fingerprint(args, suffix="native"):
+    """
+    Fingerprint everything besides pmaports that influences the result of
+    recurse(): the APKINDEX files, the packages installed in the chroot and
+    the selected providers.
+
+    :param suffix: the chroot suffix
+    :returns: tuple that changes when the result of recurse() may change
+    """
+    # Same files as in pmb.helpers.repo.apkindex_files(), but for all
+    # channels and mirrors (so we don't need to read the pmaports config)
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    paths = sorted(glob.glob(f"{args.work}/packages/*/{arch}/APKINDEX.tar.gz"))
+    paths += sorted(glob.glob(f"{args.work}/cache_apk_{arch}/APKINDEX.*"))
+    paths.append(f"{args.work}/chroot_{suffix}/lib/apk/db/installed")
+    return (tuple(pmb.helpers.persistent_cache.fingerprint_file(path)
+                  for path in paths),
+            tuple(sorted(args.selected_providers.items())))
+
+
 def recurse(args, pkgnames, suffix="native"):
     """
     Find all dependencies of the given pkgnames.
 
+    The result is cached for the current session, until one of the files in
+    recurse_fingerprint() changes (e.g. after building a package, or after
+    installing packages to the chroot).
+
     :param suffix: the chroot suffix to resolve dependencies for. If a package
                    has multiple providers, we look at the installed packages in
                    the chroot to make a decision (see package_provider()).
@@ -126,16 +153,31 @@ def recurse(args, pkgnames, suffix="native"):
               depends. Dependencies explicitly marked as conflicting are
               prefixed with !.
     """
+    # Cached result (the order of pkgnames matters for the resulting order
+    # and for choosing providers, so it is part of the key)
+    cache = pmb.helpers.other.cache["pmb.parse.depends.recurse"]
+    fingerprint = recurse_fingerprint(args, suffix)
+    cache_key = (suffix, tuple(pkgnames))
+    if cache_key in cache and cache[cache_key][0] == fingerprint:
+        return list(cache[cache_key][1])
+
     logging.debug(f"({suffix}) calculate depends of {', '.join(pkgnames)} "
                   "(pmbootstrap -v for details)")
 
-    # Iterate over todo-list until is is empty
-    todo = list(pkgnames)
+    # Iterate over todo-list until is is empty. The keys of ret are the
+    # result, todo_count counts the entries of todo so they can be looked up
+    # quickly in pkgnames_install.
+    todo = collections.deque(pkgnames)
+    todo_count = collections.Counter(todo)
     required_by = {}
-    ret = []
-    while len(todo):
+    ret = {}
+    pkgnames_install = collections.ChainMap(ret, todo_count)
+    while todo:
         # Skip already passed entries
-        pkgname_depend = todo.pop(0)
+        pkgname_depend = todo.popleft()
+        todo_count[pkgname_depend] -= 1
+        if not todo_count[pkgname_depend]:
+            del todo_count[pkgname_depend]
         if pkgname_depend in ret:
             continue
 
@@ -144,7 +186,6 @@ def recurse(args, pkgnames, suffix="native"):
         pkgname_depend = pkgname_depend.lstrip("!")
 
         # Get depends and pkgname from aports
-        pkgnames_install = list(ret) + todo
         package = package_from_aports(args, pkgname_depend)
         package = package_from_index(args, pkgname_depend, pkgnames_install,
                                      package, suffix)
@@ -177,10 +218,14 @@ def recurse(args, pkgnames, suffix="native"):
                 depends = package["depends"]
                 logging.verbose(f"{pkgname}: depends on: {','.join(depends)}")
                 if depends:
-                    todo += depends
+                    todo.extend(depends)
+                    todo_count.update(depends)
                     for dep in depends:
                         if dep not in required_by:
                             required_by[dep] = set()
                         required_by[dep].add(pkgname_depend)
-            ret.append(pkgname)
+            ret[pkgname] = None
+
+    ret = list(ret)
+    cache[cache_key] = (fingerprint, tuple(ret))
     return ret
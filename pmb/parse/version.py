@@ -1,6 +1,7 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 import collections
+import functools
 
 """
 In order to stay as compatible to Alpine's apk as possible, this code
@@ -185,6 +186,52 @@ def get_token(previous, rest):
     return (next, value, rest)
 
 
+# Tail rank of a token sequence, where the next token is a suffix indicating
+# a pre-release (e.g. "_rc"). Lower than -token_value() of any token.
+tail_rank_pre_release = -100
+
+
+@functools.lru_cache(maxsize=65536)
+def key(version):
+    """
+    Tokenize one version string, so it can be compared with other versions
+    without parsing it again. The result is cached, compare(), validate(),
+    sort() and highest() use it internally.
+
+    A plain tuple comparison of two keys is not enough to compare versions,
+    as apk's algorithm is not a strict total order (e.g. "1_git" and "1_p"
+    are both equal to "1", but "1_git" is lower than "1_p"). Use compare()
+    with the version strings instead.
+
+    :param version: full version string
+    :returns: tuple of steps like (value, next, tail):
+              - value: value of the current token, as returned by get_token()
+              - next: token_value() of the token that follows
+              - tail: how the following token compares against a different
+              following token of another version, see compare()
+              The last step is followed by an "end" or "invalid" token.
+    """
+    value_end = token_value("end")
+    value_invalid = token_value("invalid")
+
+    ret = []
+    token = "digit"
+    rest = version
+    while True:
+        (token, value, rest) = get_token(token, rest)
+        tail = -token_value(token)
+        if token == "suffix":
+            # Look at the value of the suffix without consuming it
+            (suffix_next, suffix_value, _) = get_token(token, rest)
+            if suffix_value < 0:
+                tail = tail_rank_pre_release
+            else:
+                tail = -token_value(suffix_next)
+        ret.append((value, token_value(token), tail))
+        if ret[-1][1] in [value_end, value_invalid]:
+            return tuple(ret)
+
+
 def validate(version):
     """
     Check whether one version string is valid.
@@ -194,13 +241,7 @@ def validate(version):
 
     C equivalent: apk_version_validate()
     """
-    current = "digit"
-    rest = version
-    while current != "end":
-        (current, value, rest) = get_token(current, rest)
-        if current == "invalid":
-            return False
-    return True
+    return key(version)[-1][1] != token_value("invalid")
 
 
 def compare(a_version, b_version, fuzzy=False):
@@ -220,56 +261,73 @@ def compare(a_version, b_version, fuzzy=False):
 
     C equivalent: apk_version_compare_blob_fuzzy()
     """
-
-    # Defaults
-    a_token = "digit"
-    b_token = "digit"
-    a_value = 0
-    b_value = 0
-    a_rest = a_version
-    b_rest = b_version
-
-    # Parse A and B one token at a time, until one string ends, or the
-    # current token has a different type/value
-    while (a_token == b_token and a_token not in ["end", "invalid"] and
-           a_value == b_value):
-        (a_token, a_value, a_rest) = get_token(a_token, a_rest)
-        (b_token, b_value, b_rest) = get_token(b_token, b_rest)
-
-    # Compare the values inside the last tokens
-    if a_value < b_value:
-        return -1
-    if a_value > b_value:
-        return 1
-
-    # Equal: When tokens are the same strings, or when the value
-    # is the same and fuzzy compare is enabled
-    if a_token == b_token or fuzzy:
+    if a_version == b_version:
         return 0
 
-    # Leading version components and their values are equal, now the
-    # non-terminating version is greater unless it's a suffix
-    # indicating pre-release
-    if a_token == "suffix":
-        (a_token, a_value, a_rest) = get_token(a_token, a_rest)
-        if a_value < 0:
+    # Walk through the tokens of A and B, until one string ends, or the
+    # current token has a different type/value
+    value_end = token_value("end")
+    value_invalid = token_value("invalid")
+    for (a_value, a_next, a_tail), (b_value, b_next, b_tail) in \
+            zip(key(a_version), key(b_version)):
+        # Compare the values inside the tokens
+        if a_value != b_value:
+            return -1 if a_value < b_value else 1
+
+        # Same token follows: continue, unless both strings ended
+        if a_next == b_next:
+            if a_next in [value_end, value_invalid]:
+                return 0
+            continue
+
+        # Equal: when the value is the same and fuzzy compare is enabled
+        if fuzzy:
+            return 0
+
+        # Leading version components and their values are equal, now the
+        # non-terminating version is greater unless it's a suffix
+        # indicating pre-release. Otherwise compare the token value (e.g.
+        # digit < letter). Both are covered by the tail of the step.
+        if a_tail < b_tail:
             return -1
-    if b_token == "suffix":
-        (b_token, b_value, b_rest) = get_token(b_token, b_rest)
-        if b_value < 0:
+        if a_tail > b_tail:
             return 1
 
-    # Compare the token value (e.g. digit < letter)
-    if token_value(a_token) > token_value(b_token):
-        return -1
-    if token_value(a_token) < token_value(b_token):
-        return 1
+        # The tokens are not the same, but previous checks revealed that it
+        # is equal anyway (e.g. "1_p" == "1").
+        return 0
 
-    # The tokens are not the same, but previous checks revealed that it
-    # is equal anyway (e.g. "1.0" == "1").
+    # Not reached: all keys end with an "end" or "invalid" token
     return 0
 
 
+def sort(versions, reverse=False):
+    """
+    Sort multiple version strings with compare().
+
+    :param versions: iterable of full version strings
+    :param reverse: sort from the highest to the lowest version
+    :returns: sorted list of the version strings
+    """
+    return sorted(versions, key=functools.cmp_to_key(compare),
+                  reverse=reverse)
+
+
+def highest(versions):
+    """
+    Get the highest version out of multiple version strings. When multiple
+    versions are equal according to compare(), the first one wins.
+
+    :param versions: iterable of full version strings
+    :returns: the highest version string, or None if versions is empty
+    """
+    ret = None
+    for version in versions:
+        if ret is None or compare(version, ret) == 1:
+            ret = version
+    return ret
+
+
 """
 Convenience functions below are not modeled after apk's version.c.
 """
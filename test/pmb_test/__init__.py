@@ -1,8 +1,15 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 import os
+import pytest
 import sys
 
 # Add topdir to import path
 topdir = os.path.realpath(os.path.join(os.path.dirname(__file__) + "/../.."))
 sys.path.insert(0, topdir)
+
+# Benchmarks only run when requested, e.g.:
+# $ PMB_TEST_BENCHMARK=1 pytest test -k benchmark
+benchmark = pytest.mark.skipif(not os.environ.get("PMB_TEST_BENCHMARK"),
+                               reason="set PMB_TEST_BENCHMARK=1 to run"
+                               " benchmarks")
@@ -0,0 +1,113 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import os
+import pytest
+import sys
+
+import pmb_test  # noqa
+import pmb.build.cache
+import pmb.chroot
+import pmb.config.pmaports
+import pmb.helpers.logging
+import pmb.helpers.other
+import pmb.helpers.pmaports
+import pmb.parse.apkindex
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap", "init"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    return args
+
+
+def test_fingerprint_lookup(args, tmpdir, monkeypatch):
+    tmpdir = str(tmpdir)
+    aport = f"{tmpdir}/aports/hello"
+    os.makedirs(aport)
+    with open(f"{aport}/APKBUILD", "w") as handle:
+        handle.write("pkgname=hello\n")
+    versions = {"gcc": "13.2.1-r0"}
+
+    monkeypatch.setattr(args, "work", f"{tmpdir}/work")
+    monkeypatch.setattr(pmb.helpers.pmaports, "find",
+                        lambda args, pkgname: aport)
+    monkeypatch.setattr(pmb.config.pmaports, "read_config",
+                        lambda args: {"channel": "edge"})
+    monkeypatch.setattr(pmb.parse.apkindex, "package",
+                        lambda args, pkgname, arch, must_exist:
+                        {"pkgname": pkgname, "version": versions[pkgname]}
+                        if pkgname in versions else None)
+
+    apkbuild = {"pkgname": "hello", "subpackages": {"hello-doc": None},
+                "options": []}
+    func = pmb.build.cache.fingerprint
+    fingerprint = func(args, apkbuild, "armhf", None, ["gcc"], "armhf")
+    assert fingerprint == func(args, apkbuild, "armhf", None, ["gcc"],
+                               "armhf")
+    assert fingerprint != func(args, apkbuild, "armhf", "native", ["gcc"],
+                               "x86_64")
+    versions["gcc"] = "13.2.1-r1"
+    assert fingerprint != func(args, apkbuild, "armhf", None, ["gcc"],
+                               "armhf")
+    versions["gcc"] = "13.2.1-r0"
+    with open(f"{aport}/APKBUILD", "a") as handle:
+        handle.write("pkgrel=1\n")
+    assert fingerprint != func(args, apkbuild, "armhf", None, ["gcc"],
+                               "armhf")
+    fingerprint = func(args, apkbuild, "armhf", None, ["gcc"], "armhf")
+
+    # No previous build
+    pmb.helpers.other.cache["pmb.build.cache"] = {}
+    assert pmb.build.cache.lookup(args, apkbuild, "armhf",
+                                  fingerprint) is False
+    assert pmb.build.cache.reused(apkbuild, "armhf") is None
+
+    # Previous build with the same inputs (store() writes through the chroot)
+    path = f"{tmpdir}/work/packages/edge/armhf"
+    os.makedirs(path)
+    for apk in ["hello-1-r1.apk", "hello-doc-1-r1.apk"]:
+        with open(f"{path}/{apk}", "w") as handle:
+            handle.write(apk)
+    checksum = hashlib.sha256(b"hello-1-r1.apk").hexdigest()
+    checksum_doc = hashlib.sha256(b"hello-doc-1-r1.apk").hexdigest()
+    with open(f"{path}/hello.fingerprint", "w") as handle:
+        handle.write(f"{fingerprint}\n"
+                     f"hello-1-r1.apk 14 {checksum}\n"
+                     f"hello-doc-1-r1.apk 18 {checksum_doc}\n")
+    assert pmb.build.cache.lookup(args, apkbuild, "armhf", fingerprint)
+    assert pmb.build.cache.reused(apkbuild, "armhf") == "armhf/hello-1-r1.apk"
+
+    # A later build of the package does not use the result of this lookup
+    pmb.build.cache.forget(apkbuild, "armhf")
+    assert pmb.build.cache.reused(apkbuild, "armhf") is None
+
+    # Disabled, different inputs, modified or deleted apk
+    assert not pmb.build.cache.lookup(args, apkbuild, "armhf", fingerprint,
+                                      reuse=False)
+    assert not pmb.build.cache.lookup(args, apkbuild, "armhf", "0" * 64)
+    with open(f"{path}/hello-1-r1.apk", "w") as handle:
+        handle.write("hello-1-r2.apk")
+    assert not pmb.build.cache.lookup(args, apkbuild, "armhf", fingerprint)
+    with open(f"{path}/hello-1-r1.apk", "w") as handle:
+        handle.write("modified")
+    assert not pmb.build.cache.lookup(args, apkbuild, "armhf", fingerprint)
+    with open(f"{path}/hello-1-r1.apk", "w") as handle:
+        handle.write("hello-1-r1.apk")
+    assert pmb.build.cache.lookup(args, apkbuild, "armhf", fingerprint)
+    os.unlink(f"{path}/hello-doc-1-r1.apk")
+    assert not pmb.build.cache.lookup(args, apkbuild, "armhf", fingerprint)
+    assert pmb.build.cache.reused(apkbuild, "armhf") is None
+
+    # The apks get stored with their size and checksum
+    commands = []
+    monkeypatch.setattr(pmb.chroot, "user",
+                        lambda args, cmd, working_dir: commands.append(cmd))
+    pmb.build.cache.store(args, apkbuild, "armhf", "armhf/hello-1-r1.apk")
+    assert commands[0][2].startswith(f"printf '%s\\n' {fingerprint}"
+                                     f" 'hello-1-r1.apk 14 {checksum}' >")
@@ -0,0 +1,81 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import subprocess
+
+import pmb_test  # noqa
+import pmb.build.other
+
+
+def sync(source, destination, exclude=()):
+    commands = pmb.build.other.sync_commands(source, destination, exclude)
+    for command in commands:
+        subprocess.run(command, check=True)
+    return commands
+
+
+def test_sync_commands(tmpdir):
+    aport = f"{tmpdir}/aport"
+    build = f"{tmpdir}/build"
+    os.makedirs(f"{aport}/files")
+    os.makedirs(f"{aport}/src")
+    with open(f"{tmpdir}/shared.patch", "w") as handle:
+        handle.write("shared")
+    with open(f"{aport}/APKBUILD", "w") as handle:
+        handle.write("pkgname=hello")
+    with open(f"{aport}/files/hello.conf", "w") as handle:
+        handle.write("conf")
+    os.symlink("../shared.patch", f"{aport}/shared.patch")
+
+    # First copy: everything, with resolved symlinks
+    commands = sync(aport, build, ["src"])
+    assert sorted(os.listdir(build)) == ["APKBUILD", "files", "shared.patch"]
+    assert not os.path.islink(f"{build}/shared.patch")
+    assert len([cmd for cmd in commands if cmd[0] == "cp"]) == 3
+
+    # Nothing changed
+    assert sync(aport, build, ["src"]) == [["mkdir", "-p", "--", build]]
+
+    # Leftovers of the build are removed, changed files copied again
+    os.makedirs(f"{build}/src/hello-1.0")
+    os.makedirs(f"{build}/pkg")
+    with open(f"{aport}/APKBUILD", "a") as handle:
+        handle.write("\npkgrel=1")
+    commands = sync(aport, build, ["src"])
+    assert commands == [["rm", "-rf", "--", f"{build}/pkg", f"{build}/src"],
+                        ["mkdir", "-p", "--", build],
+                        ["cp", "-pL", "--", f"{aport}/APKBUILD",
+                         f"{build}/APKBUILD"]]
+    assert sorted(os.listdir(build)) == ["APKBUILD", "files", "shared.patch"]
+    with open(f"{build}/APKBUILD") as handle:
+        assert handle.read() == "pkgname=hello\npkgrel=1"
+
+
+def test_sync_commands_symlink_loop(tmpdir):
+    aport = f"{tmpdir}/aport"
+    build = f"{tmpdir}/build"
+    os.makedirs(f"{aport}/files")
+    with open(f"{aport}/APKBUILD", "w") as handle:
+        handle.write("pkgname=hello")
+    os.symlink("..", f"{aport}/files/loop")
+
+    # The loop is skipped instead of walking it forever
+    sync(aport, build)
+    assert sorted(os.listdir(build)) == ["APKBUILD", "files"]
+    assert os.listdir(f"{build}/files") == []
+
+
+def test_split_command():
+    func = pmb.build.other._split_command
+    assert func(["rm", "-rf", "--"], []) == []
+    assert func(["mkdir", "-p", "--"], ["/a", "/b"]) == \
+        [["mkdir", "-p", "--", "/a", "/b"]]
+
+    # Each command stays below the limit for one "sh -c" script
+    paths = [f"/tmp/build/file{i:04}" for i in range(1000)]
+    commands = func(["rm", "-rf", "--"], paths, 1000)
+    assert len(commands) > 1
+    assert [path for command in commands for path in command[3:]] == paths
+    for command in commands:
+        assert command[:3] == ["rm", "-rf", "--"]
+        assert len(" ".join(command)) < 1000
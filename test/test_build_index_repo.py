@@ -0,0 +1,47 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+import io
+import os
+import tarfile
+
+import pmb_test  # noqa
+import pmb.build.other
+
+
+def write_apkindex(path, packages):
+    data = "".join(f"P:{pkgname}\nV:{version}\nA:x86_64\n\n"
+                   for pkgname, version in packages).encode()
+    info = tarfile.TarInfo("APKINDEX")
+    info.size = len(data)
+    with tarfile.open(f"{path}/APKINDEX.tar.gz", "w:gz") as tar:
+        tar.addfile(info, io.BytesIO(data))
+
+
+def test_index_outdated(tmpdir):
+    path = str(tmpdir)
+    func = pmb.build.other.index_outdated
+
+    # No index
+    open(f"{path}/hello-1-r0.apk", "w").close()
+    assert func(path) is True
+
+    # Index lists exactly the apks
+    write_apkindex(path, [("hello", "1-r0")])
+    os.utime(f"{path}/hello-1-r0.apk", (0, 0))
+    assert func(path) is False
+
+    # New apk
+    open(f"{path}/hello-doc-1-r0.apk", "w").close()
+    os.utime(f"{path}/hello-doc-1-r0.apk", (0, 0))
+    assert func(path) is True
+    os.unlink(f"{path}/hello-doc-1-r0.apk")
+    assert func(path) is False
+
+    # Changed apk
+    mtime = os.path.getmtime(f"{path}/APKINDEX.tar.gz")
+    os.utime(f"{path}/hello-1-r0.apk", (mtime + 1, mtime + 1))
+    assert func(path) is True
+
+    # Deleted apk
+    os.unlink(f"{path}/hello-1-r0.apk")
+    assert func(path) is True
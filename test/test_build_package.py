@@ -12,9 +12,11 @@ import pmb_test  # noqa
 import pmb_test.git
 import pmb.build
 import pmb.build._package
+import pmb.build.cache
 import pmb.config
 import pmb.config.init
 import pmb.helpers.logging
+from pmb.helpers.exceptions import BuildFailedError
 
 
 @pytest.fixture
@@ -234,6 +236,8 @@ def test_init_buildenv(args, monkeypatch):
     monkeypatch.setattr(pmb.build._package, "is_necessary_warn_depends",
                         return_true)
     monkeypatch.setattr(pmb.chroot.apk, "install", return_none)
+    monkeypatch.setattr(pmb.build.cache, "fingerprint", return_none)
+    monkeypatch.setattr(pmb.build.cache, "lookup", return_false)
 
     # Shortcut and fake apkbuild
     func = pmb.build._package.init_buildenv
@@ -335,6 +339,44 @@ def test_package(args):
     assert pmb.build.package(args, "alpine-base") is None
 
 
+def test_package_overlay(args, monkeypatch):
+    # Skip everything except for discarding the overlay
+    apkbuild = {"pkgname": "test", "options": []}
+    monkeypatch.setattr(pmb.build._package, "skip_already_built", return_false)
+    monkeypatch.setattr(pmb.build._package, "get_apkbuild",
+                        lambda *args: apkbuild)
+    monkeypatch.setattr(pmb.build._package, "check_build_for_arch",
+                        return_true)
+    monkeypatch.setattr(pmb.build.autodetect, "crosscompile", return_none)
+    monkeypatch.setattr(pmb.build._package, "init_buildenv", return_true)
+    monkeypatch.setattr(pmb.build._package, "finish", return_none)
+    monkeypatch.setattr(pmb.build.cache, "store", return_none)
+    umounted = []
+
+    def umount_overlay(args, suffix):
+        umounted.append(suffix)
+        raise RuntimeError("umount: target is busy")
+    monkeypatch.setattr(pmb.chroot, "umount_overlay", umount_overlay)
+    args.build_overlay = True
+
+    # The build error doesn't get hidden by the error of discarding the
+    # overlay
+    def run_abuild(*args):
+        raise RuntimeError("abuild failed")
+    monkeypatch.setattr(pmb.build._package, "run_abuild", run_abuild)
+    with pytest.raises(BuildFailedError):
+        pmb.build.package(args, "test", force=True)
+    assert umounted == ["native-overlay"]
+
+    # Successful build: the error of discarding the overlay is raised
+    monkeypatch.setattr(pmb.build._package, "run_abuild",
+                        lambda *args: ("x86_64/test-1-r0.apk", [], {}))
+    with pytest.raises(RuntimeError) as e:
+        pmb.build.package(args, "test", force=True)
+    assert str(e.value) == "umount: target is busy"
+    assert umounted == ["native-overlay", "native-overlay"]
+
+
 def test_build_depends_high_level(args, monkeypatch):
     """
     "hello-world-wrapper" depends on "hello-world". We build both, then delete
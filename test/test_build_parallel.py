@@ -0,0 +1,100 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+import pytest
+import sys
+import threading
+
+import pmb_test  # noqa
+import pmb.build.parallel
+import pmb.chroot
+import pmb.config
+import pmb.helpers.depgraph
+import pmb.helpers.logging
+import pmb.parse.arch
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap", "init"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    return args
+
+
+def test_worker_suffix(args, monkeypatch):
+    func = pmb.build.parallel.worker_suffix
+    arch_native = pmb.config.arch_native
+    assert func("native", arch_native) == "native"
+    assert func("buildroot_armhf", "armhf") == "buildroot_armhf"
+
+    monkeypatch.setattr(pmb.build.parallel, "worker", 2)
+    assert func("native", arch_native) == f"buildroot_{arch_native}-2"
+    assert func("buildroot_armhf", "armhf") == "buildroot_armhf-2"
+
+    # Cross-native packages are always built in the native chroot
+    assert func("native", "armhf") == "native"
+
+    assert pmb.parse.arch.from_chroot_suffix(args, "buildroot_armhf-2") == \
+        "armhf"
+    assert pmb.parse.arch.from_chroot_suffix(args, "buildroot_x86_64-1") == \
+        "x86_64"
+
+
+def test_plan(args, monkeypatch):
+    depends = {"app": ["libfoo", "libbar"],
+               "libfoo": ["musl"],
+               "libbar": ["libbaz"],
+               "libbaz": ["musl"],
+               "musl": [],
+               "unrelated": []}
+    pmaports = ["app", "libfoo", "libbar", "libbaz", "unrelated"]
+    graph = pmb.helpers.depgraph.Graph("armhf", depends, pmaports)
+    necessary = {"app", "libfoo", "libbaz", "unrelated"}
+
+    monkeypatch.setattr(pmb.helpers.depgraph, "get",
+                        lambda args, arch: graph)
+    monkeypatch.setattr(pmb.helpers.pmaports, "get",
+                        lambda args, pkgname: {"pkgname": pkgname})
+    monkeypatch.setattr(pmb.build, "is_necessary",
+                        lambda args, arch, apkbuild:
+                        apkbuild["pkgname"] in necessary)
+
+    # libbar is up to date, but app still needs to wait for libbaz
+    func = pmb.build.parallel.plan
+    ret = func(args, ["app"], "armhf")
+    assert list(ret) == ["libbaz", "libfoo", "app"]
+    assert ret == {"libbaz": set(),
+                   "libfoo": set(),
+                   "app": {"libbaz", "libfoo"}}
+
+    # Up to date packages are only built with force
+    necessary = set()
+    assert func(args, ["app"], "armhf") == {}
+    assert func(args, ["libbar"], "armhf", True) == {"libbar": set()}
+
+
+def test_repodest(args, monkeypatch):
+    func = pmb.build.parallel.repodest
+    assert func() is None
+
+    commands = []
+    monkeypatch.setattr(pmb.chroot, "user",
+                        lambda args, cmd, suffix: commands.append(
+                            (cmd, suffix)))
+    monkeypatch.setattr(pmb.build, "index_repo",
+                        lambda args, arch: commands.append(("index", arch)))
+    pmb.build.parallel.merge(args, "armhf", "buildroot_armhf-1")
+    assert commands == []
+
+    # While building in parallel, each worker writes to its own folder
+    monkeypatch.setattr(pmb.build.parallel, "lock", threading.RLock())
+    assert func() == "/home/pmos/repodest"
+    pmb.build.parallel.merge(args, "armhf", "buildroot_armhf-1")
+    assert commands == [
+        (["sh", "-c", "mkdir -p /home/pmos/packages/pmos/armhf &&"
+          " mv /home/pmos/repodest/pmos/armhf/*.apk"
+          " /home/pmos/packages/pmos/armhf/"], "buildroot_armhf-1"),
+        ("index", "armhf")]
@@ -0,0 +1,62 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+""" Test pmb/chroot/init.py """
+import os
+import pytest
+import sys
+
+import pmb_test  # noqa
+import pmb.chroot.init
+import pmb.helpers.mount
+import pmb.helpers.other
+
+# pmb.chroot.init is the function re-exported by pmb/chroot/__init__.py
+pmb_chroot_init = sys.modules["pmb.chroot.init"]
+
+
+@pytest.fixture
+def args(tmpdir, request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap", "init"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    return args
+
+
+def test_ready(args, tmpdir, monkeypatch):
+    args.work = str(tmpdir)
+    chroot = os.path.realpath(f"{tmpdir}/chroot_native")
+    mounts = [f"{chroot}/dev", f"{chroot}/mnt/pmbootstrap/packages",
+              f"{chroot}_other/dev"]
+
+    def umount_all_list(prefix):
+        return [mount for mount in mounts if mount.startswith(prefix)]
+    monkeypatch.setattr(pmb.helpers.mount, "umount_all_list",
+                        umount_all_list)
+    monkeypatch.setitem(pmb.helpers.other.cache, "pmb.chroot.init", {})
+    func = pmb_chroot_init.ready
+
+    # Mountpoints of other chroots with the same prefix are ignored
+    assert pmb_chroot_init.mountpoints(args, "native") == set(mounts[:2])
+
+    # Not initialized in this session
+    os.makedirs(f"{chroot}/bin")
+    os.symlink("/bin/busybox", f"{chroot}/bin/sh")
+    assert not func(args, "native")
+
+    # Initialized
+    pmb_chroot_init.mark_ready(args, "native")
+    assert func(args, "native")
+    assert not func(args, "buildroot_armhf")
+
+    # Something was umounted
+    mounts.remove(f"{chroot}/dev")
+    assert not func(args, "native")
+    mounts.append(f"{chroot}/dev")
+    assert func(args, "native")
+
+    # Chroot was zapped
+    os.unlink(f"{chroot}/bin/sh")
+    assert not func(args, "native")
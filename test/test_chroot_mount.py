@@ -38,3 +38,22 @@ def test_chroot_mount(args):
 
     # Run again: it should not crash
     pmb.chroot.remove_mnt_pmbootstrap(args, suffix)
+
+
+def test_chroot_mount_overlay(args):
+    pmb.chroot.root(args, ["true"])
+
+    # Changes in the overlay chroot don't end up in the chroot below
+    suffix = pmb.chroot.mount_overlay(args, "native")
+    assert suffix == "native-overlay"
+    pmb.chroot.root(args, ["touch", "/overlay-test"], suffix)
+    assert os.path.exists(f"{args.work}/chroot_{suffix}/overlay-test")
+    assert not os.path.exists(f"{args.work}/chroot_native/overlay-test")
+
+    # Umount and discard the overlay chroot
+    pmb.chroot.umount_overlay(args, suffix)
+    assert not os.path.exists(f"{args.work}/chroot_{suffix}")
+    assert not os.path.exists(f"{args.work}/overlays/{suffix}")
+
+    # Run again: it should not crash
+    pmb.chroot.umount_overlay(args, suffix)
@@ -0,0 +1,93 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+""" Test pmb/chroot/template.py """
+import os
+import pytest
+import sys
+
+import pmb_test  # noqa
+import pmb.chroot.template
+import pmb.config
+import pmb.config.pmaports
+import pmb.helpers.logging
+import pmb.helpers.repo
+import pmb.parse.apkindex
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap", "init"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    return args
+
+
+def test_enabled(args):
+    func = pmb.chroot.template.enabled
+    assert func(args, "native")
+    assert func(args, "buildroot_armhf")
+    assert func(args, "buildroot_armhf-1")
+    assert not func(args, "rootfs_qemu-amd64")
+    assert not func(args, "installer_qemu-amd64")
+    assert not func(args, "native-overlay")
+    assert not func(args, "buildroot_armhf-1-overlay")
+
+    args.chroot_templates = False
+    assert not func(args, "native")
+
+
+def test_save_restore(args, tmpdir, monkeypatch):
+    args.work = str(tmpdir)
+    versions = {"alpine-base": "3.19.0-r0", "apk-tools": "2.14.0-r5"}
+
+    def package(args, pkgname, arch, must_exist):
+        if pkgname not in versions:
+            return None
+        return {"pkgname": pkgname, "version": versions[pkgname]}
+    monkeypatch.setattr(pmb.parse.apkindex, "package", package)
+    monkeypatch.setattr(pmb.helpers.repo, "update", lambda *args: None)
+    monkeypatch.setattr(pmb.config.pmaports, "read_config",
+                        lambda args: {"channel": "edge"})
+
+    # Fake chroot with installed packages and a mounted folder
+    chroot = f"{tmpdir}/chroot_native"
+    os.makedirs(f"{chroot}/lib/apk/db")
+    os.makedirs(f"{chroot}/mnt/pmbootstrap/packages")
+    with open(f"{chroot}/lib/apk/db/installed", "w") as handle:
+        for pkgname, version in versions.items():
+            handle.write(f"P:{pkgname}\nV:{version}\nA:x86_64\n"
+                         "t:1700000000\n\n")
+    with open(f"{chroot}/mnt/pmbootstrap/packages/test.apk", "w") as handle:
+        handle.write("mounted, must not be in the template\n")
+    monkeypatch.setattr(pmb.helpers.mount, "umount_all_list",
+                        lambda prefix: [f"{os.path.realpath(chroot)}"
+                                        "/mnt/pmbootstrap/packages"])
+
+    # No template yet
+    func = pmb.chroot.template.restore
+    assert not func(args, "native", False)
+
+    # Save and restore
+    pmb.chroot.template.save(args, "native", False)
+    path = f"{tmpdir}/cache_chroot_templates/edge_{pmb.config.arch_native}"
+    assert os.path.exists(f"{path}.tar")
+    with open(f"{path}.pkgs") as handle:
+        assert handle.read() == ("alpine-base 3.19.0-r0\n"
+                                 "apk-tools 2.14.0-r5\n")
+    pmb.helpers.run.root(args, ["rm", "-rf", chroot])
+    os.makedirs(chroot)
+    assert not func(args, "native", True)
+    assert func(args, "native", False)
+    assert os.path.exists(f"{chroot}/lib/apk/db/installed")
+    assert os.path.isdir(f"{chroot}/mnt/pmbootstrap")
+    assert not os.path.exists(f"{chroot}/mnt/pmbootstrap/packages")
+
+    # Outdated after an upgrade in the APKINDEX
+    versions["apk-tools"] = "2.14.0-r6"
+    assert pmb.chroot.template.outdated(args, "native",
+                                        {"apk-tools": "2.14.0-r5"}) == \
+        ["apk-tools"]
+    assert not func(args, "native", False)
@@ -0,0 +1,102 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import pytest
+import sys
+
+import pmb_test  # noqa
+import pmb.helpers.depgraph
+import pmb.helpers.logging
+import pmb.helpers.persistent_cache
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap", "init"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    return args
+
+
+def test_graph():
+    depends = {"app": ["libfoo", "libbar"],
+               "libfoo": ["musl"],
+               "libbar": ["musl", "cycle-a"],
+               "cycle-a": ["cycle-b"],
+               "cycle-b": ["cycle-a"],
+               "musl": [],
+               "unrelated": []}
+    pmaports = ["app", "libfoo", "libbar", "cycle-a", "cycle-b", "unrelated"]
+    graph = pmb.helpers.depgraph.Graph("x86_64", depends, pmaports)
+
+    assert graph.topological_order() == ["cycle-a", "cycle-b", "musl",
+                                         "libbar", "libfoo", "app",
+                                         "unrelated"]
+    assert graph.topological_order(["app", "cycle-b", "missing"]) == \
+        ["missing", "cycle-b", "app"]
+    assert graph.cycles() == [("cycle-a", "cycle-b")]
+    assert graph.reverse_depends("musl") == ["libbar", "libfoo"]
+    assert graph.reverse_depends("app") == []
+    assert graph.rebuild(["musl"]) == ["libbar", "libfoo", "app"]
+    assert graph.rebuild(["cycle-b"]) == ["cycle-a", "cycle-b", "libbar",
+                                          "app"]
+
+    # Serialize
+    graph_copy = pmb.helpers.depgraph.Graph.from_dict(graph.as_dict())
+    assert graph_copy.depends == graph.depends
+    assert graph_copy.pmaports == graph.pmaports
+
+    # Long chain (no recursion limit)
+    depends = {f"pkg{i}": [f"pkg{i + 1}"] for i in range(5000)}
+    depends["pkg5000"] = ["pkg0"]
+    graph = pmb.helpers.depgraph.Graph("x86_64", depends, depends.keys())
+    assert len(graph.cycles()[0]) == 5001
+
+
+def test_get(args, tmpdir, monkeypatch):
+    # Fake pmaports folder
+    tmpdir = str(tmpdir)
+    args.aports = tmpdir + "/pmaports"
+    args.work = tmpdir
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "path_base",
+                        tmpdir + "/cache_parse")
+    apkbuilds = {"main/hello": ("hello-sub", "", "musl-dev"),
+                 "main/world": ("", "hello-sub>=1 !conflict", "so:libz.so"),
+                 "main/armhf-only": ("", "", "")}
+    for aport, (subpackages, depends, makedepends) in apkbuilds.items():
+        pkgname = os.path.basename(aport)
+        arch = "armhf" if pkgname == "armhf-only" else "all"
+        os.makedirs(f"{args.aports}/{aport}")
+        with open(f"{args.aports}/{aport}/APKBUILD", "w") as handle:
+            handle.write(f"pkgname={pkgname}\n"
+                         "pkgver=1\n"
+                         "pkgrel=0\n"
+                         f"arch=\"{arch}\"\n"
+                         f"subpackages=\"{subpackages}\"\n"
+                         f"depends=\"{depends}\"\n"
+                         f"makedepends=\"{makedepends}\"\n")
+
+    # Binary packages
+    def package(args, pkgname, arch, must_exist=True):
+        if pkgname == "so:libz.so":
+            return {"pkgname": "zlib", "origin": "zlib"}
+        return None
+    monkeypatch.setattr(pmb.parse.apkindex, "package", package)
+    monkeypatch.setattr(pmb.helpers.repo, "update", lambda *args: None)
+
+    graph = pmb.helpers.depgraph.get(args, "x86_64")
+    assert graph.depends == {"hello": ("musl-dev",),
+                             "musl-dev": (),
+                             "world": ("hello", "zlib"),
+                             "zlib": ()}
+    assert graph.pmaports == {"hello", "world"}
+    assert graph.topological_order() == ["musl-dev", "hello", "zlib",
+                                         "world"]
+
+    # New session: use the persistent cache
+    pmb.helpers.other.init_cache()
+    monkeypatch.setattr(pmb.helpers.depgraph, "build", None)
+    assert pmb.helpers.depgraph.get(args, "x86_64").depends == graph.depends
@@ -0,0 +1,50 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+""" Test pmb/helpers/persistent_cache.py """
+import os
+import pytest
+import sys
+
+import pmb_test  # noqa
+import pmb.helpers.logging
+import pmb.helpers.persistent_cache
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap", "init"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    return args
+
+
+def test_prune(args, tmpdir, monkeypatch):
+    cache = pmb.helpers.persistent_cache
+    monkeypatch.setattr(cache, "path_base", f"{tmpdir}/cache_parse")
+    monkeypatch.setattr(cache, "pruned", set())
+    path_a = f"{tmpdir}/APKINDEX_a"
+    path_b = f"{tmpdir}/APKINDEX_b"
+    for path in [path_a, path_b]:
+        open(path, "w").close()
+
+    # Keys with and without a path
+    cache.save("apkindex", (path_a, False), cache.fingerprint_file(path_a), 1)
+    cache.save("apkindex", (path_b, False), cache.fingerprint_file(path_b), 2)
+    cache.save("apkindex", "no_path", (1,), 3)
+    assert len(os.listdir(f"{tmpdir}/cache_parse/apkindex")) == 3
+
+    # Pruning only happens once per session and namespace
+    os.remove(path_b)
+    cache.save("apkindex", (path_a, False), cache.fingerprint_file(path_a), 4)
+    assert len(os.listdir(f"{tmpdir}/cache_parse/apkindex")) == 3
+
+    # Entry of the removed file gets pruned in the next session
+    monkeypatch.setattr(cache, "pruned", set())
+    cache.save("apkindex", (path_a, False), cache.fingerprint_file(path_a), 5)
+    assert len(os.listdir(f"{tmpdir}/cache_parse/apkindex")) == 2
+    assert cache.load("apkindex", (path_a, False),
+                     cache.fingerprint_file(path_a)) == 5
+    assert cache.load("apkindex", "no_path", (1,)) == 3
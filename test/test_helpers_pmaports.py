@@ -6,6 +6,9 @@ import sys
 
 import pmb_test  # noqa
 import pmb.build.other
+import pmb.helpers.persistent_cache
+import pmb.helpers.pmaports
+import pmb.helpers.run
 
 
 @pytest.fixture
@@ -50,3 +53,142 @@ def test_guess_main_dev(args, tmpdir):
     func = pmb.helpers.pmaports.guess_main
     assert func(args, "plasma-framework-dev") is None
     assert func(args, "plasma-randomsubpkg") == tmpdir + "/temp/plasma"
+
+
+def test_package_index(args, tmpdir, monkeypatch):
+    # Fake pmaports folder
+    tmpdir = str(tmpdir)
+    args.aports = tmpdir + "/pmaports"
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "path_base",
+                        tmpdir + "/cache_parse")
+    apkbuilds = {"main/hello": ("hello-sub", "so:libhello.so=1 hello-cmd"),
+                 "main/hello-world": ("hello-world-doc", "hello-cmd=1"),
+                 "temp/qemu": ("qemu-x86_64 qemu-aarch64", "")}
+    for aport, (subpackages, provides) in apkbuilds.items():
+        pkgname = os.path.basename(aport)
+        os.makedirs(f"{args.aports}/{aport}")
+        with open(f"{args.aports}/{aport}/APKBUILD", "w") as handle:
+            handle.write(f"pkgname={pkgname}\n"
+                         "pkgver=1\n"
+                         "pkgrel=0\n"
+                         f"subpackages=\"{subpackages}\"\n"
+                         f"provides=\"{provides}\"\n")
+    os.makedirs(f"{args.aports}/main/hello-ui")
+    with open(f"{args.aports}/main/hello-ui/APKBUILD", "w") as handle:
+        handle.write("pkgname=hello-ui\n"
+                     "pkgver=1\n"
+                     "pkgrel=0\n"
+                     "subpackages=\"$pkgname-a:a $pkgname-b:b\"\n"
+                     "a() {\n"
+                     "\tprovides=\"hello-ui-provider=1\"\n"
+                     "}\n"
+                     "b() {\n"
+                     "\tprovides=\"hello-ui-provider=1\"\n"
+                     "\tprovider_priority=10\n"
+                     "}\n")
+
+    func = pmb.helpers.pmaports.package_index
+    index = func(args)
+    path_hello = f"{args.aports}/main/hello/APKBUILD"
+    path_ui = f"{args.aports}/main/hello-ui/APKBUILD"
+    path_world = f"{args.aports}/main/hello-world/APKBUILD"
+    assert index == {"packages": {
+        "hello-sub": path_hello,
+        "so:libhello.so": path_hello,
+        "hello-ui-a": path_ui,
+        "hello-ui-b": path_ui,
+        "hello-ui-provider": path_ui,
+        "hello-world-doc": path_world,
+        "hello-cmd": path_world,
+        "qemu-x86_64": f"{args.aports}/temp/qemu/APKBUILD",
+        "qemu-aarch64": f"{args.aports}/temp/qemu/APKBUILD"}}
+
+    # find() uses the index, provides without version are ignored even if
+    # the guessed main package has them
+    find = pmb.helpers.pmaports.find
+    assert find(args, "hello-cmd") == f"{args.aports}/main/hello-world"
+    assert find(args, "hello-ui-b") == f"{args.aports}/main/hello-ui"
+    assert find(args, "qemu-aarch64") == f"{args.aports}/temp/qemu"
+    assert find(args, "qemu-riscv64") == f"{args.aports}/temp/qemu"
+    assert find(args, "missing", False) is None
+
+    # find_providers() finds the APKBUILD with the subpackages
+    providers = pmb.helpers.pmaports.find_providers(args, "hello-ui-provider")
+    assert [pkgname for pkgname, _ in providers] == ["hello-ui-b",
+                                                     "hello-ui-a"]
+
+    # New session: only modified APKBUILDs get parsed again
+    pmb.helpers.other.init_cache()
+    with open(path_hello, "a") as handle:
+        handle.write("subpackages=\"$subpackages hello-new\"\n")
+    parsed = []
+
+    def apkbuild_bulk(paths, jobs=None):
+        parsed.extend(paths)
+        return {path: pmb.parse.apkbuild(path) for path in paths}
+    monkeypatch.setattr(pmb.parse, "apkbuild_bulk", apkbuild_bulk)
+    assert func(args)["packages"]["hello-new"] == path_hello
+    assert parsed == [path_hello]
+
+
+def test_find_apkbuilds_git(args, tmpdir, monkeypatch):
+    # Fake pmaports git repository
+    tmpdir = str(tmpdir)
+    args.aports = tmpdir + "/pmaports"
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "path_base",
+                        tmpdir + "/cache_parse")
+
+    def git(*command):
+        pmb.helpers.run.user(args, ["git", "-c", "user.name=Test",
+                                    "-c", "user.email=test@localhost",
+                                    *command], args.aports)
+
+    def add_aport(aport):
+        pkgname = os.path.basename(aport)
+        os.makedirs(f"{args.aports}/{aport}")
+        with open(f"{args.aports}/{aport}/APKBUILD", "w") as handle:
+            handle.write(f"pkgname={pkgname}\npkgver=1\npkgrel=0\n"
+                         f"subpackages=\"{pkgname}-sub\"\n")
+
+    os.makedirs(args.aports)
+    git("init", "-q")
+    add_aport("main/hello")
+    add_aport("main/world")
+    add_aport(".ci/hidden")
+    git("add", "-A")
+    git("commit", "-q", "-m", "init")
+
+    func = pmb.helpers.pmaports._find_apkbuilds
+    assert list(func(args).keys()) == ["hello", "world"]
+    assert pmb.helpers.pmaports.package_index(args)["packages"] == {
+        "hello-sub": f"{args.aports}/main/hello/APKBUILD",
+        "world-sub": f"{args.aports}/main/world/APKBUILD"}
+
+    # New session: only look at the aports that git reports as changed
+    add_aport("temp/untracked")
+    git("rm", "-q", "-r", "main/world")
+    git("commit", "-q", "-m", "remove world")
+    add_aport("main/world2")
+    git("add", "main/world2")
+    git("commit", "-q", "-m", "add world2")
+    pmb.helpers.other.init_cache()
+    assert pmb.helpers.pmaports._changed_apkbuilds(args, ("0" * 40, frozenset())) \
+        is None
+
+    def iglob(*args, **kwargs):
+        raise RuntimeError("iglob should not be used")
+    monkeypatch.setattr(pmb.helpers.pmaports.glob, "iglob", iglob)
+    parsed = []
+
+    def apkbuild_bulk(paths, jobs=None):
+        parsed.extend(paths)
+        return {path: pmb.parse.apkbuild(path) for path in paths}
+    monkeypatch.setattr(pmb.parse, "apkbuild_bulk", apkbuild_bulk)
+
+    assert list(func(args).keys()) == ["hello", "untracked", "world2"]
+    assert pmb.helpers.pmaports.package_index(args)["packages"] == {
+        "hello-sub": f"{args.aports}/main/hello/APKBUILD",
+        "untracked-sub": f"{args.aports}/temp/untracked/APKBUILD",
+        "world2-sub": f"{args.aports}/main/world2/APKBUILD"}
+    assert sorted(parsed) == [f"{args.aports}/main/world2/APKBUILD",
+                              f"{args.aports}/temp/untracked/APKBUILD"]
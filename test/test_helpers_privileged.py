@@ -0,0 +1,128 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+import base64
+import os
+import pytest
+import sys
+
+import pmb_test  # noqa
+import pmb.helpers.logging
+import pmb.helpers.privileged
+import pmb.helpers.privileged_helper
+import pmb.helpers.run
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap", "init"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    request.addfinalizer(pmb.helpers.privileged.stop)
+    return args
+
+
+def test_helper_run(monkeypatch):
+    func = pmb.helpers.privileged_helper._run
+    ret = func({"cmd": ["sh", "-c", "echo test"]})
+    assert ret["code"] == 126
+
+    # Kill commands that don't write output for too long
+    monkeypatch.setattr(pmb.helpers.privileged_helper, "programs", ["sh"])
+    ret = func({"cmd": ["sh", "-c", "echo test; sleep 60"], "timeout": 0.5})
+    assert ret["timed_out"] is True
+    assert ret["code"] != 0
+    assert base64.b64decode(ret["output"]) == b"test\n"
+
+    ret = func({"cmd": ["sh", "-c", "echo $A$B"], "env": {"A": "a"},
+                "clean_env": True})
+    assert ret["code"] == 0
+    assert base64.b64decode(ret["output"]) == b"a\n"
+
+
+def test_helper_restrictions(monkeypatch, tmpdir):
+    func = pmb.helpers.privileged_helper._run
+    work = f"{tmpdir}/work"
+    os.makedirs(f"{work}/chroot_native/bin")
+    os.makedirs(f"{tmpdir}/x")
+    os.symlink("/bin/true", f"{tmpdir}/x/mkdir")
+    monkeypatch.setattr(pmb.helpers.privileged_helper, "work", work)
+
+    # Only allowed programs from the system folders
+    for cmd in [["sed", "-n", "e id", "/dev/null"],
+                [f"{tmpdir}/x/mkdir", "-p", f"{tmpdir}/a"],
+                ["chroot", "/", "/bin/sh", "-c", "true"]]:
+        assert func({"cmd": cmd})["code"] == 126
+    assert func({"cmd": ["mkdir", "-p", f"{tmpdir}/a"]})["code"] == 0
+    assert os.path.isdir(f"{tmpdir}/a")
+
+    # Only chroots in the work folder
+    for chroot in ["/", f"{tmpdir}/x", f"{work}/chroot_native/..",
+                   f"{work}/chroot_native/../../x", f"{work}/chroot_missing"]:
+        ret = func({"cmd": ["mkdir", "/test"], "chroot": chroot})
+        assert ret["code"] == 126
+        assert b"chroot not allowed" in base64.b64decode(ret["output"])
+    ret = func({"cmd": ["mkdir", "/test"], "chroot": f"{work}/chroot_native"})
+    assert b"program not allowed" in base64.b64decode(ret["output"])
+
+    # Environment variables of the dynamic linker are not passed
+    monkeypatch.setattr(pmb.helpers.privileged_helper, "programs", ["sh"])
+    ret = func({"cmd": ["sh", "-c", "echo $LD_PRELOAD"],
+                "env": {"LD_PRELOAD": "/tmp/x.so"}})
+    assert base64.b64decode(ret["output"]) == b"\n"
+
+
+def test_privileged(args, tmpdir):
+    path = f"{tmpdir}/a/b"
+    assert pmb.helpers.privileged.supported(args, ["mkdir", path])
+    assert not pmb.helpers.privileged.supported(args, ["sh", "-c", "true"])
+    assert not pmb.helpers.privileged.supported(args, ["mkdir", path],
+                                                "interactive")
+
+    # Batch, stops after the first error
+    ret = pmb.helpers.privileged.run_batch(args, [
+        {"cmd": ["mkdir", "-p", path]},
+        {"cmd": ["rmdir", f"{tmpdir}/missing"]},
+        {"cmd": ["touch", f"{path}/file"]}])
+    assert [code for code, _, _ in ret] == [0, 1]
+    assert os.path.isdir(path)
+    assert not os.path.exists(f"{path}/file")
+
+    # Through pmb.helpers.run.root()
+    helper = pmb.helpers.privileged.helper
+    assert pmb.helpers.run.root(args, ["touch", f"{path}/file"]) == 0
+    assert pmb.helpers.run.root(args, ["touch", f"{path}/file"],
+                                output_return=True) == ""
+    with pytest.raises(RuntimeError) as e:
+        pmb.helpers.run.root(args, ["rmdir", f"{tmpdir}/missing"])
+    assert str(e.value).startswith("Command failed (exit code 1)")
+    assert pmb.helpers.privileged.helper is helper
+
+
+def test_root_batch(args, tmpdir):
+    func = pmb.helpers.run.root_batch
+    path = f"{tmpdir}/a/b"
+    assert func(args, []) == 0
+
+    # Through the helper, and as one "sh -c" command without it
+    for privileged_helper in [True, False]:
+        args.privileged_helper = privileged_helper
+        assert func(args, [["mkdir", "-p", path],
+                           ["touch", f"{path}/file"]]) == 0
+        assert os.path.exists(f"{path}/file")
+
+        # Stop after the first error
+        with pytest.raises(RuntimeError) as e:
+            func(args, [["rm", f"{path}/file"],
+                        ["rmdir", f"{tmpdir}/missing"],
+                        ["rmdir", path]])
+        assert str(e.value).startswith("Command failed (exit code 1)")
+        assert not os.path.exists(f"{path}/file")
+        assert os.path.exists(path)
+
+        assert func(args, [["rmdir", f"{tmpdir}/missing"],
+                           ["rmdir", path]], check=False) == 1
+        assert os.path.exists(path)
+        func(args, [["rmdir", path], ["rmdir", f"{tmpdir}/a"]])
@@ -1,7 +1,10 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
+import pytest
+
 import pmb_test  # noqa
 import pmb.helpers.mount
+import pmb.install.blockdevice
 
 
 def test_umount_all_list(tmpdir):
@@ -23,3 +26,70 @@ def test_umount_all_list(tmpdir):
     ret = pmb.helpers.mount.umount_all_list("/test", fake_mounts)
     assert ret == ["/test/var/cache", "/test/proc", "/test/home/pmos/packages",
                    "/test/dev/loop0p2", "/test"]
+
+
+def test_mountinfo(tmpdir):
+    # Write fake mountinfo file
+    fake_mountinfo = str(tmpdir + "/mountinfo")
+    with open(fake_mountinfo, "w") as handle:
+        handle.write("23 28 0:22 / /proc rw,relatime - proc proc rw\n")
+        handle.write("40 28 8:1 / /test rw shared:1 master:2 - ext4"
+                     " /dev/sda1 rw\n")
+        handle.write("41 40 8:1 /x /test/my\\040dir rw - ext4 /dev/sda1"
+                     " rw\n")
+
+    ret = pmb.helpers.mount.mountinfo(fake_mountinfo)
+    assert ret == [("/proc", "proc"),
+                   ("/test", "/dev/sda1"),
+                   ("/test/my dir", "/dev/sda1")]
+
+
+def test_mounted(monkeypatch):
+    entries = [("/test", "/dev/sda1"),
+               ("/test/proc", "proc"),
+               ("/test/dev/loop0p2 (deleted)", "/dev/loop0p2")]
+    reads = []
+
+    def mountinfo():
+        reads.append(True)
+        return entries
+    monkeypatch.setattr(pmb.helpers.mount, "mountinfo", mountinfo)
+    monkeypatch.setattr(pmb.helpers.mount, "snapshot", None)
+    func = pmb.helpers.mount.mounted
+
+    # Batch query, the mount table is read once
+    assert func(["/test", "/test/proc", "/test/sys", "/dev/sda1"]) == \
+        {"/test", "/test/proc", "/dev/sda1"}
+    assert pmb.helpers.mount.ismount("/test/proc")
+    assert not pmb.helpers.mount.ismount("/test/sys")
+    assert pmb.helpers.mount.umount_all_list("/test") == \
+        ["/test/proc", "/test/dev/loop0p2", "/test"]
+    assert len(reads) == 1
+
+    # Read again after mount and umount commands
+    pmb.helpers.mount.invalidate([["mkdir", "-p", "/test/sys"]])
+    assert func(["/test/sys"]) == set()
+    assert len(reads) == 1
+    entries.append(("/test/sys", "sysfs"))
+    pmb.helpers.mount.invalidate([["mkdir", "-p", "/test/sys"],
+                                  ["mount", "-t", "sysfs", "sysfs",
+                                   "/test/sys"]])
+    assert func(["/test/sys"]) == {"/test/sys"}
+    assert len(reads) == 2
+
+
+def test_mount_disk_mounted(monkeypatch, tmpdir):
+    disk = f"{tmpdir}/sdb"
+    for path in [disk, f"{disk}1", f"{disk}2"]:
+        open(path, "w").close()
+    entries = []
+    monkeypatch.setattr(pmb.helpers.mount, "mountinfo", lambda: entries)
+    monkeypatch.setattr(pmb.helpers.mount, "snapshot", None)
+    assert pmb.helpers.mount.mounted([f"{disk}2"]) == set()
+
+    # Mounted by the host system after the snapshot was taken
+    entries.append(("/media/sdb2", f"{disk}2"))
+    with pytest.raises(RuntimeError) as e:
+        pmb.install.blockdevice.mount_disk(None, disk)
+    assert str(e.value) == f"{disk}2 is mounted! Will not attempt to" \
+        " format this!"
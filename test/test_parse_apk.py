@@ -0,0 +1,120 @@
+# Copyright 2023 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+import base64
+import gzip
+import hashlib
+import io
+import pytest
+import sys
+import tarfile
+
+import pmb_test  # noqa
+import pmb.helpers.logging
+import pmb.parse.apk
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap", "init"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    return args
+
+
+def tar_segment(files, cut=True):
+    """Create a tar archive like abuild does. The signature and control
+    segments are cut, they don't have the end of archive blocks."""
+    handle = io.BytesIO()
+    with tarfile.open(fileobj=handle, mode="w", format=tarfile.GNU_FORMAT) \
+            as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+                continue
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        size = handle.tell()
+    return handle.getvalue()[:size] if cut else handle.getvalue()
+
+
+def write_apk(path, pkginfo):
+    control = gzip.compress(tar_segment({".PKGINFO": pkginfo.encode()}))
+    with open(path, "wb") as handle:
+        handle.write(gzip.compress(tar_segment({".SIGN.RSA.test.pub":
+                                                b"signature"})))
+        handle.write(control)
+        handle.write(gzip.compress(tar_segment({"usr": None,
+                                                "usr/bin": None,
+                                                "usr/bin/hello": b"hello"},
+                                               False)))
+    return "Q1" + base64.b64encode(hashlib.sha1(control).digest()).decode()
+
+
+pkginfo = """# Generated by abuild 3.11.0
+pkgname = hello
+pkgver = 1-r0
+arch = x86_64
+origin = hello-src
+depend = so:libc.musl-x86_64.so.1
+depend = busybox
+provides = cmd:hello=1-r0
+"""
+
+
+def test_parse_pkginfo():
+    ret = pmb.parse.apk.parse_pkginfo(pkginfo)
+    assert ret["pkgname"] == "hello"
+    assert ret["pkgver"] == "1-r0"
+    assert ret["origin"] == "hello-src"
+    assert ret["depend"] == ["so:libc.musl-x86_64.so.1", "busybox"]
+    assert ret["provides"] == ["cmd:hello=1-r0"]
+    assert ret["replaces"] == []
+
+
+def test_read(tmpdir):
+    path = f"{tmpdir}/hello-1-r0.apk"
+    checksum = write_apk(path, pkginfo)
+
+    ret = pmb.parse.apk.read(path)
+    assert ret["pkgname"] == "hello"
+    assert ret["checksum"] == checksum
+    assert "files" not in ret
+
+    ret = pmb.parse.apk.read(path, True)
+    assert ret["files"] == ["usr", "usr/bin", "usr/bin/hello"]
+
+
+def test_read_repo(args, tmpdir, monkeypatch):
+    for i in range(3):
+        write_apk(f"{tmpdir}/hello{i}-1-r0.apk",
+                  pkginfo.replace("hello", f"hello{i}"))
+    expected = {f"hello{i}-1-r0.apk": f"hello{i}" for i in range(3)}
+
+    # Sequential and with a process pool
+    for min_apks in [32, 1]:
+        monkeypatch.setattr(pmb.parse.apk, "read_repo_min_apks", min_apks)
+        ret = pmb.parse.apk.read_repo(str(tmpdir), jobs=2)
+        assert {key: apk["pkgname"] for key, apk in ret.items()} == expected
+
+
+def test_read_repo_truncated(args, tmpdir, monkeypatch):
+    write_apk(f"{tmpdir}/hello-1-r0.apk", pkginfo)
+    with open(f"{tmpdir}/hello-1-r0.apk", "rb") as handle:
+        data = handle.read()
+    with open(f"{tmpdir}/broken-1-r0.apk", "wb") as handle:
+        handle.write(data[:len(data) // 3])
+    with open(f"{tmpdir}/empty-1-r0.apk", "wb"):
+        pass
+
+    # Broken apks don't stop reading the others
+    for min_apks in [32, 1]:
+        monkeypatch.setattr(pmb.parse.apk, "read_repo_min_apks", min_apks)
+        ret = pmb.parse.apk.read_repo(str(tmpdir), jobs=2)
+        assert ret["broken-1-r0.apk"] is None
+        assert ret["empty-1-r0.apk"] is None
+        assert ret["hello-1-r0.apk"]["pkgname"] == "hello"
@@ -1,10 +1,13 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
+import os
 import pytest
+import shutil
 import sys
 
 import pmb_test
 import pmb_test.const
+import pmb.helpers.persistent_cache
 import pmb.parse._apkbuild
 
 
@@ -166,3 +169,151 @@ def test_weird_pkgver(args):
         "/APKBUILD.weird-pkgver")
     apkbuild = pmb.parse.apkbuild(path, check_pkgname=False, check_pkgver=True)
     assert apkbuild["pkgver"] == "3.0.0_alpha369-r0"
+
+
+def test_persistent_cache(args, tmpdir, monkeypatch):
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "path_base",
+                        str(tmpdir) + "/cache_parse")
+    testdata = pmb_test.const.testdata
+    path = str(tmpdir) + "/APKBUILD"
+    shutil.copy(testdata + "/apkbuild/APKBUILD.subpackages", path)
+
+    # Fill the persistent cache
+    apkbuild = pmb.parse.apkbuild(path, check_pkgname=False)
+    assert "custom" in apkbuild["subpackages"]
+
+    # New session: use the persistent cache, even if only the timestamp of
+    # the file has changed
+    def fake_parse_attributes(*args, **kwargs):
+        raise RuntimeError("persistent cache was not used")
+    monkeypatch.setattr(pmb.parse._apkbuild, "_parse_attributes",
+                        fake_parse_attributes)
+    pmb.helpers.other.cache["apkbuild"] = {}
+    assert pmb.parse.apkbuild(path, check_pkgname=False) == apkbuild
+    pmb.helpers.other.cache["apkbuild"] = {}
+    os.utime(path, (1, 1))
+    assert pmb.parse.apkbuild(path, check_pkgname=False) == apkbuild
+
+    # Modified file
+    pmb.helpers.other.cache["apkbuild"] = {}
+    with open(path, "a", encoding="utf-8") as handle:
+        handle.write("# modified\n")
+    with pytest.raises(RuntimeError) as e:
+        pmb.parse.apkbuild(path, check_pkgname=False)
+    assert "persistent cache was not used" in str(e.value)
+
+    # Schema changed
+    monkeypatch.undo()
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "path_base",
+                        str(tmpdir) + "/cache_parse")
+    pmb.parse.apkbuild(path, check_pkgname=False)
+    attributes = dict(pmb.config.apkbuild_attributes)
+    attributes["_pmb_test"] = {}
+    monkeypatch.setattr(pmb.config, "apkbuild_attributes", attributes)
+    pmb.helpers.other.cache["apkbuild"] = {}
+    assert "_pmb_test" in pmb.parse.apkbuild(path, check_pkgname=False)
+
+    # Clearing the cache also removes the persistent cache entry
+    assert pmb.helpers.persistent_cache.delete(
+        "apkbuild", os.path.realpath(path)) is True
+    pmb.parse.apkbuild(path, check_pkgname=False)
+    pmb.parse._apkbuild.clear_cache(path)
+    assert path not in pmb.helpers.other.cache["apkbuild"]
+    assert pmb.helpers.persistent_cache.delete(
+        "apkbuild", os.path.realpath(path)) is False
+
+
+def test_apkbuild_bulk(args, tmpdir, monkeypatch):
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "path_base",
+                        str(tmpdir) + "/cache_parse")
+    paths = []
+    for i in range(pmb.parse._apkbuild.apkbuild_bulk_min_paths + 8):
+        pkgname = f"hello-world-{i}"
+        os.makedirs(f"{tmpdir}/{pkgname}")
+        path = f"{tmpdir}/{pkgname}/APKBUILD"
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(f"pkgname={pkgname}\n"
+                         f"pkgver=1.{i}\n"
+                         "pkgrel=0\n"
+                         "arch=\"all\"\n"
+                         f"subpackages=\"$pkgname-doc {pkgname}-dev\"\n")
+        paths.append(path)
+
+    # Parse in parallel, results are in the session cache
+    pmb.helpers.other.cache["apkbuild"] = {}
+    ret = pmb.parse.apkbuild_bulk(paths, 4)
+    assert list(ret.keys()) == paths
+    assert ret[paths[3]]["pkgver"] == "1.3"
+    assert "hello-world-3-dev" in ret[paths[3]]["subpackages"]
+    for path in paths:
+        assert pmb.helpers.other.cache["apkbuild"][path] is ret[path]
+
+    # Same results as parsing sequentially
+    pmb.helpers.other.cache["apkbuild"] = {}
+    for path in paths:
+        pmb.helpers.persistent_cache.delete("apkbuild", path)
+        assert pmb.parse.apkbuild(path) == ret[path]
+
+
+def test_function_ranges(args):
+    lines = ["pkgname=test\n",
+             "build() {\n",
+             "\tmake\n",
+             "}\n",
+             "\n",
+             "package() { :; }\n",
+             "custom() {\n",
+             "\tpkgdesc=\"custom\"\n",
+             "}\n",
+             "custom() {\n",
+             "}\n",
+             "unfinished() {\n",
+             "\ttrue\n"]
+    func = pmb.parse._apkbuild.function_ranges
+    assert func(lines) == {"build": (2, 3),
+                           "package": (6, 8),
+                           "custom": (7, 8),
+                           "unfinished": (12, None)}
+
+    # function_body() uses the same ranges
+    testdata = pmb_test.const.testdata
+    path = testdata + "/apkbuild/APKBUILD.linux-envkernel-test"
+    body = pmb.parse.function_body(path, "package")
+    assert body[0].startswith("\tinstall -Dm644 ")
+    assert path in pmb.helpers.other.cache["apkbuild_functions"]
+    assert pmb.parse.function_body(path, "missing") == []
+
+
+def test_function_body_modified(args, tmpdir):
+    path = f"{tmpdir}/APKBUILD"
+    with open(path, "w") as handle:
+        handle.write("build() {\n\tmake\n}\n")
+    assert pmb.parse.function_body(path, "build") == ["\tmake\n"]
+
+    # Editing the file in the same session invalidates the cached ranges
+    with open(path, "w") as handle:
+        handle.write("prepare() {\n\ttrue\n}\nbuild() {\n\tmake all\n}\n")
+    assert pmb.parse.function_body(path, "build") == ["\tmake all\n"]
+
+
+def test_function_ranges_reused(args, monkeypatch):
+    testdata = pmb_test.const.testdata
+    path = testdata + "/apkbuild/APKBUILD.subpackages"
+    pmb.helpers.other.cache["apkbuild"].pop(path, None)
+    pmb.helpers.other.cache["apkbuild_functions"].pop(path, None)
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "load",
+                        lambda *args: None)
+
+    calls = []
+    func = pmb.parse._apkbuild.function_ranges
+
+    def function_ranges(lines):
+        calls.append(lines)
+        return func(lines)
+    monkeypatch.setattr(pmb.parse._apkbuild, "function_ranges",
+                        function_ranges)
+
+    # Parsing the APKBUILD and reading a function body index it only once
+    assert pmb.parse.apkbuild(path, check_pkgname=False)["subpackages"]
+    pmb.parse.function_body(path, "build")
+    assert len(calls) == 1
@@ -2,13 +2,18 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """ Test pmb.parse.apkindex """
 import collections
+import io
 import os
+import pickle
 import pytest
 import sys
+import tarfile
+import time
 
 import pmb_test  # noqa
 import pmb.parse.apkindex
 import pmb.helpers.logging
+import pmb.helpers.persistent_cache
 import pmb.helpers.repo
 
 
@@ -330,6 +335,43 @@ def test_providers_highest_version(args, monkeypatch):
     assert providers["test"]["version"] == "3"
 
 
+def test_provider_index(args, monkeypatch):
+    parsed = []
+
+    # Fake parse function
+    def return_fake_parse(path):
+        parsed.append(path)
+        version_mapping = {"i0": "2", "i1": "3", "i2": "3"}
+        package_block = {"pkgname": "test", "version": version_mapping[path],
+                         "index": path}
+        other_block = {"pkgname": "other", "version": "1"}
+        return {"test": {"test": package_block},
+                "virtual": {"test": package_block, "other": other_block}}
+    monkeypatch.setattr(pmb.parse.apkindex, "parse", return_fake_parse)
+
+    # Highest version wins, with the same version the last index wins
+    func = pmb.parse.apkindex.provider_index
+    index = func(["i0", "i1", "i2"])
+    assert index["test"]["test"]["index"] == "i2"
+    assert list(index["virtual"].keys()) == ["test", "other"]
+    assert parsed == ["i0", "i1", "i2"]
+
+    # Second call uses the cache
+    assert func(["i0", "i1", "i2"]) is index
+    assert parsed == ["i0", "i1", "i2"]
+
+    # Providers of a package are a lookup in the merged index
+    providers = pmb.parse.apkindex.providers(args, "virtual",
+                                             indexes=["i0", "i1", "i2"])
+    assert list(providers.keys()) == ["test", "other"]
+    assert parsed == ["i0", "i1", "i2"]
+
+    # Clearing the cache of one APKINDEX invalidates the merged index
+    pmb.parse.apkindex.clear_cache("i1")
+    func(["i0", "i1", "i2"])
+    assert parsed == ["i0", "i1", "i2"] * 2
+
+
 def test_provider_highest_priority(args, monkeypatch):
     # Verify that it picks the provider with highest priority
     func = pmb.parse.apkindex.provider_highest_priority
@@ -393,3 +435,208 @@ def test_package(args, monkeypatch):
 
     # No provider (without must_exist)
     assert func(args, pkgname, must_exist=False) is None
+
+
+def test_parse_persistent_cache(args, tmpdir, monkeypatch):
+    # Use a temporary folder for the persistent cache
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "path_base",
+                        str(tmpdir) + "/cache_parse")
+    path_orig = pmb.config.pmb_src + "/test/testdata/apkindex/no_error"
+    path = str(tmpdir) + "/APKINDEX"
+    pmb.helpers.run.user(args, ["cp", path_orig, path])
+
+    # Fill the persistent cache
+    ret = pmb.parse.apkindex.parse(path)
+    assert "curl" in ret
+
+    # Parse again in a new session: the file must not be parsed again
+    pmb.helpers.other.cache["apkindex"] = {}
+
+    def fake_parse_uncached(path, multiple_providers):
+        raise RuntimeError("persistent cache was not used")
+    monkeypatch.setattr(pmb.parse.apkindex, "_parse_uncached",
+                        fake_parse_uncached)
+    assert pmb.parse.apkindex.parse(path) == ret
+
+    # Clearing the cache must also delete the persistent cache entry
+    pmb.parse.apkindex.clear_cache(path)
+    with pytest.raises(RuntimeError) as e:
+        pmb.parse.apkindex.parse(path)
+    assert "persistent cache was not used" in str(e.value)
+    monkeypatch.undo()
+
+    # Modifying the file must invalidate the persistent cache entry
+    monkeypatch.setattr(pmb.helpers.persistent_cache, "path_base",
+                        str(tmpdir) + "/cache_parse")
+    pmb.parse.apkindex.parse(path)
+    pmb.helpers.other.cache["apkindex"] = {}
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write("")
+    assert pmb.parse.apkindex.parse(path) == {}
+
+
+def parse_next_block_baseline(path, lines, start):
+    """Frozen copy of parse_next_block() before it was rewritten to use
+    block_keys and read_blocks(), for test_parse_blocks_benchmark()."""
+    ret = {}
+    mapping = {
+        "A": "arch",
+        "D": "depends",
+        "o": "origin",
+        "P": "pkgname",
+        "p": "provides",
+        "k": "provider_priority",
+        "t": "timestamp",
+        "V": "version",
+    }
+    end_of_block_found = False
+    for i in range(start[0], len(lines)):
+        # Check for empty line
+        start[0] = i + 1
+        line = lines[i]
+        if not isinstance(line, str):
+            line = line.decode()
+        if line == "\n":
+            end_of_block_found = True
+            break
+
+        # Parse keys from the mapping
+        for letter, key in mapping.items():
+            if line.startswith(letter + ":"):
+                if key in ret:
+                    raise RuntimeError(
+                        "Key " + key + " (" + letter + ":) specified twice"
+                        " in block: " + str(ret) + ", file: " + path)
+                ret[key] = line[2:-1]
+
+    # Format and return the block
+    if end_of_block_found:
+        # Check for required keys
+        for key in ["arch", "pkgname", "version"]:
+            if key not in ret:
+                raise RuntimeError(f"Missing required key '{key}' in block "
+                                   f"{ret}, file: {path}")
+
+        # Format optional lists
+        for key in ["provides", "depends"]:
+            if key in ret and ret[key] != "":
+                # Ignore all operators for now
+                values = ret[key].split(" ")
+                ret[key] = []
+                for value in values:
+                    for operator in [">", "=", "<", "~"]:
+                        if operator in value:
+                            value = value.split(operator)[0]
+                            break
+                    ret[key].append(value)
+            else:
+                ret[key] = []
+        return ret
+
+    # No more blocks
+    elif ret != {}:
+        raise RuntimeError("Last block in " + path + " does not end"
+                           " with a new line! Delete the file and"
+                           " try again. Last block: " + str(ret))
+    return None
+
+
+def test_block_list():
+    func = pmb.parse.apkindex.block_list
+    assert func(None) == ()
+    assert func("so:libc.musl-x86_64.so.1 cmd:curl=8.5.0-r0 foo>=1") == \
+        ("so:libc.musl-x86_64.so.1", "cmd:curl", "foo")
+
+    # Same as the previous implementation, which checked the operators in
+    # this order
+    assert func("foo<=1 bar<2 baz~1 qux>1") == ("foo<", "bar", "baz", "qux")
+
+
+@pmb_test.benchmark
+def test_parse_blocks_benchmark(tmpdir):
+    """Compare read_blocks() with the previous implementation (reading all
+    lines, then parse_next_block_baseline()), using a synthetic APKINDEX
+    with 20k packages."""
+    path = str(tmpdir) + "/APKINDEX.tar.gz"
+    blocks = []
+    for i in range(20000):
+        blocks.append(f"C:Q1{i:026d}=\n"
+                      f"P:package-{i}\n"
+                      f"V:1.{i % 100}.{i % 7}-r{i % 3}\n"
+                      "A:x86_64\n"
+                      "S:12345\n"
+                      "I:67890\n"
+                      f"T:Synthetic package number {i}\n"
+                      "U:https://postmarketos.org\n"
+                      "L:GPL-3.0-or-later\n"
+                      f"o:origin-{i // 4}\n"
+                      "m:Maintainer <maintainer@example.org>\n"
+                      "t:1700000000\n"
+                      "c:0123456789abcdef0123456789abcdef01234567\n"
+                      f"D:so:libc.musl-x86_64.so.1 package-{i // 2}>=1.0"
+                      f" !conflict-{i} pc:foo~{i}\n"
+                      f"p:cmd:command-{i}=1.0 so:libpackage{i}.so.1=1\n"
+                      "\n")
+    data = "".join(blocks).encode("utf-8")
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("APKINDEX")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    def parse_baseline():
+        with tarfile.open(path, "r:gz") as tar:
+            with tar.extractfile(tar.getmember("APKINDEX")) as handle:
+                lines = handle.readlines()
+        ret = []
+        start = [0]
+        while True:
+            block = parse_next_block_baseline(path, lines, start)
+            if not block:
+                return ret
+            ret.append(block)
+
+    # Best of three runs each
+    times_baseline = []
+    times_new = []
+    for _ in range(3):
+        time_start = time.perf_counter()
+        expected = parse_baseline()
+        times_baseline.append(time.perf_counter() - time_start)
+
+        time_start = time.perf_counter()
+        ret = pmb.parse.apkindex.parse_blocks(path)
+        times_new.append(time.perf_counter() - time_start)
+
+    # Same results, and at least 1.5x as fast
+    assert len(ret) == 20000
+    assert [dict(block, depends=list(block["depends"]),
+                 provides=list(block["provides"])) for block in ret] == \
+        expected
+    assert min(times_new) * 1.5 < min(times_baseline)
+
+
+def test_package_record():
+    path = pmb.config.pmb_src + "/test/testdata/apkindex/virtual_package"
+    blocks = pmb.parse.apkindex.parse_blocks(path)
+    record = blocks[0]
+    assert isinstance(record, pmb.parse.apkindex.PackageRecord)
+
+    # Mapping interface
+    assert record["pkgname"] == "hello-world"
+    assert record.get("provider_priority") is None
+    assert "origin" in record
+    assert "origin" not in blocks[1]
+    with pytest.raises(KeyError):
+        record["provider_priority"]
+    with pytest.raises(KeyError):
+        record["__class__"]
+
+    # Read-only
+    with pytest.raises(TypeError):
+        record["pkgname"] = "test"
+    with pytest.raises(AttributeError):
+        record.pkgname = "test"
+
+    # Same data as before in the persistent cache
+    assert pickle.loads(pickle.dumps(record)) == record
+    assert record.as_dict()["depends"] == ["so:libc.musl-x86_64.so.1"]
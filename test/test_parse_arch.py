@@ -1,7 +1,9 @@
 # Copyright 2024 Stefan "Newbyte" Hansson
 # SPDX-License-Identifier: GPL-3.0-or-later
+import argparse
 import pytest
 
+import pmb.config
 import pmb.parse.arch
 
 
@@ -13,3 +15,12 @@ def test_machine_type_to_alpine() -> None:
         assert e == f"Can not map machine type {fake_machine_type} to the right Alpine Linux architecture"
 
     assert pmb.parse.arch.machine_type_to_alpine("armv7l") == "armv7"
+
+
+def test_from_chroot_suffix_overlay() -> None:
+    args = argparse.Namespace(device="qemu-amd64")
+    arch_native = pmb.config.arch_native
+    func = pmb.parse.arch.from_chroot_suffix
+    assert func(args, "native-overlay") == arch_native
+    assert func(args, "buildroot_armv7-overlay") == "armv7"
+    assert func(args, "buildroot_armv7-2-overlay") == "armv7"
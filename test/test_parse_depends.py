@@ -165,3 +165,42 @@ def test_recurse(args, monkeypatch):
     result = ["test", "so:libtest.so.1", "libtest", "libtest_depend",
               "!libtest_conflict"]
     assert func(args, pkgnames) == result
+
+
+def test_recurse_cache(args, monkeypatch):
+    monkeypatch.setattr(pmb.parse.depends, "package_from_aports",
+                        return_none)
+    fingerprint = ["first"]
+    monkeypatch.setattr(pmb.parse.depends, "recurse_fingerprint",
+                        lambda args, suffix: fingerprint[0])
+
+    # Long chain of depends, with one provider that will be installed anyway
+    depends = {f"pkg{i}": [f"pkg{i + 1}", "so:lib"] for i in range(2000)}
+    depends["pkg2000"] = ["lib-b"]
+    calls = []
+
+    def package_from_index(args, pkgname, install, aport, suffix):
+        calls.append(pkgname)
+        if pkgname == "so:lib":
+            # package_provider() picks a provider that gets installed anyway
+            pkgname = "lib-b" if "lib-b" in install else "lib-a"
+        return {"pkgname": pkgname, "depends": depends.get(pkgname, [])}
+    monkeypatch.setattr(pmb.parse.depends, "package_from_index",
+                        package_from_index)
+
+    func = pmb.parse.depends.recurse
+    result = func(args, ["pkg0"])
+    assert result[:3] == ["pkg0", "pkg1", "lib-a"]
+    assert result[-2:] == ["pkg2000", "lib-b"]
+    assert len(result) == 2003
+
+    # Cached result
+    count = len(calls)
+    result.append("modified by caller")
+    assert func(args, ["pkg0"]) == result[:-1]
+    assert len(calls) == count
+
+    # Fingerprint changed
+    fingerprint[0] = "second"
+    assert func(args, ["pkg0"]) == result[:-1]
+    assert len(calls) == count * 2
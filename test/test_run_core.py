@@ -1,10 +1,16 @@
 # Copyright 2023 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 """ Test pmb.helpers.run_core """
+import io
+import os
+import pty
 import pytest
 import re
+import select
+import signal
 import subprocess
 import sys
+import threading
 import time
 
 import pmb_test  # noqa
@@ -122,6 +128,75 @@ def test_foreground_pipe(args):
     assert len(child_procs) == 0
 
 
+def test_foreground_pipe_process_group(args, monkeypatch):
+    func = pmb.helpers.run_core.foreground_pipe
+    cmd = ["sh", "-c", "ps -o pgid= -p $$"]
+
+    # Own process group without a terminal, so the command can be killed as
+    # a whole
+    monkeypatch.setattr(pmb.helpers.run_core, "has_terminal", lambda: False)
+    ret = func(args, cmd, output_return=True)
+    assert int(ret[1]) != os.getpgid(0)
+
+    # Same process group as pmbootstrap with output to stdout or with a
+    # terminal, so it can still ask for passwords on the terminal
+    ret = func(args, cmd, output_to_stdout=True, output_return=True)
+    assert int(ret[1]) == os.getpgid(0)
+    monkeypatch.setattr(pmb.helpers.run_core, "has_terminal", lambda: True)
+    ret = func(args, cmd, output_return=True)
+    assert int(ret[1]) == os.getpgid(0)
+
+
+def test_foreground_pipe_terminal(args):
+    """A command that reads from the terminal doesn't get stopped."""
+    pid, master = pty.fork()
+    if not pid:
+        # Child with the pty as controlling terminal
+        cmd = ["sh", "-c", "read line < /dev/tty; echo \"got: $line\""]
+        ret = pmb.helpers.run_core.foreground_pipe(args, cmd,
+                                                   output_return=True)
+        os.write(1, ret[1].encode())
+        os._exit(ret[0])
+
+    os.write(master, b"password\n")
+    output = b""
+    time_end = time.perf_counter() + 10
+    while time.perf_counter() < time_end:
+        if not select.select([master], [], [], 0.1)[0]:
+            continue
+        try:
+            data = os.read(master, 1024)
+        except OSError:
+            break
+        if not data:
+            break
+        output += data
+    else:
+        os.kill(pid, signal.SIGKILL)
+    os.close(master)
+    _, status = os.waitpid(pid, 0)
+    assert b"got: password" in output
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+
+def test_process_tree():
+    func = pmb.helpers.run_core.process_tree
+
+    # Process with a child in a new session, which is in its own group
+    process = subprocess.Popen(["sh", "-c", "setsid sleep 10 & wait"])
+    time.sleep(0.2)
+    tree = func(process.pid)
+    for pid in tree:
+        os.kill(pid, signal.SIGKILL)
+    process.wait()
+    assert len(tree) == 2
+    assert tree[process.pid] == os.getpgid(0)
+    assert len(set(tree.values())) == 2
+
+    # Process that does not exist
+    assert func(process.pid) == {}
+
+
 def test_foreground_tui():
     func = pmb.helpers.run_core.foreground_tui
     assert func(["echo", "test"]) == 0
@@ -167,3 +242,80 @@ def test_sudo_timer(args):
     out = pmb.helpers.run.root(args, ["whoami"])
 
     assert out == 0
+
+
+def test_sudo_timer_paused(monkeypatch):
+    func = pmb.helpers.run_core.sudo_timer_paused
+
+    # Sudo timer not started
+    with func():
+        assert pmb.helpers.run_core.sudo_timer is None
+    assert pmb.helpers.run_core.sudo_timer is None
+
+    # The timer thread is gone while forking, and gets started again
+    timer = threading.Timer(interval=60, function=lambda: None)
+    timer.start()
+    monkeypatch.setattr(pmb.helpers.run_core, "sudo_timer", timer)
+    with func():
+        assert not timer.is_alive()
+        assert pmb.helpers.run_core.sudo_timer is None
+        with func():
+            pass
+        assert pmb.helpers.run_core.sudo_timer is None
+    timer = pmb.helpers.run_core.sudo_timer
+    assert timer.is_alive()
+    timer.cancel()
+
+
+def test_pipe_read_flush(args, monkeypatch):
+    """The log gets flushed while a process is silent, not only when it
+    writes more output or exits."""
+    class Log:
+        def __init__(self):
+            self.buffer = io.BytesIO()
+            self.flushed = []
+
+        def flush(self):
+            self.flushed.append(self.buffer.getvalue())
+
+    log = Log()
+    monkeypatch.setattr(pmb.helpers.logging, "logfd", log)
+    monkeypatch.setattr(pmb.helpers.run_core, "pipe_read_flush_interval",
+                        0.1)
+    monkeypatch.setattr(pmb.helpers.run_core, "pipe_read_flushed",
+                        time.perf_counter())
+    cmd = ["sh", "-c", "printf prompt; sleep 0.5; printf done"]
+    assert pmb.helpers.run_core.core(args, "flush", cmd) == 0
+    assert log.flushed[0] == b"prompt"
+    assert log.flushed[-1] == b"promptdone"
+
+
+@pmb_test.benchmark
+def test_core_benchmark(args, monkeypatch):
+    """Pipe 1 GiB of output through core(), to measure the throughput of
+    foreground_pipe() and pipe_read()."""
+    size = 1024 * 1024 * 1024
+    cmd = ["sh", "-c", f"yes 'line of build output' | head -c {size}"]
+
+    # Don't fill up the log of the testsuite
+    with open("/dev/null", "w") as handle:
+        monkeypatch.setattr(pmb.helpers.logging, "logfd", handle)
+        time_start = time.perf_counter()
+        ret = pmb.helpers.run_core.core(args, "benchmark", cmd, output="log")
+        time_log = time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        out = pmb.helpers.run_core.core(args, "benchmark", cmd, output="log",
+                                        output_return=True)
+        time_return = time.perf_counter() - time_start
+
+    print(f"1 GiB through core(): {time_log:.2f}s,"
+          f" {time_return:.2f}s with output_return")
+    assert ret == 0
+    assert len(out) == size
+    assert out.startswith("line of build output\n")
+
+    # Copying the output must not be the bottleneck of builds
+    # (at least 100 MiB/s)
+    assert size / time_log > 100 * 1024 * 1024
+    assert size / time_return > 100 * 1024 * 1024
@@ -68,3 +68,26 @@ def test_version_check_string():
 
     assert func("5.2.0_rc3", "<5.2.0") is False
     assert func("5.2.0_rc3", ">=5.2.0") is True
+
+
+def test_version_key():
+    func = pmb.parse.version.key
+    assert func("1.2-r3") is func("1.2-r3")
+    assert func("1.2-r3")[-1][1] == pmb.parse.version.token_value("end")
+    assert func("1.2--r3")[-1][1] == pmb.parse.version.token_value("invalid")
+
+    # Results stay the same, even where the order is not strict
+    compare = pmb.parse.version.compare
+    assert compare("1_git", "1") == 0
+    assert compare("1_p", "1") == 0
+    assert compare("1_git", "1_p") == -1
+    assert compare("1_rc1", "1") == -1
+
+
+def test_version_sort_highest():
+    versions = ["1.2-r0", "1.10-r0", "1.2_rc1-r0", "1.2-r1", "1.2a-r0"]
+    expected = ["1.2_rc1-r0", "1.2-r0", "1.2-r1", "1.2a-r0", "1.10-r0"]
+    assert pmb.parse.version.sort(versions) == expected
+    assert pmb.parse.version.sort(versions, True) == expected[::-1]
+    assert pmb.parse.version.highest(versions) == "1.10-r0"
+    assert pmb.parse.version.highest([]) is None